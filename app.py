@@ -1,130 +1,758 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, Request, current_app, render_template, request, jsonify, send_file, send_from_directory, g, url_for
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_content_range_header
 from flask_cors import CORS
 import os
-import base64
 import io
 from PIL import Image
+import hashlib
 import json
+import mimetypes
+import secrets
+import time
 from datetime import datetime
-from services.gemini_service import GeminiService
+from services.call_guard import CallGuard
+from services.gemini_service import GeminiService, GeminiResponseCache, StubGenerativeModel
+from services.camera_service import SITH_FILTER_PRESETS, CameraService, MaskCompositor, decode_data_url, encode_data_url
+from services.animation_service import ANIMATED_FORMATS, FORMAT_EXTENSIONS as ANIMATION_EXTENSIONS, \
+    VIDEO_FORMATS, AnimationService, stored_output
+from services.derivative_service import DerivativeService
+from services.frame_cache import FrameCache
+from services.image_executor import ImageExecutor, PooledCameraService
+from services.job_queue import JobQueue, QueueFull
+from services.mask_registry import MANIFEST_NAME as MASK_MANIFEST_NAME, MaskRegistry
+from services.model_store import ModelRejected, ModelStore, UploadSessionConflict
+from services.photo_index import PhotoIndex
+from services.preview_service import BOUNDARY as PREVIEW_BOUNDARY, PreviewService
+from services.photo_store import content_type, create_photo_store, delete_photo as delete_stored_photo, migrate_flat_photos
+from services.storage_maintenance import StorageMaintenance
+from services.static_assets import StaticAssets
+from services.upload_stream import UploadTooLarge, stream_to_tempfile
+from services.lazy import lazy_service
+from services.metrics import REGISTRY, TimingLogger, begin_request_stages, end_request_stages, timed
 from config import Config
 
+# Endpoints whose bodies may exceed MAX_CONTENT_LENGTH, mapped to their own limit
+LARGE_BODY_LIMITS = {
+    'upload_model': 'MODEL_MAXIMUM_BYTES',
+    'append_model_upload': 'MODEL_MAXIMUM_BYTES',
+    'create_burst': 'BURST_MAX_BYTES',
+}
+
+
+class PhotoboothRequest(Request):
+    """Request with per-endpoint body limits (Flask 3.0 only has MAX_CONTENT_LENGTH)"""
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint in LARGE_BODY_LIMITS:
+            return current_app.config.get(LARGE_BODY_LIMITS[self.endpoint])
+        return super().max_content_length
+
+
 app = Flask(__name__)
+app.request_class = PhotoboothRequest
 app.config.from_object(Config)
 CORS(app)
 
-# Initialize services
-gemini_service = GeminiService(app.config['GEMINI_API_KEY'])
+# Services are built on first use so cold starts (e.g. serverless
+# lambdas serving only the index page or /api/masks) don't pay for
+# model clients, OpenCV or mask decoding they never touch
+@lazy_service
+def get_gemini_service():
+    return GeminiService(
+        app.config['GEMINI_API_KEY'],
+        cache=GeminiResponseCache(
+            app.config['GEMINI_CACHE_DIR'],
+            max_entries=app.config['GEMINI_CACHE_SIZE'],
+            ttl=app.config['GEMINI_CACHE_TTL']
+        ),
+        perceptual_cache_keys=app.config['GEMINI_CACHE_PERCEPTUAL'],
+        model=StubGenerativeModel(
+            latency=app.config['GEMINI_STUB_LATENCY'],
+            error=app.config['GEMINI_STUB_ERROR']
+        ) if app.config['GEMINI_USE_STUB'] else None,
+        guard=CallGuard(
+            rate=app.config['GEMINI_RATE_LIMIT'],
+            burst=app.config['GEMINI_RATE_BURST'],
+            max_concurrency=app.config['GEMINI_MAX_CONCURRENCY'],
+            failure_threshold=app.config['GEMINI_BREAKER_FAILURES'],
+            reset_timeout=app.config['GEMINI_BREAKER_RESET'],
+            slow_call_seconds=app.config['GEMINI_SLOW_CALL_SECONDS'],
+            call_timeout=app.config.get('GEMINI_CALL_TIMEOUT')
+        ),
+        fallback=_local_ai_fallback
+    )
+
+def _local_ai_fallback(image_bytes, mask_id):
+    """Degraded AI path: the local Sith filter, returned as a frame handle"""
+    camera_service = get_camera_service()
+    image = camera_service.process_image_bytes(image_bytes)
+    if image is None:
+        return None
+    filter_type = mask_id if mask_id in SITH_FILTER_PRESETS else app.config['AI_FALLBACK_FILTER']
+    result_bytes = camera_service.encode_image_bytes(camera_service.apply_sith_filter(image, filter_type))
+    if not result_bytes:
+        return None
+    result_id = get_frame_cache().put(result_bytes)
+    return {'fallback_filter': filter_type, 'result_id': result_id, 'result_url': _frame_url(result_id)}
+
+@lazy_service
+def get_ai_job_queue():
+    return JobQueue(
+        workers=app.config['AI_JOB_WORKERS'],
+        max_pending=app.config['AI_JOB_QUEUE_SIZE'],
+        default_timeout=app.config['AI_JOB_TIMEOUT']
+    )
+
+@lazy_service
+def get_image_executor():
+    return ImageExecutor(
+        max_workers=app.config['IMAGE_WORKERS'],
+        task_timeout=app.config.get('IMAGE_TASK_TIMEOUT', 30)
+    )
+
+@lazy_service
+def get_camera_service():
+    if app.config.get('IMAGE_WORKERS'):
+        # Same API, but the pixel work runs in worker processes
+        return PooledCameraService(get_image_executor())
+    return CameraService()
+
+@lazy_service
+def get_mask_registry():
+    return MaskRegistry(
+        os.path.join(app.root_path, 'static', 'masks'),
+        thumbnail_size=app.config.get('MASK_THUMBNAIL_SIZE', 64),
+        check_interval=app.config.get('MASK_RELOAD_INTERVAL', 2.0)
+    )
+
+@lazy_service
+def get_mask_compositor():
+    return MaskCompositor(
+        os.path.join(app.root_path, 'static', 'masks'),
+        aliases=get_mask_registry().aliases(),
+        cache_size=app.config['MASK_CACHE_SIZE'],
+        anchors={mask['id']: mask['anchors'] for mask in get_mask_registry().masks() if mask.get('anchors')},
+        warp_mode=app.config.get('MASK_WARP_MODE'),
+        pose_quantum=app.config.get('MASK_POSE_QUANTUM', 2.0),
+        warp_cache_size=app.config.get('MASK_WARP_CACHE_SIZE', 256)
+    )
+
+@lazy_service
+def get_animation_service():
+    return AnimationService(
+        app.config['BURST_DIR'],
+        max_workers=app.config.get('BURST_WORKERS', 2),
+        max_pending=app.config.get('BURST_QUEUE_SIZE', 8),
+        max_frames=app.config.get('BURST_MAX_FRAMES', 40),
+        session_ttl=app.config.get('BURST_SESSION_TTL', 3600),
+        encode_timeout=app.config.get('BURST_ENCODE_TIMEOUT', 120),
+        ffmpeg_path=app.config.get('FFMPEG_PATH')
+    )
+
+@lazy_service
+def get_frame_cache():
+    return FrameCache(
+        app.config.get('FRAME_CACHE_DIR'),
+        max_bytes=app.config.get('FRAME_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+        ttl=app.config.get('FRAME_CACHE_TTL', 600)
+    )
+
+@lazy_service
+def get_preview_service():
+    return PreviewService(
+        _render_preview,
+        max_sessions=app.config.get('PREVIEW_MAX_SESSIONS', 16),
+        idle_timeout=app.config.get('PREVIEW_IDLE_TIMEOUT', 30),
+        max_frame_age=app.config.get('PREVIEW_MAX_FRAME_AGE', 1.0),
+        max_fps=app.config.get('PREVIEW_MAX_FPS', 15)
+    )
+
+def _render_preview(frame_bytes, mask_id, face_data):
+    """Composite the session's mask onto one pushed frame; JPEG bytes or None"""
+    camera_service = get_camera_service()
+    image = camera_service.process_image_bytes(frame_bytes)
+    if image is None:
+        return None
+    if mask_id and mask_id != 'none' and get_mask_compositor().has_mask(mask_id):
+        image = get_mask_compositor().composite_image(image, mask_id, face_data)
+    return camera_service.encode_image_bytes(image, quality=app.config.get('PREVIEW_QUALITY', 70))
+
+@lazy_service
+def get_photo_store():
+    return create_photo_store(app.config)
+
+@lazy_service
+def get_derivative_service():
+    return DerivativeService(
+        get_camera_service(),
+        app.config['DERIVATIVE_DIR'],
+        open_photo,
+        formats=app.config['DERIVATIVE_FORMATS'],
+        max_workers=app.config['DERIVATIVE_WORKERS']
+    )
+
+@lazy_service
+def get_static_assets():
+    return StaticAssets(
+        app.static_folder,
+        app.config['STATIC_BUILD_DIR'],
+        auto_reload=app.debug
+    )
+
+@lazy_service
+def get_model_store():
+    return ModelStore(
+        os.path.join(app.static_folder, 'models'),
+        min_bytes=int(app.config.get('MODEL_MINIMUM_BYTES', 50 * 1024)),
+        max_bytes=app.config.get('MODEL_MAXIMUM_BYTES'),
+        session_ttl=app.config.get('MODEL_UPLOAD_SESSION_TTL', 24 * 3600)
+    )
+
+@lazy_service
+def get_photo_index():
+    index = PhotoIndex(
+        app.config['PHOTO_INDEX_PATH'],
+        app.config['UPLOAD_FOLDER'],
+        exclude=get_derivative_service().is_derivative
+    )
+    # Photos saved flat in uploads/ by older versions move into the store once
+    if migrate_flat_photos(get_photo_store(), index, app.config['UPLOAD_FOLDER']):
+        get_derivative_service().purge_directory(app.config['UPLOAD_FOLDER'])
+    return index
+
+
+@lazy_service
+def get_storage_maintenance():
+    maintenance = StorageMaintenance(
+        get_photo_store(),
+        get_photo_index(),
+        get_derivative_service(),
+        get_camera_service(),
+        budget_bytes=app.config.get('STORAGE_BUDGET_BYTES'),
+        eviction_order=app.config.get('STORAGE_EVICTION_ORDER', 'age'),
+        quality=app.config.get('RECOMPRESS_QUALITY', 82),
+        format=app.config.get('RECOMPRESS_FORMAT', 'JPEG'),
+        min_savings=app.config.get('RECOMPRESS_MIN_SAVINGS', 0.1),
+        slice_seconds=app.config.get('MAINTENANCE_SLICE_SECONDS', 0.2),
+        interval=app.config.get('MAINTENANCE_INTERVAL', 5.0),
+        # Stay out of the way of live traffic
+        is_busy=lambda: IN_FLIGHT.value() > 0,
+        lock_path=os.path.join(app.config['UPLOAD_FOLDER'], '.maintenance.lock')
+    )
+    if app.config.get('ENABLE_STORAGE_MAINTENANCE'):
+        maintenance.start()
+    return maintenance
+
+
+def open_photo(filename):
+    """Open a stored photo by its public filename; None if it is unknown"""
+    record = get_photo_index().get(filename)
+    if record is None or not record['blob']:
+        return None
+    return get_photo_store().open(record['blob'])
+
+
+# Request instrumentation: per-route latency, bytes in/out and
+# saturation of the background pools, exported at /metrics
+REQUEST_SECONDS = REGISTRY.histogram(
+    'photobooth_request_duration_seconds', 'Request latency by route', ('route', 'method', 'status')
+)
+REQUEST_BYTES = REGISTRY.counter(
+    'photobooth_request_bytes_total', 'Request body bytes received', ('route',)
+)
+RESPONSE_BYTES = REGISTRY.counter(
+    'photobooth_response_bytes_total', 'Response body bytes sent (streamed bodies excluded)', ('route',)
+)
+IN_FLIGHT = REGISTRY.gauge('photobooth_requests_in_flight', 'Requests currently being handled')
+timing_logger = TimingLogger()
+
+
+def _pool_stats(accessor, fields):
+    """Gauge collector reading a lazily built service without building it"""
+    def collect():
+        service = accessor.peek()
+        if service is None:
+            return {}
+        stats = service.stats()
+        return {(field,): stats[field] for field in fields}
+    return collect
+
+
+REGISTRY.gauge(
+    'photobooth_ai_jobs', 'AI job queue occupancy', ('state',),
+    collect=_pool_stats(get_ai_job_queue, ('workers', 'running', 'queued', 'capacity'))
+)
+REGISTRY.gauge(
+    'photobooth_derivative_jobs', 'Thumbnail pool occupancy', ('state',),
+    collect=_pool_stats(get_derivative_service, ('workers', 'pending'))
+)
+
+
+def _gemini_breaker_open():
+    gemini_service = get_gemini_service.peek()
+    if gemini_service is None or gemini_service.guard is None:
+        return None
+    return 0 if gemini_service.accepting_calls() else 1
+
+
+def _gemini_cache_stats():
+    gemini_service = get_gemini_service.peek()
+    if gemini_service is None or gemini_service.cache is None:
+        return {}
+    return {(name,): value for name, value in gemini_service.cache.stats().items()}
+
+
+REGISTRY.gauge(
+    'photobooth_storage', 'Photo storage usage and maintenance progress', ('stat',),
+    collect=_pool_stats(get_storage_maintenance, (
+        'photos', 'bytes', 'unoptimized', 'recompressed', 'recompress_bytes_reclaimed',
+        'evicted', 'eviction_bytes_reclaimed', 'skipped_busy'
+    ))
+)
+REGISTRY.gauge(
+    'photobooth_gemini_cache', 'Gemini response cache counters', ('counter',),
+    collect=_gemini_cache_stats
+)
+REGISTRY.gauge(
+    'photobooth_gemini_guard', 'Gemini rate limiter, concurrency cap and fallback counters', ('stat',),
+    collect=_pool_stats(get_gemini_service, (
+        'calls', 'succeeded', 'failed', 'slow', 'rejected_open', 'rejected_rate', 'rejected_concurrency',
+        'in_flight', 'consecutive_failures', 'times_opened', 'fallbacks', 'fallback_errors'
+    ))
+)
+REGISTRY.gauge(
+    'photobooth_gemini_breaker_open', 'Whether the Gemini circuit breaker is refusing calls',
+    collect=_gemini_breaker_open
+)
+REGISTRY.gauge(
+    'photobooth_image_workers', 'Image worker pool occupancy and failures', ('state',),
+    collect=_pool_stats(get_image_executor, ('workers', 'alive', 'busy', 'queued', 'timeouts', 'crashes'))
+)
+REGISTRY.gauge(
+    'photobooth_burst_jobs', 'Burst encoder occupancy', ('state',),
+    collect=_pool_stats(get_animation_service, ('workers', 'pending', 'capacity', 'encoded', 'failed'))
+)
+REGISTRY.gauge(
+    'photobooth_preview', 'Live preview sessions and frame counters', ('stat',),
+    collect=_pool_stats(get_preview_service, (
+        'active', 'streaming', 'capacity', 'received', 'rendered', 'dropped', 'stale', 'failed'
+    ))
+)
+REGISTRY.gauge(
+    'photobooth_mask_warp', 'Landmark mask warp cache counters', ('counter',),
+    collect=_pool_stats(get_mask_compositor, ('hits', 'misses', 'fallbacks', 'entries'))
+)
+REGISTRY.gauge(
+    'photobooth_frame_cache', 'Frame handle cache counters', ('counter',),
+    collect=_pool_stats(get_frame_cache, ('hits', 'disk_hits', 'misses', 'stores', 'entries', 'memory_bytes'))
+)
+
+
+def _route_label():
+    # The URL rule, not the path, keeps label cardinality bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_metrics():
+    if not app.config.get('ENABLE_METRICS'):
+        return
+    g.metrics_started = time.perf_counter()
+    g.metrics_stages = begin_request_stages()
+    IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    stages = end_request_stages(g.pop('metrics_stages'))
+    IN_FLIGHT.dec()
+    
+    route = _route_label()
+    bytes_in = request.content_length or 0
+    # Measuring a streamed body would buffer all of it (preview streams never end)
+    bytes_out = (response.calculate_content_length() if response.is_sequence else response.content_length) or 0
+    REQUEST_SECONDS.observe(elapsed, route, request.method, response.status_code)
+    REQUEST_BYTES.inc(route, amount=bytes_in)
+    RESPONSE_BYTES.inc(route, amount=bytes_out)
+    
+    if app.config.get('METRICS_TIMING_LOG'):
+        timing_logger.log(
+            route=route, method=request.method, status=response.status_code,
+            ms=round(elapsed * 1000, 3), bytes_in=bytes_in, bytes_out=bytes_out, stages=stages
+        )
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not app.config.get('ENABLE_METRICS'):
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    response = app.response_class(REGISTRY.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.template_global()
+def asset_url(filename):
+    """Fingerprinted URL for a static file, falling back to the plain /static/ URL"""
+    if app.config.get('ENABLE_ASSET_FINGERPRINTING'):
+        url = get_static_assets().url(filename)
+        if url:
+            return url
+    return url_for('static', filename=filename)
+
+
+@app.template_global()
+def asset_urls(directory):
+    """``{relpath: url}`` for a static directory, for scripts that build URLs themselves"""
+    if not app.config.get('ENABLE_ASSET_FINGERPRINTING'):
+        return {}
+    return get_static_assets().urls(directory)
+
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Serve a fingerprinted static file, precompressed when the client allows
+
+    The URL changes whenever the content does, so responses are immutable.
+    Range requests (audio seeking) are handled by send_file.
+    """
+    resolved = get_static_assets().resolve(filename)
+    if resolved is None:
+        return jsonify({'error': 'File not found'}), 404
+    relpath, entry = resolved
+    
+    accepted = [e for e in ('br', 'gzip') if request.accept_encodings.quality(e) > 0]
+    encoding = StaticAssets.choose_encoding(entry, accepted)
+    path = get_static_assets().encoded_path(entry, encoding) if encoding else get_static_assets().source_path(relpath)
+    
+    response = send_file(
+        os.path.abspath(path),
+        mimetype=mimetypes.guess_type(relpath)[0] or 'application/octet-stream',
+        etag=f"{entry['hash'][:16]}-{encoding or 'identity'}",
+        max_age=app.config.get('ASSET_CACHE_SECONDS', 31536000),
+        conditional=True
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry.get('encodings'):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Hash and precompress static files ahead of the first request (run at deploy time)."""
+    # Mask analysis first: it rewrites static/masks/manifest.json
+    print(f"Analyzed {get_mask_registry().build_manifest()} masks into static/masks/{MASK_MANIFEST_NAME}")
+    print(f"Fingerprinted {get_static_assets().build(precompress=True)} static files "
+          f"into {app.config['STATIC_BUILD_DIR']}")
+
 
 @app.route('/')
 def index():
     """Main photobooth interface"""
     return render_template('index.html')
 
+# (registry version, JSON body, ETag) of the last /api/masks listing
+_mask_listing = [None, None, None]
+
+
 @app.route('/api/masks')
 def get_masks():
-    """Get available Star Wars mask overlays"""
-    masks = [
-        {
-            "id": "none",
-            "name": "No Mask",
-            "image": None,
-            "icon": "🚫",
-            "description": "Original camera feed without mask overlay"
-        },
-        {
-            "id": "vader-mask",
-            "name": "Darth Vader",
-            "image": "/static/masks/vader-mask.png",
-            "icon": "🎭",
-            "description": "Become the Dark Lord of the Sith"
-        },
-        {
-            "id": "sith-lord",
-            "name": "Sith Lord",
-            "image": "/static/masks/sith-lord-mask.png",
-            "icon": "⚔️",
-            "description": "Ancient Sith warrior mask"
-        },
-        {
-            "id": "storm-trooper",
-            "name": "Storm Trooper",
-            "image": "/static/masks/storm-trooper.png",
-            "icon": "🎖️",
-            "description": "Imperial Storm Trooper helmet"
-        },
-        {
-            "id": "emperor",
-            "name": "Emperor",
-            "image": "/static/masks/emperor-mask.png",
-            "icon": "👑",
-            "description": "Dark Emperor hood and face"
-        },
-        {
-            "id": "kylo-ren",
-            "name": "Kylo Ren",
-            "image": "/static/masks/kylo-ren-mask.png",
-            "icon": "🗡️",
-            "description": "Knights of Ren mask"
-        },
-        {
-            "id": "jedi",
-            "name": "Jedi Master",
-            "image": "/static/masks/jedi-mask.png",
-            "icon": "✨",
-            "description": "Ancient Jedi Master hood"
-        }
-    ]
-    return jsonify(masks)
+    """Available mask overlays with their size, alpha box, anchors and thumbnail
+
+    The listing is rebuilt only when the mask files or manifest change and
+    carries an ETag, so clients revalidating an unchanged listing get 304.
+    """
+    registry = get_mask_registry()
+    if registry.refresh():
+        get_mask_compositor.reset()  # composite with the new or edited masks
+    if _mask_listing[0] != registry.version:
+        body = json.dumps([
+            dict(mask, image=asset_url(mask['image'][len('/static/'):])) if mask['image'] else mask
+            for mask in registry.masks()
+        ], ensure_ascii=False)
+        _mask_listing[:] = [registry.version, body, hashlib.sha256(body.encode('utf-8')).hexdigest()[:20]]
+    _, body, etag = _mask_listing
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/static/masks/<filename>')
 def serve_mask(filename):
-    """Serve mask image files"""
-    return send_from_directory('static/masks', filename)
+    """Serve mask image files (clients should prefer the /assets/ URLs from /api/masks)"""
+    return send_from_directory(
+        os.path.join(app.static_folder, 'masks'), filename,
+        max_age=app.config.get('MASK_FILE_CACHE_SECONDS', 3600)
+    )
+
+APPLY_MASK_RESPONSE_MODES = ('full', 'handle', 'binary')
+
+
+def _frame_url(frame_id):
+    # A plain path, not url_for: the AI fallback also runs in job queue
+    # threads, which have no app or request context
+    return f'/api/frames/{frame_id}'
+
+
+def _frame_not_found(frame_id):
+    return jsonify({'error': 'Unknown or expired frame_id; upload the image again',
+                    'frame_id': frame_id}), 404
+
+
+@app.route('/api/frames', methods=['POST'])
+def upload_frame():
+    """Store a frame (raw image body or JSON ``image``) and return its handle"""
+    try:
+        if request.mimetype.startswith('image/'):
+            image_bytes = request.get_data()
+        else:
+            data = request.get_json(silent=True) or {}
+            image_bytes = decode_data_url(data['image']) if data.get('image') else b''
+        if not image_bytes:
+            return jsonify({'error': 'No image data provided'}), 400
+        frame_id = get_frame_cache().put(image_bytes)
+        return jsonify({'frame_id': frame_id, 'url': _frame_url(frame_id),
+                        'ttl': app.config.get('FRAME_CACHE_TTL')}), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/frames/<frame_id>', methods=['GET'])
+def get_frame(frame_id):
+    """Bytes of a cached frame or apply-mask result"""
+    image_bytes = get_frame_cache().get(frame_id)
+    if image_bytes is None:
+        return _frame_not_found(frame_id)
+    # Content-addressed, so the URL never changes meaning
+    return send_file(io.BytesIO(image_bytes), mimetype='image/jpeg', etag=frame_id,
+                     conditional=True, max_age=app.config.get('FRAME_CACHE_TTL'))
+
 
 @app.route('/api/apply-mask', methods=['POST'])
 def apply_mask():
-    """Apply mask overlay to captured image"""
+    """Apply mask overlay to captured image
+
+    The frame can be sent as JSON ``image`` (base64), as a ``frame_id``
+    from an earlier call or /api/frames, or as a raw ``image/*`` body with
+    the other parameters in the query string. ``response`` selects what
+    comes back: ``full`` (default) echoes ``processed_image`` as before,
+    ``handle`` returns JSON with ``frame_id``/``result_id`` and no image,
+    and ``binary`` returns the JPEG only if the mask changed it (204 with
+    an ``X-Frame-Id`` header otherwise).
+    """
     try:
-        data = request.get_json()
-        image_data = data.get('image')
-        mask_id = data.get('mask_id')
-        face_data = data.get('face_data', {})
+        if request.mimetype.startswith('image/'):
+            params = request.args
+            image_data = None
+            with timed('apply_mask.read_body'):
+                image_bytes = request.get_data()
+        elif request.is_json:
+            with timed('apply_mask.parse_json'):
+                data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Request body is not a JSON object'}), 400
+            params = data
+            image_data = data.get('image')
+            image_bytes = None
+        else:
+            return jsonify({'error': 'Expected a JSON or image/* body'}), 415
+        mask_id = params.get('mask_id')
+        face_data = params.get('face_data', {})
+        if isinstance(face_data, str):
+            try:
+                face_data = json.loads(face_data or '{}')
+            except ValueError:
+                return jsonify({'error': 'face_data is not valid JSON'}), 400
+        response_mode = params.get('response') or request.args.get('response') or 'full'
+        if response_mode not in APPLY_MASK_RESPONSE_MODES:
+            return jsonify({'error': f"response must be one of {', '.join(APPLY_MASK_RESPONSE_MODES)}"}), 400
         
-        if not image_data:
+        frame_cache = get_frame_cache()
+        frame_id = params.get('frame_id')
+        if image_bytes is None and image_data:
+            with timed('apply_mask.base64_decode'):
+                image_bytes = decode_data_url(image_data)
+        if image_bytes:
+            frame_id = frame_cache.put(image_bytes)
+        elif frame_id:
+            image_bytes = frame_cache.get(frame_id)
+            if image_bytes is None:
+                return _frame_not_found(frame_id)
+        else:
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Process with mask overlay (server-side processing if needed)
+        # Process with mask overlay
         result = {
             'success': True,
-            'processed_image': image_data,  # Client-side processing handles the overlay
+            'frame_id': frame_id,
+            'image_changed': False,
             'mask_applied': mask_id,
-            'face_detected': bool(face_data)
+            'face_detected': bool(face_data),
+            'server_composited': False
         }
+        result_bytes = None
+        
+        # Server-side compositing so saved photos don't depend on the browser
+        if app.config.get('ENABLE_SERVER_COMPOSITING') and mask_id and mask_id != 'none' \
+                and get_mask_compositor().has_mask(mask_id):
+            camera_service = get_camera_service()
+            image = camera_service.process_image_bytes(image_bytes)
+            if image is not None:
+                composited = get_mask_compositor().composite_image(image, mask_id, face_data)
+                result_bytes = camera_service.encode_image_bytes(composited)
+                if result_bytes:
+                    result['server_composited'] = True
+                    result['image_changed'] = True
+                    result['result_id'] = frame_cache.put(result_bytes)
+                    result['result_url'] = _frame_url(result['result_id'])
         
-        # Optional: Use Gemini for additional AI processing
+        # Optional: Use Gemini for additional AI processing. It only adds
+        # metadata, so it is handed the bytes and never changes the image.
         if mask_id != 'none' and app.config.get('ENABLE_AI_PROCESSING'):
-            # Call the compatibility wrapper on the GeminiService. It will
-            # return metadata and (at minimum) echo the original image back
-            # as `processed_image` if a transformed image isn't produced.
-            ai_result = gemini_service.enhance_mask_image(image_data, mask_id, face_data)
+            ai_input = result_bytes or image_bytes
+            run_async = params.get('async') if isinstance(params, dict) and 'async' in params \
+                else request.args.get('async') == '1'
+            # While the breaker is open the local fallback answers at once,
+            # so there is nothing worth queueing
+            if run_async and app.config.get('ENABLE_ASYNC_AI') and get_gemini_service().accepting_calls():
+                # Hand the model round trip to the job queue and answer now;
+                # the client polls /api/jobs/<job_id> for the AI metadata
+                try:
+                    job = get_ai_job_queue().submit(
+                        get_gemini_service().enhance_mask_bytes, ai_input, mask_id, face_data,
+                        timeout=app.config.get('AI_JOB_TIMEOUT')
+                    )
+                except QueueFull as e:
+                    response = jsonify({'error': str(e)})
+                    response.headers['Retry-After'] = '2'
+                    return response, 429
+                result.update({
+                    'job_id': job.id,
+                    'job_status': job.status,
+                    'job_url': f'/api/jobs/{job.id}'
+                })
+                return _apply_mask_response(result, response_mode, image_data, image_bytes, result_bytes, 202)
+            
+            ai_result = get_gemini_service().enhance_mask_bytes(ai_input, mask_id, face_data)
             if ai_result.get('success'):
-                # Merge AI metadata, and prefer AI-processed image when present
-                if ai_result.get('processed_image'):
-                    result['processed_image'] = ai_result.get('processed_image')
-                result.update({k: v for k, v in ai_result.items() if k != 'processed_image'})
+                result.update(ai_result)
+                if ai_result.get('degraded') and ai_result.get('result_id'):
+                    # The local fallback filtered the image
+                    result_bytes = frame_cache.get(ai_result['result_id'])
+                    result['image_changed'] = result_bytes is not None
         
-        return jsonify(result)
+        return _apply_mask_response(result, response_mode, image_data, image_bytes, result_bytes)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def _apply_mask_response(result, mode, image_data, image_bytes, result_bytes, status=200):
+    """Shape the apply-mask result for the requested response mode"""
+    if mode == 'binary':
+        headers = {'X-Frame-Id': result['frame_id'], 'X-Image-Changed': '1' if result_bytes else '0'}
+        if result.get('job_id'):
+            headers['X-Job-Id'] = result['job_id']
+        if result_bytes is None:
+            response = app.response_class(status=204, headers=headers)
+            del response.headers['Content-Type']  # no body, so no type
+            return response
+        headers['X-Result-Id'] = result['result_id']
+        return app.response_class(result_bytes, status=status, mimetype='image/jpeg', headers=headers)
+    
+    if mode == 'full':
+        # Legacy shape: the (possibly composited) image as a data URL
+        with timed('apply_mask.encode_response'):
+            if result_bytes is not None:
+                result['processed_image'] = encode_data_url(result_bytes)
+            else:
+                result['processed_image'] = image_data or encode_data_url(image_bytes)
+    return jsonify(result), status
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, and result once finished, of an asynchronous AI job"""
+    job = get_ai_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running AI job"""
+    job = get_ai_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not get_ai_job_queue().cancel(job_id):
+        return jsonify({'error': f'Job already {job.status}'}), 409
+    return jsonify(job.to_dict())
+
+def _capture_filename(mask_used, prefix='sith_photo', ext='.jpg'):
+    """Build a unique public filename for a new capture
+
+    The random token keeps two captures in the same second with the same
+    mask from sharing a name.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    mask = secure_filename(mask_used) or 'none'
+    while True:
+        filename = f"{prefix}_{timestamp}-{secrets.token_hex(6)}_{mask}{ext}"
+        if not get_photo_index().exists(filename):
+            return filename
+
+
+@timed('capture.register')
+def _register_capture(filename, store_blobs, mask_used, size, dimensions, kind='photo'):
+    """Store a capture, index it and build thumbnails in the background
+
+    ``store_blobs()`` puts the capture into the photo store and returns
+    ``(blob, video_blob)``. It runs under the index's blob lock together
+    with the index insert, so deleting a photo with identical content
+    cannot remove the blob in between (see delete_photo). Returns the
+    stored ``(blob, video_blob)``.
+    """
+    width, height = dimensions
+    index = get_photo_index()
+    with index.blob_lock():
+        blob, video_blob = store_blobs()
+        index.add(filename, mask_used, size, time.time(), width, height, blob, kind, video_blob)
+    get_derivative_service().schedule(filename)
+    get_storage_maintenance()  # starts the background worker on the first capture
+    return blob, video_blob
+
+
+@app.route('/api/ai/status')
+def ai_status():
+    """Report AI processing state, admission control and response cache counters"""
+    # Don't build services just to report on them
+    gemini_service = get_gemini_service.peek()
+    ai_job_queue = get_ai_job_queue.peek()
+    return jsonify({
+        'enabled': bool(app.config.get('ENABLE_AI_PROCESSING')),
+        'cache': gemini_service.cache.stats() if gemini_service and gemini_service.cache else None,
+        'guard': gemini_service.stats() if gemini_service else None,
+        'jobs': ai_job_queue.stats() if ai_job_queue else None
+    })
+
 @app.route('/api/capture-photo', methods=['POST'])
 def capture_photo():
-    """Save captured photo with mask overlay"""
+    """Save captured photo with mask overlay (base64 JSON compatibility path)"""
     try:
-        data = request.get_json()
+        with timed('capture.parse_json'):
+            data = request.get_json()
         image_data = data.get('image')
         mask_used = data.get('mask', 'none')
         
@@ -132,85 +760,478 @@ def capture_photo():
             return jsonify({'error': 'No image data provided'}), 400
         
         # Decode and save image (support both data URLs and raw base64)
-        if ',' in image_data:
-            image_b64 = image_data.split(',', 1)[1]
-        else:
-            image_b64 = image_data
+        with timed('capture.base64_decode'):
+            image_bytes = decode_data_url(image_data)
+        
+        # Save image (identical bytes are stored once)
+        filename = _capture_filename(mask_used)
+        
+        def store_blobs():
+            with timed('capture.disk_write'):
+                return get_photo_store().put_bytes(image_bytes), None
+        
+        dimensions = PhotoIndex.read_dimensions(io.BytesIO(image_bytes))
+        _register_capture(filename, store_blobs, mask_used, len(image_bytes), dimensions)
+        
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'url': f"/api/download/{filename}"
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        image_bytes = base64.b64decode(image_b64)
+@app.route('/api/capture-photo/stream', methods=['POST'])
+def capture_photo_stream():
+    """Save a captured photo sent as a raw image/jpeg body or a multipart upload
+
+    The body is streamed to a temp file in chunks and renamed into place,
+    so the image is never held in memory as base64 or a JSON document.
+    The mask id comes from the ``mask`` query parameter or form field.
+    """
+    upload = None
+    try:
+        max_bytes = app.config.get('MAX_CONTENT_LENGTH')
         
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"sith_photo_{timestamp}_{mask_used}.jpg"
-        filepath = os.path.join('uploads', filename)
+        if request.mimetype == 'multipart/form-data':
+            if 'image' not in request.files:
+                return jsonify({'error': 'No image data provided'}), 400
+            source = request.files['image'].stream
+            mask_used = request.form.get('mask') or request.args.get('mask', 'none')
+        elif request.mimetype == 'image/jpeg':
+            source = request.stream
+            mask_used = request.args.get('mask', 'none')
+        else:
+            return jsonify({'error': 'Expected an image/jpeg body or multipart upload'}), 415
+        
+        with timed('capture.disk_write'):
+            upload = stream_to_tempfile(source, get_photo_store().temp_dir(), max_bytes=max_bytes)
+        if upload.size == 0:
+            return jsonify({'error': 'No image data provided'}), 400
+        if not upload.head.startswith(b'\xff\xd8'):
+            return jsonify({'error': 'Uploaded data is not a JPEG image'}), 400
         
-        # Ensure uploads directory exists
-        os.makedirs('uploads', exist_ok=True)
+        filename = _capture_filename(mask_used)
+        size = upload.size
+        dimensions = PhotoIndex.read_dimensions(upload.path)
         
-        # Save image
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
+        def store_blobs():
+            nonlocal upload
+            blob = get_photo_store().put_upload(upload)
+            upload = None  # consumed by the store
+            return blob, None
+        
+        _register_capture(filename, store_blobs, mask_used, size, dimensions)
         
         return jsonify({
             'success': True,
             'filename': filename,
-            'filepath': filepath
+            'url': f"/api/download/{filename}"
         })
         
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if upload is not None:
+            upload.discard()
+
+def _burst_options(params):
+    """Encoder options from JSON, form or query parameters"""
+    formats = params.get('formats') or app.config.get('BURST_FORMATS', ('WEBP',))
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    formats = [f.strip().upper() for f in formats if f.strip()]
+    unknown = [f for f in formats if f not in ANIMATED_FORMATS + VIDEO_FORMATS]
+    if unknown:
+        raise ValueError(f"Unsupported burst formats: {', '.join(unknown)}")
+    boomerang = params.get('boomerang', True)
+    if isinstance(boomerang, str):
+        boomerang = boomerang.lower() not in ('0', 'false', 'no')
+    return {
+        'formats': formats,
+        'filter_type': params.get('filter') or None,
+        'fps': max(1, min(float(params.get('fps') or app.config.get('BURST_FPS', 10)), 30)),
+        'boomerang': bool(boomerang),
+        'max_size': max(64, min(int(params.get('max_size') or app.config.get('BURST_MAX_SIZE', 720)),
+                                app.config.get('BURST_MAX_SIZE', 720))),
+        'quality': app.config.get('BURST_QUALITY', 80)
+    }
+
+
+def _store_burst(mask_used):
+    """Completion callback: store an encoded burst and list it in the gallery"""
+    def on_done(session_id, result):
+        photo_store = get_photo_store()
+        outputs = result['outputs']
+        image_format = next(f for f in ANIMATED_FORMATS if f in outputs)
+        size = outputs[image_format]['size'] + (outputs['MP4']['size'] if 'MP4' in outputs else 0)
+        
+        def store_blobs():
+            blob = photo_store.put_upload(stored_output(outputs[image_format]), ANIMATION_EXTENSIONS[image_format])
+            video_blob = photo_store.put_upload(stored_output(outputs['MP4']), '.mp4') if 'MP4' in outputs else None
+            return blob, video_blob
+        
+        filename = _capture_filename(mask_used, 'sith_burst', ANIMATION_EXTENSIONS[image_format])
+        _, video_blob = _register_capture(filename, store_blobs, mask_used, size,
+                                          (result['width'], result['height']), kind='animation')
+        return {
+            'filename': filename,
+            'url': f"/api/download/{filename}",
+            'video_url': f"/api/download/{filename}?video=1" if video_blob else None,
+            'frames': result['frames'],
+            'width': result['width'],
+            'height': result['height']
+        }
+    return on_done
+
+
+def _submit_burst(session_id, params):
+    options = _burst_options(params)
+    mask_used = params.get('mask') or 'none'
+    job = get_animation_service().submit(session_id, _store_burst(mask_used), **options)
+    return jsonify({
+        'burst_id': session_id,
+        'job_id': job.id,
+        'job_status': job.status,
+        'job_url': f'/api/bursts/jobs/{job.id}',
+        'formats': get_animation_service().resolve_formats(options['formats'])
+    }), 202
+
+
+def _preview_params(params):
+    face_data = params.get('face_data')
+    if isinstance(face_data, str):
+        face_data = json.loads(face_data or '{}')
+    return params.get('mask_id'), face_data
+
+@app.route('/api/preview', methods=['POST'])
+def create_preview():
+    """Open a live preview session
+
+    Push frames (raw image/* bodies, ``mask_id``/``face_data`` in the query
+    string) to ``frames_url`` and read composited frames from
+    ``stream_url``, a multipart/x-mixed-replace (MJPEG) response usable as
+    an <img> src. Only the newest unrendered frame is kept, so a busy
+    server drops frames instead of building up lag.
+    """
+    try:
+        mask_id, face_data = _preview_params({**request.args.to_dict(), **(request.get_json(silent=True) or {})})
+        session = get_preview_service().create_session(mask_id, face_data)
+        return jsonify({
+            'session_id': session.id,
+            'frames_url': f'/api/preview/{session.id}/frames',
+            'stream_url': f'/api/preview/{session.id}/stream',
+            'max_fps': app.config.get('PREVIEW_MAX_FPS'),
+            'idle_timeout': app.config.get('PREVIEW_IDLE_TIMEOUT')
+        }), 201
+    except QueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/preview/<session_id>/frames', methods=['POST'])
+def push_preview_frame(session_id):
+    """Replace the session's pending frame with this one (latest frame wins)"""
+    session = get_preview_service().get(session_id)
+    if session is None:
+        return jsonify({'error': 'Preview session not found'}), 404
+    try:
+        if not request.mimetype.startswith('image/'):
+            return jsonify({'error': 'Send the frame as a raw image/* body'}), 415
+        frame_bytes = request.get_data()
+        if not frame_bytes:
+            return jsonify({'error': 'No image data provided'}), 400
+        mask_id, face_data = _preview_params(request.args)
+        seq, dropped = session.push(frame_bytes, mask_id, face_data)
+        return jsonify({'seq': seq, 'replaced_pending': dropped, 'dropped': session.counters['dropped']}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/preview/<session_id>/stream', methods=['GET'])
+def stream_preview(session_id):
+    """Composited frames as they are rendered, one multipart part each"""
+    preview_service = get_preview_service()
+    session = preview_service.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Preview session not found'}), 404
+    if session.streaming:
+        return jsonify({'error': 'Preview session already has a stream'}), 409
+    return app.response_class(
+        preview_service.stream(session),
+        mimetype=f'multipart/x-mixed-replace; boundary={PREVIEW_BOUNDARY}',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/preview/<session_id>', methods=['GET'])
+def get_preview(session_id):
+    """Per-session FPS, latency and dropped-frame counters"""
+    session = get_preview_service().get(session_id)
+    if session is None:
+        return jsonify({'error': 'Preview session not found'}), 404
+    return jsonify(session.stats())
+
+@app.route('/api/preview/<session_id>', methods=['DELETE'])
+def close_preview(session_id):
+    session = get_preview_service().close(session_id)
+    if session is None:
+        return jsonify({'error': 'Preview session not found'}), 404
+    return jsonify(session.stats())
+
+@app.route('/api/bursts', methods=['POST'])
+def create_burst():
+    """Start a burst capture ("boomerang")
+
+    Send every frame at once as a multipart upload (repeated ``frames``
+    files) or JSON ``frames`` (base64 list) to encode straight away, or
+    send no frames to open a session and stream frames one request at a
+    time to /api/bursts/<burst_id>/frames. Encoding runs in a process pool;
+    the response is a job to poll.
+    """
+    animation_service = get_animation_service()
+    session_id = animation_service.create_session()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            params = request.form.to_dict()
+            for frame in request.files.getlist('frames'):
+                animation_service.add_frame(session_id, frame.stream)
+        else:
+            params = request.get_json(silent=True) or {}
+            for frame in params.get('frames') or []:
+                animation_service.add_frame(session_id, io.BytesIO(decode_data_url(frame)))
+        params = {**request.args.to_dict(), **params}
+        
+        if not animation_service.frame_paths(session_id):
+            return jsonify({
+                'burst_id': session_id,
+                'frames_url': f'/api/bursts/{session_id}/frames',
+                'encode_url': f'/api/bursts/{session_id}/encode',
+                'max_frames': animation_service.max_frames
+            }), 201
+        return _submit_burst(session_id, params)
+        
+    except QueueFull as e:
+        animation_service.abort_session(session_id)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        animation_service.abort_session(session_id)
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        animation_service.abort_session(session_id)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        animation_service.abort_session(session_id)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bursts/<burst_id>/frames', methods=['POST'])
+def add_burst_frame(burst_id):
+    """Append one frame (raw image/jpeg or image/png body) to a burst"""
+    try:
+        count = get_animation_service().add_frame(burst_id, request.stream,
+                                                  max_bytes=app.config.get('MAX_CONTENT_LENGTH'))
+        return jsonify({'burst_id': burst_id, 'frames': count})
+    except LookupError:
+        return jsonify({'error': 'Burst not found'}), 404
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bursts/<burst_id>/encode', methods=['POST'])
+def start_burst_encode(burst_id):
+    """Encode a burst's frames; options: mask, filter, formats, fps, boomerang, max_size"""
+    try:
+        params = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+        return _submit_burst(burst_id, params)
+    except LookupError:
+        return jsonify({'error': 'Burst not found'}), 404
+    except QueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/bursts/<burst_id>', methods=['DELETE'])
+def abort_burst(burst_id):
+    if not get_animation_service().abort_session(burst_id):
+        return jsonify({'error': 'Burst not found'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/bursts/jobs/<job_id>', methods=['GET'])
+def get_burst_job(job_id):
+    """Status of a burst encode; the result has the stored animation's URLs"""
+    job = get_animation_service().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/download/<filename>')
 def download_photo(filename):
-    """Download captured photo"""
+    """Download captured photo (``?video=1``: a burst's MP4)"""
     try:
-        uploads_dir = app.config.get('UPLOAD_FOLDER', 'uploads')
-        filepath = os.path.join(uploads_dir, filename)
-        if os.path.exists(filepath):
-            # Use send_from_directory for safer downloads
-            return send_from_directory(directory=uploads_dir, path=filename, as_attachment=True)
-        else:
+        record = get_photo_index().get(secure_filename(filename))
+        if record is None or not record['blob']:
             return jsonify({'error': 'File not found'}), 404
+        blob = record['blob']
+        download_name = record['filename']
+        if request.args.get('video') == '1':
+            if not record['video_blob']:
+                return jsonify({'error': 'File not found'}), 404
+            blob = record['video_blob']
+            download_name = os.path.splitext(download_name)[0] + '.mp4'
+        
+        photo_store = get_photo_store()
+        path = photo_store.local_path(blob)
+        get_photo_index().touch(record['filename'], time.time())
+        return send_file(
+            os.path.abspath(path) if path else photo_store.open(blob),
+            mimetype=content_type(blob),
+            as_attachment=True,
+            download_name=download_name,
+            etag=blob.split('.')[0],
+            conditional=True
+        )
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gallery')
 def get_gallery():
-    """Get all captured photos"""
-    try:
-        uploads_dir = 'uploads'
-        if not os.path.exists(uploads_dir):
-            return jsonify([])
-        
-        photos = []
-        for filename in os.listdir(uploads_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                photos.append({
-                    'filename': filename,
-                    'url': f'/api/download/{filename}',
-                    'timestamp': os.path.getmtime(os.path.join(uploads_dir, filename))
-                })
+    """Get a page of captured photos (newest first)
+
+    Query parameters: ``limit``, ``cursor`` (from the previous page's
+    ``next_cursor``) and ``mask`` to filter by mask id.
+    """
+    try:
+        default_limit = app.config.get('GALLERY_PAGE_SIZE', 40)
+        max_limit = app.config.get('GALLERY_MAX_PAGE_SIZE', 200)
+        limit = max(1, min(request.args.get('limit', default_limit, type=int), max_limit))
+        cursor = request.args.get('cursor') or None
+        mask = request.args.get('mask') or None
         
-        # Sort by timestamp (newest first)
-        photos.sort(key=lambda x: x['timestamp'], reverse=True)
+        # The ETag only depends on the index version, so a refresh that
+        # finds nothing new is answered without touching the photo table
+        with timed('gallery.etag'):
+            etag = get_photo_index().etag(limit, cursor, mask)
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            try:
+                with timed('gallery.query'):
+                    records, next_cursor = get_photo_index().page(limit=limit, cursor=cursor, mask=mask)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            photos = [{
+                'filename': record['filename'],
+                'url': f"/api/download/{record['filename']}",
+                'variants': _variant_urls(record),
+                'kind': record['kind'],
+                'video_url': f"/api/download/{record['filename']}?video=1" if record['video_blob'] else None,
+                'mask': record['mask'],
+                'size': record['size'],
+                'timestamp': record['timestamp'],
+                'width': record['width'],
+                'height': record['height']
+            } for record in records]
+            response = jsonify({'photos': photos, 'next_cursor': next_cursor})
         
-        return jsonify(photos)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _variant_urls(record):
+    """Variant URLs for a photo record; the version suffix busts caches on overwrite"""
+    version = int(record['timestamp'])
+    return {
+        variant: f"/api/photos/{variant}/{record['filename']}?v={version}"
+        for variant in get_derivative_service().variants
+    }
+
+
+@app.route('/api/photos/<variant>/<filename>')
+def get_photo_variant(variant, filename):
+    """Serve a resized variant of a photo, generating it on first request"""
+    try:
+        safe_name = secure_filename(filename)
+        # Prefer WebP when the browser advertises support for it
+        format = 'WEBP' if 'image/webp' in request.headers.get('Accept', '') else 'JPEG'
+        with timed('photos.ensure_variant'):
+            path = get_derivative_service().ensure(safe_name, variant, format)
+        if not path:
+            return jsonify({'error': 'File not found'}), 404
+        get_photo_index().touch(safe_name, time.time())
+        
+        response = send_file(
+            os.path.abspath(path),
+            mimetype='image/webp' if format == 'WEBP' else 'image/jpeg',
+            max_age=app.config.get('DERIVATIVE_CACHE_SECONDS', 31536000)
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept')
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/storage/status')
+def storage_status():
+    """Storage usage, disk budget and maintenance progress"""
+    try:
+        return jsonify(get_storage_maintenance().stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.cli.command('maintain-storage')
+def maintain_storage():
+    """Recompress originals and enforce the storage budget until done."""
+    maintenance = get_storage_maintenance()
+    maintenance.stop()
+    maintenance.run_until_idle()
+    stats = maintenance.stats()
+    print(f"Recompressed {stats['recompressed']} photos ({stats['recompress_bytes_reclaimed']} bytes saved), "
+          f"evicted {stats['evicted']} ({stats['eviction_bytes_reclaimed']} bytes); "
+          f"{stats['photos']} photos use {stats['bytes']} bytes")
+
+
+@app.cli.command('backfill-derivatives')
+def backfill_derivatives():
+    """Generate missing thumbnail/medium variants for existing uploads."""
+    photos, written = get_derivative_service().backfill(get_photo_index().iter_filenames())
+    print(f"Checked {photos} photos, wrote {written} variants")
+
+
 @app.route('/api/delete-photo/<path:filename>', methods=['DELETE'])
 def delete_photo(filename):
-    """Delete a photo from the uploads directory."""
+    """Delete a photo; its stored bytes go once no other photo shares them."""
     try:
-        uploads_dir = app.config.get('UPLOAD_FOLDER', 'uploads')
         # Secure the filename (avoid directory traversal)
         safe_name = secure_filename(filename)
-        filepath = os.path.join(uploads_dir, safe_name)
-        if not os.path.exists(filepath):
+        if delete_stored_photo(get_photo_store(), get_photo_index(), safe_name) is None:
             return jsonify({'error': 'File not found'}), 404
-        os.remove(filepath)
+        get_derivative_service().remove(safe_name)
         return jsonify({'success': True, 'deleted': safe_name}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -218,32 +1239,148 @@ def delete_photo(filename):
 
 @app.route('/api/upload-model', methods=['POST'])
 def upload_model():
-    """Upload a MediaPipe .task model to static/models for local loading by the frontend."""
+    """Upload a MediaPipe .task model to static/models for local loading by the frontend.
+
+    Accepts a multipart form (``model`` file) or a raw body with the name in
+    ``?filename=``. The body is streamed to disk with its SHA-256, and a
+    model whose content is already stored is not written again.
+    """
     try:
-        if 'model' not in request.files:
-            return jsonify({'error': 'No file part'}), 400
-        file = request.files['model']
-        if file.filename == '':
+        if request.mimetype == 'multipart/form-data':
+            if 'model' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+            file = request.files['model']
+            if file.filename == '':
+                return jsonify({'error': 'No selected file'}), 400
+            filename, source = secure_filename(file.filename), file.stream
+        else:
+            filename, source = secure_filename(request.args.get('filename', '')), request.stream
+        if not filename:
             return jsonify({'error': 'No selected file'}), 400
+        
+        result = get_model_store().save_stream(source, filename)
+        return jsonify(_model_upload_response(result)), 200
+    except ModelRejected as e:
+        return jsonify({'error': str(e)}), 400
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _model_upload_response(result):
+    return {
+        'success': True,
+        'path': f"/static/models/{result['filename']}",
+        'size': result['size'],
+        'sha256': result['sha256'],
+        'deduplicated': result['deduplicated']
+    }
+
+
+def _upload_session_response(session):
+    data = {
+        'session_id': session['id'],
+        'upload_url': f"/api/upload-model/sessions/{session['id']}",
+        'filename': session['filename'],
+        'size': session['size'],
+        'offset': session['offset'],
+        'chunk_size': app.config.get('MODEL_UPLOAD_CHUNK_BYTES'),
+        'complete': session.get('result') is not None
+    }
+    if session.get('result'):
+        data.update(_model_upload_response(session['result']))
+    return data
+
 
-        filename = secure_filename(file.filename)
-        models_dir = os.path.join(app.root_path, 'static', 'models')
-        os.makedirs(models_dir, exist_ok=True)
-        save_path = os.path.join(models_dir, filename)
+@app.route('/api/upload-model/sessions', methods=['POST'])
+def create_model_upload():
+    """Start a resumable model upload
+
+    JSON body: ``filename``, ``size`` and optionally ``sha256``. If the
+    checksum matches a stored model the upload completes immediately.
+    """
+    try:
+        data = request.get_json() or {}
+        filename = secure_filename(data.get('filename') or '')
+        size = data.get('size')
+        if not filename or not isinstance(size, int):
+            return jsonify({'error': 'filename and integer size are required'}), 400
+        session = get_model_store().create_session(filename, size, data.get('sha256'))
+        return jsonify(_upload_session_response(session)), 200 if session.get('result') else 201
+    except ModelRejected as e:
+        return jsonify({'error': str(e)}), 400
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/upload-model/sessions/<session_id>', methods=['GET'])
+def get_model_upload(session_id):
+    """Offset of a resumable upload, for continuing after a dropped connection"""
+    session = get_model_store().get_session(session_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found'}), 404
+    return jsonify(_upload_session_response(session))
 
-        # Read file bytes to validate size before saving
-        file_bytes = file.read()
-        min_size = int(app.config.get('MODEL_MINIMUM_BYTES', 50 * 1024))  # default 50KB
-        if len(file_bytes) < min_size:
-            return jsonify({'error': 'Uploaded file is too small to be a valid model'}), 400
 
-        # Write bytes to disk
-        with open(save_path, 'wb') as f:
-            f.write(file_bytes)
+@app.route('/api/upload-model/sessions/<session_id>', methods=['PUT'])
+def append_model_upload(session_id):
+    """Upload one chunk; ``Content-Range: bytes <start>-<end>/<total>`` gives its position
 
-        return jsonify({'success': True, 'path': f'/static/models/{filename}', 'size': len(file_bytes)}), 200
+    A chunk that does not start at the stored offset is rejected with 409
+    and the offset to resume from.
+    """
+    try:
+        header = request.headers.get('Content-Range')
+        content_range = parse_content_range_header(header) if header else None
+        if header and content_range is None:
+            return jsonify({'error': 'Invalid Content-Range header'}), 400
+        start = content_range.start if content_range else 0
+        total = content_range.length if content_range else None
+        session = get_model_store().append(session_id, start, request.stream, total)
+        if session is None:
+            return jsonify({'error': 'Upload session not found'}), 404
+        return jsonify(_upload_session_response(session))
+    except UploadSessionConflict as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except ModelRejected as e:
+        return jsonify({'error': str(e)}), 400
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/upload-model/sessions/<session_id>', methods=['DELETE'])
+def abort_model_upload(session_id):
+    """Abandon a resumable upload and delete its partial data"""
+    if not get_model_store().abort_session(session_id):
+        return jsonify({'error': 'Upload session not found'}), 404
+    return jsonify({'success': True})
+
+
+@app.route('/static/models/<filename>')
+def serve_model(filename):
+    """Serve an uploaded model with a strong, content-based ETag
+
+    The frontend probes this URL with HEAD; clients revalidate and get 304
+    until the model's content actually changes.
+    """
+    safe_name = secure_filename(filename)
+    model_store = get_model_store()
+    if not safe_name or safe_name != filename or not os.path.isfile(model_store.path(safe_name)):
+        return jsonify({'error': 'File not found'}), 404
+    response = send_file(
+        os.path.abspath(model_store.path(safe_name)),
+        mimetype='application/octet-stream',
+        etag=model_store.digest(safe_name),
+        conditional=True,
+        max_age=0
+    )
+    response.cache_control.no_cache = True
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,81 @@
+"""
+Shared helpers for the benchmark scripts: statistics, JSON reports and
+baseline comparison.
+"""
+
+import json
+import math
+import platform
+import time
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(samples_ms):
+    """p50/p95/p99/mean/max of latency samples given in milliseconds"""
+    return {
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'mean_ms': round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+        'max_ms': round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
+
+
+def new_report(benchmark, results, **extra):
+    report = {
+        'benchmark': benchmark,
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+    report.update(extra)
+    report['results'] = results
+    return report
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_regressions(results, baseline_results, metrics, tolerance):
+    """Compare two ``{name: {metric: value}}`` maps.
+
+    ``metrics`` maps metric name -> True if higher is better (throughput),
+    False if lower is better (latency). Returns human-readable regressions
+    for every metric that is worse than the baseline by more than
+    ``tolerance`` (0.25 = 25%). Entries missing from either side are skipped.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline_results.get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in metrics.items():
+            if metric not in current or not previous.get(metric):
+                continue
+            if higher_is_better:
+                limit = previous[metric] * (1 - tolerance)
+                worse = current[metric] < limit
+            else:
+                limit = previous[metric] * (1 + tolerance)
+                worse = current[metric] > limit
+            if worse:
+                regressions.append(
+                    f'{name} {metric}: {current[metric]:.2f} vs limit {limit:.2f} '
+                    f'(baseline {previous[metric]:.2f})'
+                )
+    return regressions
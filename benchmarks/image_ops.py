@@ -0,0 +1,245 @@
+"""
+Micro-benchmarks for the image-processing hot paths.
+
+Synthetic frames are generated locally (no network access) at common camera
+resolutions and each operation is timed in a loop:
+
+- capture_decode: data URL split + base64 decode, as in /api/capture-photo
+- process_image_data: CameraService.process_image_data (decode to PIL)
+- decode_reduced:<size>: process_image_data with a target_size hint
+  (JPEG DCT-scaled decode), for preview, detection and thumbnail sizes
+- filter:<preset>: CameraService.apply_sith_filter for every preset
+- detect_faces: CameraService.detect_faces
+- optimize_image: CameraService.optimize_image (JPEG, 1280x720 bound)
+- thumbnail_from_jpeg: optimize_image to a 320px WebP straight from the
+  encoded JPEG, as the derivative pipeline does
+
+For every operation the report holds throughput, latency percentiles and
+peak memory. Peak memory is measured in a forked child as the rise of the
+process high-water RSS (VmHWM, reset through /proc/self/clear_refs), so
+allocations made by Pillow and OpenCV in C are counted as well.
+
+    python benchmarks/image_ops.py --output ops.json
+    python benchmarks/image_ops.py --baseline ops.json --tolerance 0.2
+"""
+
+import argparse
+import base64
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+from _report import find_regressions, latency_summary, load_report, new_report, write_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+from services.camera_service import CameraService, SITH_FILTER_PRESETS  # noqa: E402
+
+RESOLUTIONS = {
+    '640x480': (640, 480),
+    '1280x720': (Config.DEFAULT_CAMERA_WIDTH, Config.DEFAULT_CAMERA_HEIGHT),
+    '1920x1080': (1920, 1080),
+    '4032x3024': (4032, 3024),  # 12 MP phone capture
+}
+DEFAULT_RESOLUTIONS = ('640x480', '1280x720', '1920x1080')
+# target_size hints for decode_reduced
+DECODE_TARGETS = {
+    'preview': (1280, 720),
+    'detect': (480, None),
+    'thumb': (320, 320),
+}
+
+
+def synthetic_frame(width, height, seed=0):
+    """A deterministic camera-like RGB frame: gradients, a face-sized blob and sensor noise"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[..., 0] = 90 + 80 * x / width
+    frame[..., 1] = 70 + 60 * y / height
+    frame[..., 2] = 60 + 40 * (x + y) / (width + height)
+    # Skin-toned ellipse roughly where a face would be
+    cx, cy, rx, ry = width / 2, height / 2.3, width / 8, height / 4.5
+    inside = ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 <= 1
+    frame[inside] = (205, 160, 135)
+    frame += rng.normal(0, 6, frame.shape)
+    return Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8))
+
+
+def build_fixtures(width, height):
+    image = synthetic_frame(width, height)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return {'image': image, 'jpeg': buffer.getvalue(), 'data_url': data_url}
+
+
+def build_operations(service, fixtures):
+    """name -> zero-argument callable for one resolution"""
+    from PIL import Image
+
+    image = fixtures['image']
+    jpeg = fixtures['jpeg']
+    data_url = fixtures['data_url']
+
+    def capture_decode():
+        # Mirrors the decode in app.capture_photo
+        image_b64 = data_url.split(',', 1)[1] if ',' in data_url else data_url
+        return base64.b64decode(image_b64)
+
+    def process_image_data():
+        # Force a full decode; Image.open alone is lazy
+        decoded = service.process_image_data(data_url)
+        decoded.load()
+        return decoded
+
+    def decode_reduced(target_size):
+        def decode():
+            decoded = service.process_image_data(data_url, target_size=target_size)
+            decoded.load()
+            return decoded
+        return decode
+
+    def thumbnail_from_jpeg():
+        with Image.open(io.BytesIO(jpeg)) as source:
+            return service.optimize_image(source, 320, 320, quality=75, format='WEBP')
+
+    operations = {
+        'capture_decode': capture_decode,
+        'process_image_data': process_image_data,
+        'detect_faces': lambda: service.detect_faces(image),
+        'optimize_image': lambda: service.optimize_image(image),
+        'thumbnail_from_jpeg': thumbnail_from_jpeg,
+    }
+    for name, target_size in DECODE_TARGETS.items():
+        operations[f'decode_reduced:{name}'] = decode_reduced(target_size)
+    for preset in SITH_FILTER_PRESETS:
+        operations[f'filter:{preset}'] = (lambda p: lambda: service.apply_sith_filter(image, p))(preset)
+    return operations
+
+
+def time_operation(fn, min_iterations, min_seconds, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_iterations or time.perf_counter() - started < min_seconds:
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _status_kb(field):
+    """A kB field (VmRSS, VmHWM) from /proc/self/status"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _release_free_heap():
+    """Return freed malloc pages to the OS so new allocations show up in RSS (glibc)"""
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _peak_child(fn, conn):
+    try:
+        _release_free_heap()
+        # Writing 5 to clear_refs resets the VmHWM high-water mark, so the
+        # peak below belongs to this call and not to the forked parent
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        before = _status_kb('VmRSS')
+        fn()
+        conn.send(max(0, _status_kb('VmHWM') - before))
+    except Exception:
+        conn.send(None)
+    finally:
+        conn.close()
+
+
+def peak_memory_kb(fn):
+    """Peak RSS growth of one call, measured in a forked child (Linux); None if unsupported"""
+    if not os.path.exists('/proc/self/clear_refs') or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_peak_child, args=(fn, child))
+    process.start()
+    result = parent.recv() if parent.poll(60) else None
+    process.join()
+    return result
+
+
+def run(resolutions, only, min_iterations, min_seconds, warmup, measure_memory):
+    service = CameraService()
+    results = {}
+    for label in resolutions:
+        width, height = RESOLUTIONS[label]
+        fixtures = build_fixtures(width, height)
+        for name, fn in build_operations(service, fixtures).items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            samples = time_operation(fn, min_iterations, min_seconds, warmup)
+            row = {
+                'resolution': label,
+                'operation': name,
+                'iterations': len(samples),
+                'ops_per_sec': round(1000.0 / (sum(samples) / len(samples)), 2),
+            }
+            row.update(latency_summary(samples))
+            if measure_memory:
+                row['peak_memory_kb'] = peak_memory_kb(fn)
+            results[f'{name}@{label}'] = row
+            print(f"{name:<26} {label:>9}  {row['ops_per_sec']:>9.1f} ops/s  "
+                  f"p50 {row['p50_ms']:>8.2f}  p95 {row['p95_ms']:>8.2f}  p99 {row['p99_ms']:>8.2f} ms  "
+                  f"peak {row.get('peak_memory_kb') if row.get('peak_memory_kb') is not None else '-'} KiB",
+                  flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', nargs='+', default=list(DEFAULT_RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--only', nargs='+', help='operation name prefixes to run (e.g. filter: detect_faces)')
+    parser.add_argument('--iterations', type=int, default=20, help='minimum timed iterations per operation')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds per operation')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--no-memory', action='store_true', help='skip the forked peak-memory measurement')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed regression vs baseline (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    results = run(args.resolutions, args.only, args.iterations, args.min_time, args.warmup, not args.no_memory)
+
+    if args.output:
+        write_report(new_report('image_ops', results), args.output)
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_report(args.baseline)['results'],
+            {'p50_ms': False, 'p95_ms': False, 'ops_per_sec': True}, args.tolerance
+        )
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+End-to-end load test for the Star Wars Photobooth app.
+
+Starts the app under gunicorn (or the Werkzeug dev server) in a scratch
+directory with the Gemini stub, then replays photobooth visits from a
+growing number of concurrent virtual users. A visit is: the page, the
+mask list, a run of /api/apply-mask previews, then captures, each
+followed by a gallery refresh and sometimes a download and a delete.
+
+For every worker count and concurrency stage the report holds throughput,
+p50/p95/p99 latency and error rate per route, plus the peak and mean RSS
+of the whole server process tree (gunicorn master, workers and their
+image worker processes).
+
+    python benchmarks/load_test.py --workers 1 2 --concurrency 1 4 8 --output load.json
+    python benchmarks/load_test.py --mix preview=20,capture=2 --stage-seconds 30
+    python benchmarks/load_test.py --baseline load.json --tolerance 0.25
+
+With --baseline, the run fails (exit code 1) if throughput or latency
+regresses by more than the tolerance. --url points the traffic at an
+already running server instead (RSS is then sampled only with --pid).
+"""
+
+import argparse
+import base64
+import io
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from _report import find_regressions, latency_summary, load_report, new_report, write_report
+from image_ops import synthetic_frame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Requests per visit; fractions are probabilities. gallery, download and
+# delete are per capture (the gallery is refreshed after every capture).
+DEFAULT_MIX = {
+    'page': 1,
+    'masks': 1,
+    'preview': 8,
+    'capture': 1,
+    'gallery': 1,
+    'download': 0.5,
+    'delete': 0.5,
+}
+FACE_DATA = {'normalizedX': 0.38, 'normalizedY': 0.22, 'normalizedWidth': 0.24, 'normalizedHeight': 0.42}
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (value or '').split(',')):
+        name, _, count = item.partition('=')
+        if name not in mix:
+            raise argparse.ArgumentTypeError(f"unknown mix entry {name!r} (choose from {', '.join(mix)})")
+        mix[name] = float(count)
+    return mix
+
+
+def repeat(count, rng):
+    """Whole part of ``count`` plus one more with probability of its fraction"""
+    whole = int(count)
+    return whole + (1 if rng.random() < count - whole else 0)
+
+
+def jpeg_bytes(size, seed, quality=85):
+    buffer = io.BytesIO()
+    synthetic_frame(*size, seed=seed).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def data_url(image_bytes):
+    return 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode('ascii')
+
+
+# Server under test
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_env(scratch, stub_latency):
+    env = dict(os.environ)
+    uploads = os.path.join(scratch, 'uploads')
+    env.update({
+        'UPLOAD_FOLDER': uploads,
+        'PHOTO_INDEX_PATH': os.path.join(uploads, 'photo_index.sqlite3'),
+        'DERIVATIVE_DIR': os.path.join(uploads, 'derivatives'),
+        'BURST_DIR': os.path.join(uploads, 'bursts'),
+        'GEMINI_CACHE_DIR': os.path.join(scratch, 'gemini-cache'),
+        'FRAME_CACHE_DIR': os.path.join(scratch, 'frames'),
+        'GEMINI_USE_STUB': '1',
+        'GEMINI_STUB_LATENCY': str(stub_latency),
+        'ENABLE_AI_PROCESSING': '1',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def start_server(kind, workers, threads, env):
+    """Launch the app; returns (process, base_url) once it answers"""
+    port = free_port()
+    if kind == 'gunicorn':
+        command = [
+            sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+            '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'
+        ]
+    else:
+        command = [
+            sys.executable, '-c',
+            f'from app import app; app.run(host="127.0.0.1", port={port}, threaded=True, debug=False)'
+        ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited: {process.stderr.read().decode('utf-8', 'replace')[-2000:]}")
+        try:
+            if requests.get(base_url + '/api/masks', timeout=2).ok:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError('server did not start within 60s')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of ``pid`` and all its descendants (Linux /proc)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The command name may contain spaces; fields resume after ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Samples a process tree's RSS in the background while a stage runs"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.samples.append(process_tree_rss(self.pid))
+            except OSError:
+                pass
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        if not self.samples:
+            return {}
+        return {
+            'rss_peak_mb': round(max(self.samples) / 1024 / 1024, 1),
+            'rss_mean_mb': round(sum(self.samples) / len(self.samples) / 1024 / 1024, 1),
+        }
+
+
+# Virtual users
+
+class Visitor:
+    """One virtual user looping over photobooth visits until the stage ends"""
+
+    def __init__(self, base_url, fixtures, mix, options, seed, record):
+        self.base_url = base_url
+        self.fixtures = fixtures
+        self.mix = mix
+        self.options = options
+        self.rng = random.Random(seed)
+        self.record = record
+        self.session = requests.Session()
+        self.mask_ids = ['vader-mask']
+
+    def request(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.options.timeout, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(route, (time.perf_counter() - started) * 1000, ok)
+        if self.options.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.options.think_time))
+        return response if ok else None
+
+    def visit(self):
+        rng = self.rng
+        for _ in range(repeat(self.mix['page'], rng)):
+            self.request('GET /', 'GET', '/')
+        for _ in range(repeat(self.mix['masks'], rng)):
+            response = self.request('GET /api/masks', 'GET', '/api/masks')
+            if response is not None:
+                self.mask_ids = [mask['id'] for mask in response.json() if mask.get('image')] or self.mask_ids
+
+        preview = self.fixtures['preview']
+        for _ in range(repeat(self.mix['preview'], rng)):
+            self.request('POST /api/apply-mask', 'POST', '/api/apply-mask', json={
+                'image': preview,
+                'mask_id': rng.choice(self.mask_ids),
+                'face_data': FACE_DATA,
+                'response': self.options.preview_response
+            })
+
+        for _ in range(repeat(self.mix['capture'], rng)):
+            # Trailing bytes after the JPEG end marker make each capture
+            # unique, so content-addressed storage can't deduplicate them
+            capture = rng.choice(self.fixtures['captures']) + os.urandom(16)
+            response = self.request('POST /api/capture-photo', 'POST', '/api/capture-photo', json={
+                'image': data_url(capture),
+                'mask': rng.choice(self.mask_ids)
+            })
+            for _ in range(repeat(self.mix['gallery'], rng)):
+                self.request('GET /api/gallery', 'GET', '/api/gallery')
+            if response is None:
+                continue
+            filename = response.json()['filename']
+            if rng.random() < self.mix['download']:
+                self.request('GET /api/download/<filename>', 'GET', f'/api/download/{filename}')
+            if rng.random() < self.mix['delete']:
+                self.request('DELETE /api/delete-photo/<filename>', 'DELETE', f'/api/delete-photo/{filename}')
+
+
+def run_stage(base_url, concurrency, seconds, fixtures, mix, options, pid):
+    samples = {}
+    lock = threading.Lock()
+
+    def record(route, latency_ms, ok):
+        with lock:
+            latencies, errors = samples.setdefault(route, ([], [0]))
+            latencies.append(latency_ms)
+            if not ok:
+                errors[0] += 1
+
+    deadline = time.monotonic() + seconds
+
+    def user(index):
+        visitor = Visitor(base_url, fixtures, mix, options, options.seed * 1000 + index, record)
+        while time.monotonic() < deadline:
+            visitor.visit()
+
+    sampler = RssSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+    started = time.monotonic()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    memory = sampler.stop() if sampler else {}
+
+    routes = {}
+    for route, (latencies, errors) in sorted(samples.items()):
+        routes[route] = dict(
+            requests=len(latencies),
+            rps=round(len(latencies) / elapsed, 2),
+            error_rate=round(errors[0] / len(latencies), 4),
+            **latency_summary(latencies)
+        )
+    all_latencies = [latency for latencies, _ in samples.values() for latency in latencies]
+    total_errors = sum(errors[0] for _, errors in samples.values())
+    total = dict(
+        requests=len(all_latencies),
+        rps=round(len(all_latencies) / elapsed, 2),
+        error_rate=round(total_errors / len(all_latencies), 4) if all_latencies else 0.0,
+        **latency_summary(all_latencies),
+        **memory
+    )
+    return routes, total
+
+
+def print_stage(label, routes, total):
+    print(f"\n{label}")
+    width = max([len(route) for route in routes] + [5])
+    print(f"{'route':<{width}}  {'reqs':>6}  {'req/s':>7}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'errors':>7}")
+    for route, row in list(routes.items()) + [('total', total)]:
+        print(f"{route:<{width}}  {row['requests']:>6}  {row['rps']:>7.1f}  {row['p50_ms']:>8.1f}  "
+              f"{row['p95_ms']:>8.1f}  {row['p99_ms']:>8.1f}  {row['error_rate']:>7.1%}")
+    if 'rss_peak_mb' in total:
+        print(f"server RSS: peak {total['rss_peak_mb']} MB, mean {total['rss_mean_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), default='gunicorn')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2], help='gunicorn worker counts to compare')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='virtual users per stage')
+    parser.add_argument('--stage-seconds', type=float, default=15.0)
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='per-visit request counts, e.g. preview=12,capture=1,delete=0.8')
+    parser.add_argument('--preview-size', type=parse_size, default=(640, 480))
+    parser.add_argument('--preview-response', choices=('full', 'handle', 'binary'), default='full')
+    parser.add_argument('--capture-sizes', type=parse_size, nargs='+', default=[(1280, 720), (1920, 1080)])
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean seconds between a user\'s requests')
+    parser.add_argument('--stub-latency', type=float, default=0.5, help='seconds per stubbed Gemini call')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='load an already running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='with --url: server process whose tree RSS is sampled')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed regression vs baseline (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    fixtures = {
+        'preview': data_url(jpeg_bytes(args.preview_size, seed=0, quality=80)),
+        'captures': [jpeg_bytes(size, seed=i + 1, quality=92) for i, size in enumerate(args.capture_sizes)],
+    }
+
+    results = {}
+    worker_counts = [None] if args.url else args.workers
+    for workers in worker_counts:
+        scratch = tempfile.mkdtemp(prefix='photobooth-load-')
+        process = None
+        try:
+            if args.url:
+                base_url, pid = args.url.rstrip('/'), args.pid
+            else:
+                process, base_url = start_server(args.server, workers, args.threads,
+                                                 server_env(scratch, args.stub_latency))
+                pid = process.pid
+            for concurrency in args.concurrency:
+                prefix = f"c{concurrency}" if workers is None else f"w{workers} c{concurrency}"
+                routes, total = run_stage(base_url, concurrency, args.stage_seconds, fixtures, args.mix, args, pid)
+                print_stage(f"{prefix}: {args.stage_seconds:g}s", routes, total)
+                for route, row in routes.items():
+                    results[f"{prefix} {route}"] = row
+                results[f"{prefix} total"] = total
+        finally:
+            if process is not None:
+                stop_server(process)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+        write_report(new_report('load_test', results, config=config), args.output)
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_report(args.baseline)['results'],
+            {'rps': True, 'p95_ms': False, 'p99_ms': False, 'error_rate': False}, args.tolerance
+        )
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
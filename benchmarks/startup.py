@@ -0,0 +1,166 @@
+"""
+Cold-start benchmark for the Star Wars Photobooth app.
+
+Each sample runs in a fresh interpreter and measures how long ``import app``
+takes and how long the first request to one route takes, so lazily built
+services are charged to the route that needs them.
+
+    python benchmarks/startup.py --runs 5 --output startup.json
+    python benchmarks/startup.py --baseline startup.json --tolerance 0.25
+
+With --baseline, the run fails (exit code 1) if any median regresses by
+more than the tolerance. Routes listed in BUDGETS also fail the run when
+their median first request is over budget or pulls in a module they must
+not need (--no-budgets skips that check).
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from _report import find_regressions, load_report, new_report, write_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (method, path, JSON body)
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/api/masks', None),
+    ('GET', '/api/gallery', None),
+    ('GET', '/api/ai/status', None),
+    ('POST', '/api/apply-mask', 'frame'),
+]
+
+# Modules whose import dominates a cold start
+HEAVY_MODULES = ('cv2', 'numpy', 'google.generativeai')
+
+# route -> (max median first_request_ms, heavy modules it must not import).
+# /api/masks reads the precomputed analysis in static/masks/manifest.json
+# (flask build-assets); a change that makes it analyze masks again trips this.
+BUDGETS = {
+    'GET /api/masks': (50.0, ('cv2', 'numpy')),
+}
+
+PROBE = r'''
+import base64, io, json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+method, path, body = json.loads(sys.argv[1])
+if body == 'frame':
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (40, 40, 40)).save(buffer, 'JPEG')
+    body = {
+        'image': 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii'),
+        'mask_id': 'vader-mask',
+        'face_data': {'x': 220, 'y': 120, 'width': 200, 'height': 240}
+    }
+client = app_module.app.test_client()
+before = time.perf_counter()
+response = client.open(path, method=method, json=body)
+done = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (done - before) * 1000,
+    'heavy_modules': [name for name in json.loads(sys.argv[2]) if name in sys.modules]
+}))
+'''
+
+
+def run_probe(route, env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, json.dumps(route), json.dumps(HEAVY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs):
+    scratch = tempfile.mkdtemp(prefix='photobooth-startup-')
+    env = dict(os.environ)
+    env.update({
+        'UPLOAD_FOLDER': os.path.join(scratch, 'uploads'),
+        'PHOTO_INDEX_PATH': os.path.join(scratch, 'uploads', 'photo_index.sqlite3'),
+        'GEMINI_CACHE_DIR': os.path.join(scratch, 'gemini-cache'),
+        'GEMINI_USE_STUB': '1',
+        'GEMINI_STUB_LATENCY': '0',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+
+    results = {}
+    try:
+        for method, path, body in ROUTES:
+            samples = [run_probe((method, path, body), env) for _ in range(runs)]
+            results[f'{method} {path}'] = {
+                'status': samples[-1]['status'],
+                'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2),
+                'first_request_ms': round(statistics.median(s['first_request_ms'] for s in samples), 2),
+                'heavy_modules': sorted({name for s in samples for name in s['heavy_modules']}),
+                'runs': runs,
+            }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def check_budgets(results):
+    """Lines describing routes that exceed their BUDGETS entry"""
+    violations = []
+    for route, (max_ms, forbidden) in BUDGETS.items():
+        row = results.get(route)
+        if row is None:
+            continue
+        if row['first_request_ms'] > max_ms:
+            violations.append(f"{route}: first request {row['first_request_ms']:.1f} ms > {max_ms:.0f} ms budget")
+        imported = [name for name in forbidden if name in row['heavy_modules']]
+        if imported:
+            violations.append(f"{route}: imports {', '.join(imported)}")
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per route (median is reported)')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown vs baseline (0.25 = 25%%)')
+    parser.add_argument('--no-budgets', action='store_true', help='skip the per-route BUDGETS check')
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+
+    width = max(len(route) for route in results)
+    print(f"{'route':<{width}}  status  import ms  first request ms  heavy modules")
+    for route, row in results.items():
+        print(f"{route:<{width}}  {row['status']:>6}  {row['import_ms']:>9.1f}  {row['first_request_ms']:>16.1f}"
+              f"  {', '.join(row['heavy_modules']) or '-'}")
+
+    if args.output:
+        write_report(new_report('startup', results), args.output)
+
+    failed = False
+    if not args.no_budgets:
+        for line in check_budgets(results):
+            print(f'OVER BUDGET {line}')
+            failed = True
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_report(args.baseline)['results'],
+            {'import_ms': False, 'first_request_ms': False}, args.tolerance
+        )
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
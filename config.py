@@ -8,7 +8,82 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY') or 'your-gemini-api-key'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-    UPLOAD_FOLDER = 'uploads'
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'uploads'
+    
+    # Photo storage: content-addressed blobs in hash-sharded directories
+    PHOTO_STORE_BACKEND = os.environ.get('PHOTO_STORE_BACKEND') or 'filesystem'  # or 's3' (needs boto3)
+    PHOTO_STORE_ROOT = os.environ.get('PHOTO_STORE_ROOT') or UPLOAD_FOLDER
+    PHOTO_STORE_S3_BUCKET = os.environ.get('PHOTO_STORE_S3_BUCKET')
+    PHOTO_STORE_S3_PREFIX = 'photos/'
+    PHOTO_STORE_S3_ENDPOINT = os.environ.get('PHOTO_STORE_S3_ENDPOINT')  # e.g. a local MinIO
+    
+    # Storage maintenance: background recompression and disk budget
+    ENABLE_STORAGE_MAINTENANCE = True
+    STORAGE_BUDGET_BYTES = int(os.environ.get('STORAGE_BUDGET_BYTES') or 0) or None  # None = unlimited
+    STORAGE_EVICTION_ORDER = 'age'  # or 'access' (least recently downloaded/viewed first)
+    RECOMPRESS_FORMAT = 'JPEG'  # progressive JPEG; 'WEBP' is smaller but changes the download type
+    RECOMPRESS_QUALITY = 82
+    RECOMPRESS_MIN_SAVINGS = 0.1  # keep a re-encode only if it is at least 10% smaller
+    MAINTENANCE_SLICE_SECONDS = 0.2  # longest uninterrupted stretch of maintenance work
+    MAINTENANCE_INTERVAL = 5.0  # seconds between slices; slices are skipped while requests are in flight
+    
+    # Gallery settings
+    PHOTO_INDEX_PATH = os.environ.get('PHOTO_INDEX_PATH') or os.path.join(UPLOAD_FOLDER, 'photo_index.sqlite3')
+    GALLERY_PAGE_SIZE = 40
+    GALLERY_MAX_PAGE_SIZE = 200
+    
+    # Thumbnail / derivative settings
+    DERIVATIVE_DIR = os.environ.get('DERIVATIVE_DIR') or os.path.join(UPLOAD_FOLDER, 'derivatives')
+    DERIVATIVE_FORMATS = ('WEBP',)  # generated eagerly; JPEG is produced on demand
+    DERIVATIVE_WORKERS = 2
+    DERIVATIVE_CACHE_SECONDS = 365 * 24 * 3600
+    
+    # Gemini metadata for /api/apply-mask previews
+    ENABLE_AI_PROCESSING = os.environ.get('ENABLE_AI_PROCESSING', '').lower() in ('1', 'true', 'yes')
+    
+    # Offline stand-in for the Gemini client (tests, load runs)
+    GEMINI_USE_STUB = os.environ.get('GEMINI_USE_STUB', '').lower() in ('1', 'true', 'yes')
+    GEMINI_STUB_LATENCY = float(os.environ.get('GEMINI_STUB_LATENCY') or 0.5)
+    GEMINI_STUB_ERROR = os.environ.get('GEMINI_STUB_ERROR')  # make every stub call fail with this message
+    
+    # Gemini admission control (per worker): calls that are refused, or that
+    # fail, fall back to the local Sith filter instead of waiting on the API
+    GEMINI_RATE_LIMIT = float(os.environ.get('GEMINI_RATE_LIMIT') or 2.0)  # calls/s; 0 disables the limiter
+    GEMINI_RATE_BURST = 4
+    GEMINI_MAX_CONCURRENCY = 4  # calls in flight; further calls are refused at once
+    GEMINI_BREAKER_FAILURES = 5  # consecutive failures (or slow calls) that open the breaker
+    GEMINI_BREAKER_RESET = 30  # seconds the breaker stays open before a probe call
+    GEMINI_SLOW_CALL_SECONDS = 10  # slower calls count as failures
+    GEMINI_CALL_TIMEOUT = 30  # seconds; callers stop waiting (queued jobs: at most their deadline)
+    AI_FALLBACK_FILTER = 'sith-lord'  # for masks without a filter preset of the same name
+    
+    # Asynchronous AI jobs (POST /api/apply-mask with "async": true)
+    ENABLE_ASYNC_AI = True
+    AI_JOB_WORKERS = 2
+    AI_JOB_QUEUE_SIZE = 16  # pending jobs beyond this are rejected with 429
+    AI_JOB_TIMEOUT = 60  # seconds
+    
+    # Gemini response cache (shared on disk by all workers)
+    GEMINI_CACHE_DIR = os.environ.get('GEMINI_CACHE_DIR') or os.path.join('.cache', 'gemini')
+    GEMINI_CACHE_TTL = 24 * 3600
+    GEMINI_CACHE_SIZE = 256
+    GEMINI_CACHE_PERCEPTUAL = False  # key images by difference hash instead of SHA-256
+    
+    # Instrumentation (/metrics, Prometheus text format)
+    ENABLE_METRICS = True
+    METRICS_TIMING_LOG = os.environ.get('METRICS_TIMING_LOG', '').lower() in ('1', 'true', 'yes')  # JSON line per request
+    
+    # Static assets: content-hashed /assets/ URLs, cached forever
+    ENABLE_ASSET_FINGERPRINTING = True
+    STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR') or os.path.join('.cache', 'assets')  # manifest + .gz/.br copies
+    ASSET_CACHE_SECONDS = 365 * 24 * 3600
+    MASK_FILE_CACHE_SECONDS = 3600  # un-fingerprinted /static/masks/ URLs
+    
+    # MediaPipe model uploads (static/models)
+    MODEL_MINIMUM_BYTES = 50 * 1024
+    MODEL_MAXIMUM_BYTES = 64 * 1024 * 1024  # overrides MAX_CONTENT_LENGTH for model uploads
+    MODEL_UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024  # suggested chunk size for resumable uploads
+    MODEL_UPLOAD_SESSION_TTL = 24 * 3600
     
     # Audio settings
     ENABLE_AUDIO = True
@@ -18,6 +93,47 @@ class Config:
     DEFAULT_CAMERA_WIDTH = 1280
     DEFAULT_CAMERA_HEIGHT = 720
     
+    # Image worker processes for decode/filter/detect/encode; 0 runs them on
+    # the request threads (serverless hosts can't keep worker processes)
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 0)
+    IMAGE_TASK_TIMEOUT = 30  # seconds; the worker is killed and replaced
+    
+    # Mask compositing settings
+    ENABLE_SERVER_COMPOSITING = True
+    MASK_CACHE_SIZE = 64  # pre-scaled mask variants kept in memory
+    MASK_RELOAD_INTERVAL = 2.0  # seconds between checks of static/masks for changed files
+    MASK_THUMBNAIL_SIZE = 64  # px, longest side of the thumbnails in /api/masks
+    MASK_WARP_MODE = 'affine'  # fit masks to face landmarks: 'affine', 'perspective' or None (box placement)
+    MASK_POSE_QUANTUM = 2.0  # px; landmark rounding so near-identical poses share a warped mask
+    MASK_WARP_CACHE_SIZE = 256  # warped masks kept in memory
+    
+    # Frame handles for /api/apply-mask (upload a frame once, preview many masks)
+    FRAME_CACHE_DIR = os.environ.get('FRAME_CACHE_DIR') or os.path.join('.cache', 'frames')  # shared by workers
+    FRAME_CACHE_MAX_BYTES = 64 * 1024 * 1024  # in-memory LRU per worker
+    FRAME_CACHE_TTL = 600  # seconds; expired handles answer 404 and the client re-uploads
+    
+    # Burst capture ("boomerang") settings
+    BURST_DIR = os.environ.get('BURST_DIR') or os.path.join(UPLOAD_FOLDER, 'bursts')  # frames being collected
+    BURST_MAX_FRAMES = 40
+    BURST_MAX_BYTES = 64 * 1024 * 1024  # overrides MAX_CONTENT_LENGTH for single-request bursts
+    BURST_FORMATS = ('WEBP',)  # 'GIF' for wider compatibility; 'MP4' needs ffmpeg on PATH
+    BURST_FPS = 10
+    BURST_MAX_SIZE = 720  # longest side of encoded frames
+    BURST_QUALITY = 80
+    BURST_WORKERS = 2  # encoder processes
+    BURST_QUEUE_SIZE = 8  # pending encodes beyond this are rejected with 429
+    BURST_ENCODE_TIMEOUT = 120  # seconds
+    BURST_SESSION_TTL = 3600
+    FFMPEG_PATH = os.environ.get('FFMPEG_PATH')  # default: ffmpeg from PATH, if any
+    
+    # Live preview channel (push frames, stream composited MJPEG back). Sessions
+    # are per worker, so pushes and the stream must reach the same process
+    PREVIEW_MAX_SESSIONS = 16  # each open stream holds a request thread
+    PREVIEW_IDLE_TIMEOUT = 30  # seconds without a pushed frame before a session ends
+    PREVIEW_MAX_FRAME_AGE = 1.0  # seconds; older pending frames are skipped, not rendered
+    PREVIEW_MAX_FPS = 15  # per session
+    PREVIEW_QUALITY = 70
+    
     # Filter settings
     FILTER_QUALITY = 'high'
     ENABLE_REAL_TIME_FILTERS = True
@@ -0,0 +1,291 @@
+"""
+Animation Service for Star Wars Photobooth
+Burst captures encoded to animated WebP/GIF (and MP4) in a process pool
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from services.camera_service import CameraService
+from services.image_executor import ImageExecutor
+from services.job_queue import Job, QueueFull
+from services.metrics import record_stage
+from services.upload_stream import StreamedUpload, stream_to_tempfile
+
+ANIMATED_FORMATS = ('WEBP', 'GIF')
+VIDEO_FORMATS = ('MP4',)
+FORMAT_EXTENSIONS = {'WEBP': '.webp', 'GIF': '.gif', 'MP4': '.mp4'}
+FRAME_MAGIC = (b'\xff\xd8', b'\x89PNG')
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_frames(frame_paths, max_size, filter_type):
+    camera_service = CameraService()
+    frames = []
+    for path in frame_paths:
+        with Image.open(path) as image:
+            # JPEG frames are decoded at reduced resolution, close to max_size
+            frames.append(camera_service.reduce_image(image, (max_size, max_size)).convert('RGB'))
+    # Normalise sizes: animated formats need every frame the same size
+    size = frames[0].size
+    frames = [frame if frame.size == size else frame.resize(size, Image.Resampling.BILINEAR) for frame in frames]
+    if filter_type:
+        frames = camera_service.apply_sith_filter_batch(frames, filter_type)
+    return frames
+
+
+def _encode_video(frames, path, fps, quality, ffmpeg_path, timeout):
+    # libx264 needs even dimensions; frames go in as JPEGs over a pipe
+    crf = str(max(18, min(35, int(51 - quality * 0.4))))
+    command = [
+        ffmpeg_path, '-y', '-loglevel', 'error', '-f', 'image2pipe', '-framerate', str(fps),
+        '-i', '-', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-c:v', 'libx264',
+        '-pix_fmt', 'yuv420p', '-crf', crf, '-movflags', '+faststart', path
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for frame in frames:
+            frame.save(process.stdin, format='JPEG', quality=95)
+        process.stdin.close()
+        _, stderr = process.communicate(timeout=timeout)
+    except Exception:
+        process.kill()
+        process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode('utf-8', 'replace').strip()}")
+
+
+def encode_burst(frame_paths, output_dir, formats=('WEBP',), filter_type=None, fps=10, boomerang=True,
+                 max_size=720, quality=80, ffmpeg_path=None, timeout=120):
+    """Encode frames into each requested format (runs in a worker process).
+
+    Outputs are written next to the frames and described as
+    ``{format: {'path', 'size', 'sha256', 'head'}}`` plus the frame size
+    and count, so only file names cross the process boundary.
+    """
+    started = time.perf_counter()
+    frames = _load_frames(frame_paths, max_size, filter_type)
+    if boomerang and len(frames) > 2:
+        frames = frames + frames[-2:0:-1]
+    duration = int(round(1000 / fps))
+
+    outputs = {}
+    for format in formats:
+        path = os.path.join(output_dir, 'output' + FORMAT_EXTENSIONS[format])
+        if format == 'WEBP':
+            frames[0].save(path, format='WEBP', save_all=True, append_images=frames[1:],
+                           duration=duration, loop=0, quality=quality, method=4)
+        elif format == 'GIF':
+            palettized = [frame.convert('P', palette=Image.Palette.ADAPTIVE, colors=256) for frame in frames]
+            palettized[0].save(path, format='GIF', save_all=True, append_images=palettized[1:],
+                               duration=duration, loop=0, disposal=1)
+        elif format == 'MP4':
+            _encode_video(frames, path, fps, quality, ffmpeg_path, timeout)
+        with open(path, 'rb') as f:
+            head = f.read(16)
+        outputs[format] = {'path': path, 'size': os.path.getsize(path), 'sha256': _file_digest(path), 'head': head}
+    return {
+        'outputs': outputs,
+        'width': frames[0].width,
+        'height': frames[0].height,
+        'frames': len(frames),
+        'seconds': time.perf_counter() - started
+    }
+
+
+class AnimationService:
+    """Burst sessions spooled to disk and encoded off the request workers.
+
+    Frames arrive all at once or one request at a time and are written to
+    ``<burst_dir>/<session_id>/`` (any gunicorn worker can add to a
+    session). ``submit`` hands the frame paths to an ImageExecutor that
+    decodes, filters and encodes them in worker processes, so encoding
+    uses other cores and never blocks a request thread (and an encode that
+    hangs is killed after ``encode_timeout``); ``on_done(session_id,
+    result)`` then runs in this process to store the outputs. MP4 is
+    produced only when an ``ffmpeg`` binary is available.
+    """
+
+    def __init__(self, burst_dir, max_workers=2, max_pending=8, max_frames=40, session_ttl=3600,
+                 encode_timeout=120, ffmpeg_path=None, result_ttl=300, executor=None):
+        self.logger = logging.getLogger(__name__)
+        self.burst_dir = burst_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_frames = max_frames
+        self.session_ttl = session_ttl
+        self.encode_timeout = encode_timeout
+        self.result_ttl = result_ttl
+        self.ffmpeg_path = shutil.which(ffmpeg_path or 'ffmpeg')
+        # Bursts get their own workers so long encodes never queue ahead of previews
+        self.executor = executor or ImageExecutor(max_workers, task_timeout=encode_timeout, name='burst-worker')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.counters = {'encoded': 0, 'failed': 0}
+        os.makedirs(burst_dir, exist_ok=True)
+
+    @property
+    def video_available(self):
+        return self.ffmpeg_path is not None
+
+    # Sessions
+
+    def session_dir(self, session_id):
+        if not session_id or not session_id.isalnum():
+            return None
+        path = os.path.join(self.burst_dir, session_id)
+        return path if os.path.isdir(path) else None
+
+    def create_session(self):
+        self.prune_sessions()
+        session_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.burst_dir, session_id))
+        return session_id
+
+    def frame_paths(self, session_id):
+        directory = self.session_dir(session_id)
+        if directory is None:
+            return None
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith('frame-'))
+
+    def add_frame(self, session_id, stream, max_bytes=None):
+        """Spool one JPEG/PNG frame; returns the session's frame count.
+
+        Raises LookupError for an unknown session and ValueError when the
+        frame is not an image or the session is full.
+        """
+        directory = self.session_dir(session_id)
+        if directory is None:
+            raise LookupError(session_id)
+        if len(self.frame_paths(session_id)) >= self.max_frames:
+            raise ValueError(f"A burst holds at most {self.max_frames} frames")
+        upload = stream_to_tempfile(stream, directory, max_bytes=max_bytes)
+        if upload.size == 0 or not upload.head.startswith(FRAME_MAGIC):
+            upload.discard()
+            raise ValueError('Frames must be JPEG or PNG images')
+        # Nanosecond names keep frames in arrival order across workers
+        upload.commit(os.path.join(directory, f"frame-{time.time_ns():020d}-{uuid.uuid4().hex[:6]}"))
+        return len(self.frame_paths(session_id))
+
+    def abort_session(self, session_id):
+        directory = self.session_dir(session_id)
+        if directory is None:
+            return False
+        shutil.rmtree(directory, ignore_errors=True)
+        return True
+
+    def prune_sessions(self):
+        """Delete sessions untouched for longer than the TTL"""
+        cutoff = time.time() - self.session_ttl
+        for name in os.listdir(self.burst_dir):
+            path = os.path.join(self.burst_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    # Encoding
+
+    def resolve_formats(self, formats):
+        """Formats that will actually be produced for a request"""
+        formats = [f for f in formats if f in ANIMATED_FORMATS or (f in VIDEO_FORMATS and self.video_available)]
+        if not any(f in ANIMATED_FORMATS for f in formats):
+            formats.insert(0, 'WEBP')  # the gallery always gets an animated image
+        return formats
+
+    def submit(self, session_id, on_done, formats=('WEBP',), filter_type=None, fps=10, boomerang=True,
+               max_size=720, quality=80):
+        """Encode a session's frames in the pool; returns a Job to poll.
+
+        Raises LookupError for an unknown session, ValueError when it has
+        fewer than two frames and QueueFull when too many encodes are pending.
+        """
+        frame_paths = self.frame_paths(session_id)
+        if frame_paths is None:
+            raise LookupError(session_id)
+        if len(frame_paths) < 2:
+            raise ValueError('A burst needs at least two frames')
+        formats = self.resolve_formats(formats)
+
+        self._prune_jobs()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"Burst encoder is busy ({self.max_pending} pending)")
+            self._pending += 1
+
+        job = Job(encode_burst, (), {}, self.encode_timeout)
+        job.status = 'running'
+        job.started = time.time()
+        with self._lock:
+            self._jobs[job.id] = job
+        future = self.executor.submit(
+            encode_burst, frame_paths, self.session_dir(session_id), tuple(formats), filter_type,
+            fps, boomerang, max_size, quality, self.ffmpeg_path, self.encode_timeout
+        )
+        future.add_done_callback(lambda f: self._finished(job, session_id, on_done, f))
+        return job
+
+    def _finished(self, job, session_id, on_done, future):
+        try:
+            result = future.result()
+            record_stage('bursts.encode', result['seconds'])
+            stored = on_done(session_id, result)
+            outcome = ('done', stored, None)
+            self._count(encoded=1)
+        except Exception as e:
+            self.logger.error(f"Burst {session_id} failed: {e}")
+            outcome = ('failed', None, str(e))
+            self._count(failed=1)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self.abort_session(session_id)
+        if not job.done:
+            job._finish(*outcome)
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune_jobs(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished < cutoff]:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = self._pending
+        stats['workers'] = self.max_workers
+        stats['capacity'] = self.max_pending
+        stats['video_available'] = self.video_available
+        return stats
+
+
+def stored_output(output):
+    """StreamedUpload for an encoded output, ready for ``PhotoStore.put_upload``"""
+    return StreamedUpload(output['path'], output['size'], output['sha256'], output['head'])
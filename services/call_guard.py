@@ -0,0 +1,305 @@
+"""
+Call Guard for Star Wars Photobooth
+Rate limiting, concurrency cap and circuit breaker for calls to a remote API
+"""
+
+import logging
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CallRejected(Exception):
+    """Raised instead of making a call the guard does not allow right now"""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(f"Call rejected ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to the remote service.
+
+    ``try_acquire`` never blocks. After a failure ``decrease`` halves the
+    rate (down to ``min_rate``); each success adds ``rate_step`` back, up
+    to the configured rate, so throughput recovers gradually (AIMD).
+    """
+
+    def __init__(self, rate, burst=None, min_rate=None, rate_step=None, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.rate_step = rate_step if rate_step is not None else rate / 10
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update; caller holds the lock"""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token; returns 0 on success, else seconds until one is due"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def decrease(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def increase(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """Stops calling a failing service, then probes it before recovering.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    refuses every call for ``reset_timeout`` seconds. It then lets one
+    probe call through (half-open): success closes it, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        """State, moving open -> half-open once the timeout passes; caller holds the lock"""
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def allow(self):
+        """Claim permission for one call; returns 0 if allowed, else seconds to wait"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return 0.0
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return 0.0
+            if state == OPEN:
+                return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+            return float(self.reset_timeout)  # a probe is already in flight
+
+    def cancel(self):
+        """Give back a permission that was never used"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.times_opened += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
+                self._probing = False
+
+    def consecutive_failures(self):
+        with self._lock:
+            return self._failures
+
+
+class CallGuard:
+    """Admission control around a slow or unreliable remote call.
+
+    A call must pass the circuit breaker, take a token from the rate
+    limiter and get one of ``max_concurrency`` slots (waiting at most
+    ``max_wait`` seconds); otherwise ``call`` raises CallRejected at once
+    so the caller can degrade instead of piling up behind a stuck API.
+    Errors and calls slower than ``slow_call_seconds`` count as failures:
+    they trip the breaker and slow the limiter down. Calls longer than
+    ``call_timeout`` (or the per-call ``timeout``) raise TimeoutError in
+    the caller. Limits apply per process; under gunicorn divide the API
+    quota by the worker count.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=None, max_concurrency=None, max_wait=0.0,
+                 failure_threshold=5, reset_timeout=30, slow_call_seconds=None, call_timeout=None,
+                 clock=time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.bucket = TokenBucket(rate, burst, min_rate, clock=clock) if rate else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, clock=clock)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.slow_call_seconds = slow_call_seconds
+        self.call_timeout = call_timeout
+        self._abandoned = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0, 'succeeded': 0, 'failed': 0, 'slow': 0, 'timeouts': 0,
+            'rejected_open': 0, 'rejected_rate': 0, 'rejected_concurrency': 0
+        }
+
+    def allows(self):
+        """Whether a call could be attempted now (the breaker is not open)"""
+        return self.breaker.state != OPEN
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """Run ``fn`` if admitted; raises CallRejected otherwise.
+
+        With a timeout (the smaller of ``timeout`` and ``call_timeout``)
+        ``fn`` runs on a helper thread and the caller gets TimeoutError
+        once it overruns. The abandoned call keeps its concurrency slot
+        until it really returns, so hung calls cannot pile up past
+        ``max_concurrency``.
+        """
+        limits = [t for t in (timeout, self.call_timeout) if t is not None]
+        if limits:
+            return self._call_with_timeout(min(limits), fn, args, kwargs)
+        self._admit()
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self._record(False, time.perf_counter() - started)
+            raise
+        finally:
+            self._leave()
+        self._record(True, time.perf_counter() - started)
+        return result
+
+    def _call_with_timeout(self, timeout, fn, args, kwargs):
+        if timeout <= 0:
+            raise TimeoutError('No time left for the call')
+        self._admit()
+        started = time.perf_counter()
+        state = {'finished': False, 'abandoned': False}
+        done = threading.Event()
+
+        def run():
+            try:
+                state['result'] = fn(*args, **kwargs)
+            except BaseException as e:
+                state['error'] = e
+            with self._lock:
+                state['finished'] = True
+                abandoned = state['abandoned']
+                if abandoned:
+                    self._abandoned -= 1
+            done.set()
+            if abandoned:
+                self._leave()
+
+        threading.Thread(target=run, name='guarded-call', daemon=True).start()
+        done.wait(timeout)
+        with self._lock:
+            if not state['finished']:
+                state['abandoned'] = True
+                self._abandoned += 1
+                self.counters['timeouts'] += 1
+        if state['abandoned']:
+            self._record(False, time.perf_counter() - started)
+            raise TimeoutError(f"Call did not finish within {timeout:.1f}s")
+        self._leave()
+        self._record('error' not in state, time.perf_counter() - started)
+        if 'error' in state:
+            raise state['error']
+        return state['result']
+
+    def _admit(self):
+        wait = self.breaker.allow()
+        if wait:
+            self._reject('rejected_open', 'circuit open', wait)
+        if self.bucket is not None:
+            wait = self.bucket.try_acquire()
+            if wait:
+                self.breaker.cancel()
+                self._reject('rejected_rate', 'rate limited', wait)
+        if self._slots is not None:
+            acquired = self._slots.acquire(timeout=self.max_wait) if self.max_wait else self._slots.acquire(False)
+            if not acquired:
+                self.breaker.cancel()
+                self._reject('rejected_concurrency', 'too many calls in flight', None)
+        with self._lock:
+            self._in_flight += 1
+            self.counters['calls'] += 1
+
+    def _reject(self, counter, reason, retry_after):
+        with self._lock:
+            self.counters[counter] += 1
+        raise CallRejected(reason, round(retry_after, 3) if retry_after else None)
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def _record(self, succeeded, seconds):
+        slow = bool(self.slow_call_seconds) and seconds > self.slow_call_seconds
+        with self._lock:
+            self.counters['succeeded' if succeeded else 'failed'] += 1
+            if slow:
+                self.counters['slow'] += 1
+        if succeeded and not slow:
+            self.breaker.record_success()
+            if self.bucket is not None:
+                self.bucket.increase()
+            return
+        was_open = self.breaker.state == OPEN
+        self.breaker.record_failure()
+        if self.bucket is not None:
+            self.bucket.decrease()
+        if not was_open and self.breaker.state == OPEN:
+            self.logger.warning(
+                f"Circuit opened after {'a slow call' if succeeded else 'a failed call'} "
+                f"({seconds:.2f}s); refusing calls for {self.breaker.reset_timeout}s"
+            )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = self._in_flight
+            stats['abandoned'] = self._abandoned
+        stats['state'] = self.breaker.state
+        stats['consecutive_failures'] = self.breaker.consecutive_failures()
+        stats['times_opened'] = self.breaker.times_opened
+        stats['max_concurrency'] = self.max_concurrency
+        if self.bucket is not None:
+            stats['rate'] = round(self.bucket.rate, 3)
+            stats['tokens'] = round(self.bucket.tokens(), 3)
+        return stats
@@ -1,40 +1,353 @@
 """
 Camera Service for Star Wars Photobooth
 Handles camera utilities and image processing
+
+OpenCV and NumPy are imported inside the methods that need them so that
+importing this module stays cheap on serverless cold starts.
 """
 
-import cv2
-import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
 import io
+import os
 import base64
+import binascii
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics import timed
+
+# Mask size relative to the detected face; mirrors maskScaleFactors and
+# baseMaskScale in static/js/maskManager.js so server and client agree
+MASK_SCALE_FACTORS = {
+    'vader-mask': 1.3,
+    'sith-lord': 1.1,
+    'storm-trooper': 1.4,
+    'emperor': 1.2,
+    'kylo-ren': 1.25,
+    'jedi': 1.15
+}
+BASE_MASK_SCALE = 1.2
+HELMET_MASKS = ('vader-mask', 'storm-trooper', 'kylo-ren', 'emperor')
+FACE_MASKS = ('sith-lord', 'jedi')
+# Vertical nudge as a fraction of face height (positionAdjustments in maskManager.js)
+MASK_Y_ADJUSTMENTS = {
+    'vader-mask': -0.1,
+    'sith-lord': -0.05,
+    'storm-trooper': -0.1,
+    'emperor': -0.15,
+    'kylo-ren': -0.08,
+    'jedi': -0.12
+}
+# MediaPipe Face Mesh indices of the landmarks masks are warped onto, in
+# the order of the mask anchors they match (mouth: midpoint of the inner lips)
+WARP_ANCHORS = ('left_eye', 'right_eye', 'nose', 'mouth', 'chin')
+WARP_LANDMARKS = {'left_eye': (33,), 'right_eye': (263,), 'nose': (1,), 'mouth': (13, 14), 'chin': (152,)}
+WARP_MODES = ('affine', 'perspective')
+# Sith filter presets, expressed as ImageEnhance factors applied in the
+# order contrast -> brightness -> color (saturation). 1.0 means unchanged.
+SITH_FILTER_PRESETS = {
+    'sith-lord': {'contrast': 1.3, 'brightness': 0.8, 'color': 0.7},         # pale, drained skin
+    'vader-mask': {'contrast': 1.5, 'brightness': 0.6, 'color': 0.8},        # dark, high contrast
+    'sith-eyes': {'contrast': 1.2, 'brightness': 0.9},
+    'dark-corruption': {'contrast': 1.4, 'brightness': 0.7, 'color': 0.5},   # heavy desaturation
+    'imperial-officer': {'contrast': 1.1, 'brightness': 0.95},
+    'lightsaber-duel': {'contrast': 1.3, 'brightness': 1.1, 'color': 1.2}    # vivid lighting
+}
+
+# ITU-R 601-2 luma weights, as used by PIL's RGB -> L conversion
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def decode_data_url(image_data):
+    """Bytes of a base64 image, given as a data URL or bare base64 (str or bytes)
+
+    The payload is decoded through a memoryview, so the base64 text is not
+    copied again just to strip the ``data:...;base64,`` prefix.
+    """
+    if isinstance(image_data, str):
+        image_data = image_data.encode('ascii')
+    view = memoryview(image_data)
+    # Base64 has no commas, so the prefix separator is within the first bytes
+    comma = image_data.find(b',', 0, 256)
+    if comma >= 0:
+        view = view[comma + 1:]
+    return binascii.a2b_base64(view)
+
+
+def fit_size(size, max_size):
+    """Largest size with the aspect ratio of ``size`` that fits in ``max_size``
+
+    Either bound may be None (unbounded); sizes are never enlarged.
+    """
+    width, height = size
+    max_width, max_height = max_size
+    ratio = min(
+        max_width / width if max_width else 1.0,
+        max_height / height if max_height else 1.0,
+        1.0
+    )
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def encode_data_url(image_bytes, mimetype='image/jpeg'):
+    return f'data:{mimetype};base64,' + base64.b64encode(image_bytes).decode('ascii')
+
+
+class CompiledFilter:
+    """A filter preset fused into a per-channel LUT plus a color matrix.
+
+    Contrast and brightness are both per-pixel affine maps, so they fold
+    into one 256-entry lookup table (contrast pivots on the image's mean
+    luma, so the table is cached per mean). Saturation mixes channels and
+    becomes a 3x3 matrix. That is two C passes over the image instead of
+    one full image allocation per ImageEnhance step.
+    """
+    
+    def __init__(self, contrast=1.0, brightness=1.0, color=1.0):
+        self.contrast = contrast
+        self.brightness = brightness
+        self.color = color
+        self._luts = {}
+        self.matrix = None
+        if color != 1.0:
+            matrix = []
+            for channel in range(3):
+                for source in range(3):
+                    weight = (1.0 - color) * LUMA_WEIGHTS[source]
+                    matrix.append(weight + (color if source == channel else 0.0))
+                matrix.append(0.0)
+            self.matrix = tuple(matrix)
+    
+    def lut(self, mean):
+        """Fused contrast+brightness table for an image with the given mean luma"""
+        table = self._luts.get(mean)
+        if table is None:
+            table = []
+            for value in range(256):
+                value = min(255, max(0, int(mean + self.contrast * (value - mean))))
+                value = min(255, max(0, int(value * self.brightness)))
+                table.append(value)
+            self._luts[mean] = table = table * 3
+        return table
+    
+    @staticmethod
+    def mean_luma(image):
+        """Mean luma of an RGB image from its channel histograms (no L copy)"""
+        histogram = image.histogram()
+        total = image.width * image.height or 1
+        mean = 0.0
+        for channel, weight in enumerate(LUMA_WEIGHTS):
+            counts = histogram[channel * 256:(channel + 1) * 256]
+            mean += weight * sum(value * count for value, count in enumerate(counts)) / total
+        return int(mean + 0.5)
+    
+    def apply(self, image):
+        mean = self.mean_luma(image) if self.contrast != 1.0 else 0
+        if self.contrast != 1.0 or self.brightness != 1.0:
+            image = image.point(self.lut(mean))
+        if self.matrix is not None:
+            image = image.convert('RGB', self.matrix)
+        return image
+
+
+_compiled_filters = {}
+
+
+def compile_sith_filter(filter_type):
+    """Return the CompiledFilter for a named preset, or None if unknown"""
+    compiled = _compiled_filters.get(filter_type)
+    if compiled is None and filter_type in SITH_FILTER_PRESETS:
+        compiled = _compiled_filters[filter_type] = CompiledFilter(**SITH_FILTER_PRESETS[filter_type])
+    return compiled
+
+
+class FaceDetector:
+    """Haar-cascade face detector tuned for repeated server-side calls.
+
+    Each thread loads the cascade once (CascadeClassifier is not safe to
+    share between threads), detection runs on a downscaled grayscale copy
+    and boxes are mapped back to full resolution. OpenCV releases the GIL
+    while detecting, so detect_batch spreads images across a thread pool.
+    """
+    
+    CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+    CASCADE_WINDOW = 24  # training window of the frontal face cascade
+    
+    def __init__(self, detect_width=480, scale_factor=1.1, min_neighbors=4, max_workers=4):
+        self.detect_width = detect_width
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.max_workers = max_workers
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def _cascade(self):
+        import cv2
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(cv2.data.haarcascades + self.CASCADE_FILE)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load {self.CASCADE_FILE}")
+            self._local.cascade = cascade
+        return cascade
+    
+    def _pool(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='face-detect'
+                )
+            return self._executor
+    
+    @staticmethod
+    def _grayscale(image):
+        """Grayscale uint8 array from a PIL image or an RGB/gray ndarray"""
+        import cv2
+        import numpy as np
+        if isinstance(image, np.ndarray):
+            return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if image.mode != 'L':
+            image = image.convert('L')
+        return np.asarray(image)
+    
+    def detect(self, image, min_face_size=None):
+        """Detect faces and return face records in full-resolution pixels.
+
+        ``min_face_size`` is a hint in full-resolution pixels; faces smaller
+        than it are skipped, which also lets the cascade skip small scales.
+        """
+        import cv2
+        gray = self._grayscale(image)
+        height, width = gray.shape[:2]
+        
+        scale = 1.0
+        if self.detect_width and width > self.detect_width:
+            scale = self.detect_width / width
+            gray = cv2.resize(gray, (self.detect_width, max(1, int(round(height * scale)))),
+                              interpolation=cv2.INTER_AREA)
+        
+        min_size = self.CASCADE_WINDOW
+        if min_face_size:
+            min_size = max(min_size, int(min_face_size * scale))
+        
+        boxes, neighbors = self._cascade().detectMultiScale2(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors,
+            minSize=(min_size, min_size)
+        )
+        
+        records = []
+        for (x, y, w, h), count in zip(boxes, neighbors):
+            records.append(self.face_record(
+                x / scale, y / scale, w / scale, h / scale, width, height,
+                # More overlapping raw detections means a more reliable face
+                confidence=float(count) / (float(count) + self.min_neighbors)
+            ))
+        records.sort(key=lambda r: r['width'] * r['height'], reverse=True)
+        return records
+    
+    def detect_batch(self, images, min_face_size=None):
+        """Detect faces in several images concurrently; results keep input order"""
+        return list(self._pool().map(lambda image: self.detect(image, min_face_size), images))
+    
+    @staticmethod
+    def face_record(x, y, width, height, frame_width, frame_height, confidence=0.8):
+        """Face record in the shape faceDetection.js sends as face_data"""
+        return {
+            'x': float(x),
+            'y': float(y),
+            'width': float(width),
+            'height': float(height),
+            'centerX': float(x + width / 2),
+            'centerY': float(y + height / 2),
+            'confidence': round(confidence, 3),
+            'normalizedX': float(x / frame_width),
+            'normalizedY': float(y / frame_height),
+            'normalizedWidth': float(width / frame_width),
+            'normalizedHeight': float(height / frame_height)
+        }
+
 
 class CameraService:
     """Camera utilities and image processing service"""
     
-    def __init__(self):
+    def __init__(self, face_detector=None):
         self.logger = logging.getLogger(__name__)
+        self.face_detector = face_detector or FaceDetector()
         
-    def process_image_data(self, image_data):
-        """Process base64 image data"""
+    @timed('camera.decode')
+    def process_image_data(self, image_data, target_size=None):
+        """Process base64 image data (``target_size`` as in process_image_bytes)"""
         try:
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64
-            image_bytes = base64.b64decode(image_data)
+            # Decode base64 (data URL prefix is optional)
+            image_bytes = decode_data_url(image_data)
             
             # Convert to PIL Image
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            return image
+            return self.process_image_bytes(image_bytes, target_size)
             
         except Exception as e:
             self.logger.error(f"Error processing image data: {e}")
             return None
     
+    def process_image_bytes(self, image_bytes, target_size=None):
+        """Open encoded image bytes (e.g. a cached frame) as a PIL image
+
+        Without ``target_size`` the image opens lazily at full resolution.
+        With a ``(max_width, max_height)`` hint (either may be None) it is
+        decoded at reduced resolution and fitted inside it, so a filter
+        preview, detection (``detection_size()``) or thumbnail only pays
+        for the pixels it uses.
+        """
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            return self.reduce_image(image, target_size) if target_size else image
+        except Exception as e:
+            self.logger.error(f"Error processing image bytes: {e}")
+            return None
+    
+    @staticmethod
+    def reduce_image(image, target_size, resample=Image.Resampling.BILINEAR):
+        """Fit a freshly opened image inside ``target_size``, decoding as little as possible
+
+        JPEGs use DCT scaling (``draft``) to decode straight at 1/2, 1/4 or
+        1/8 size, the smallest that still covers the target, which leaves
+        a cheap final resize of less than 2x. Other formats are reduced by
+        an integer factor before the final ``resample`` pass (``reducing_gap``).
+        """
+        size = fit_size(image.size, target_size)
+        if size == image.size:
+            return image
+        # No-op unless the image is a JPEG that has not been decoded yet
+        image.draft(image.mode, size)
+        if image.size != size:
+            image = image.resize(size, resample, reducing_gap=3.0)
+        return image
+    
+    def detection_size(self):
+        """``target_size`` hint for frames that are only used for detect_faces"""
+        return (self.face_detector.detect_width, None)
+    
+    def encode_image_data(self, image, quality=90):
+        """Encode a PIL image as a base64 JPEG data URL"""
+        image_bytes = self.encode_image_bytes(image, quality)
+        return encode_data_url(image_bytes) if image_bytes is not None else None
+    
+    @timed('camera.encode')
+    def encode_image_bytes(self, image, quality=90):
+        """Encode a PIL image as JPEG bytes"""
+        try:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality)
+            return output.getvalue()
+        except Exception as e:
+            self.logger.error(f"Error encoding image data: {e}")
+            return None
+    
+    @timed('camera.filter')
     def apply_sith_filter(self, image, filter_type):
         """Apply Sith-themed filters to image"""
         try:
@@ -45,145 +358,61 @@ class CameraService:
             if image.mode != 'RGB':
                 image = image.convert('RGB')
             
-            # Apply filter based on type
-            if filter_type == 'sith-lord':
-                return self._apply_sith_lord_filter(image)
-            elif filter_type == 'vader-mask':
-                return self._apply_vader_mask_filter(image)
-            elif filter_type == 'sith-eyes':
-                return self._apply_sith_eyes_filter(image)
-            elif filter_type == 'dark-corruption':
-                return self._apply_dark_corruption_filter(image)
-            elif filter_type == 'imperial-officer':
-                return self._apply_imperial_officer_filter(image)
-            elif filter_type == 'lightsaber-duel':
-                return self._apply_lightsaber_duel_filter(image)
-            else:
+            compiled = compile_sith_filter(filter_type)
+            if compiled is None:
                 return image
+            return compiled.apply(image)
                 
         except Exception as e:
             self.logger.error(f"Error applying filter {filter_type}: {e}")
             return image
     
-    def _apply_sith_lord_filter(self, image):
-        """Apply Sith Lord transformation"""
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.3)
-        
-        # Reduce brightness
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(0.8)
-        
-        # Adjust color balance for pale skin
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(0.7)
-        
-        return image
-    
-    def _apply_vader_mask_filter(self, image):
-        """Apply Vader mask effect"""
-        # High contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.5)
-        
-        # Darken
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(0.6)
-        
-        # Slight desaturation
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(0.8)
-        
-        return image
+    def apply_sith_filter_batch(self, images, filter_type):
+        """Apply one Sith filter preset to many images, compiling it once"""
+        compiled = compile_sith_filter(filter_type)
+        results = []
+        for image in images:
+            try:
+                if image is not None and image.mode != 'RGB':
+                    image = image.convert('RGB')
+                results.append(compiled.apply(image) if compiled and image is not None else image)
+            except Exception as e:
+                self.logger.error(f"Error applying filter {filter_type}: {e}")
+                results.append(image)
+        return results
     
-    def _apply_sith_eyes_filter(self, image):
-        """Apply glowing red Sith eyes effect"""
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.2)
-        
-        # Slight brightness boost
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(0.9)
-        
-        return image
-    
-    def _apply_dark_corruption_filter(self, image):
-        """Apply dark side corruption effect"""
-        # High contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.4)
-        
-        # Reduce brightness
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(0.7)
-        
-        # Desaturate
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(0.5)
-        
-        return image
-    
-    def _apply_imperial_officer_filter(self, image):
-        """Apply Imperial Officer look"""
-        # Slight contrast boost
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.1)
-        
-        # Maintain brightness
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(0.95)
-        
-        return image
-    
-    def _apply_lightsaber_duel_filter(self, image):
-        """Apply lightsaber duel lighting effect"""
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.3)
-        
-        # Boost brightness
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(1.1)
-        
-        # Enhance saturation
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.2)
-        
-        return image
-    
-    def detect_faces(self, image):
-        """Detect faces in image using OpenCV"""
+    @timed('camera.detect_faces')
+    def detect_faces(self, image, min_face_size=None):
+        """Detect faces in image using OpenCV
+
+        Returns ``(found, faces)`` where faces are face_data-shaped records.
+        """
         try:
-            # Convert PIL to OpenCV format
-            open_cv_image = np.array(image)
-            open_cv_image = cv2.cvtColor(open_cv_image, cv2.COLOR_RGB2BGR)
-            
-            # Load face cascade
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(open_cv_image, cv2.COLOR_BGR2GRAY)
-            
-            # Detect faces
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-            
+            faces = self.face_detector.detect(image, min_face_size=min_face_size)
             return len(faces) > 0, faces
             
         except Exception as e:
             self.logger.error(f"Error detecting faces: {e}")
             return False, []
     
-    def optimize_image(self, image, max_width=1280, max_height=720, quality=85):
-        """Optimize image for web delivery"""
+    def detect_faces_batch(self, images, min_face_size=None):
+        """Detect faces in many images across the detector's thread pool"""
+        try:
+            return self.face_detector.detect_batch(images, min_face_size=min_face_size)
+        except Exception as e:
+            self.logger.error(f"Error detecting faces: {e}")
+            return [[] for _ in images]
+    
+    @timed('camera.optimize')
+    def optimize_image(self, image, max_width=1280, max_height=720, quality=85, format='JPEG', progressive=False):
+        """Optimize image for web delivery (JPEG or WEBP)
+
+        Pass the image straight from ``Image.open`` so JPEG sources are
+        decoded at reduced resolution (see ``reduce_image``).
+        """
         try:
-            # Calculate new dimensions
-            ratio = min(max_width / image.width, max_height / image.height)
-            if ratio < 1:
-                new_width = int(image.width * ratio)
-                new_height = int(image.height * ratio)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # LANCZOS for the last step: these images are stored and served
+            image = self.reduce_image(image, (max_width, max_height), Image.Resampling.LANCZOS)
             
             # Convert to RGB if necessary
             if image.mode != 'RGB':
@@ -191,7 +420,10 @@ class CameraService:
             
             # Save optimized image
             output = io.BytesIO()
-            image.save(output, format='JPEG', quality=quality, optimize=True)
+            if format.upper() == 'WEBP':
+                image.save(output, format='WEBP', quality=quality, method=4)
+            else:
+                image.save(output, format='JPEG', quality=quality, optimize=True, progressive=progressive)
             output.seek(0)
             
             return output.getvalue()
@@ -199,3 +431,352 @@ class CameraService:
         except Exception as e:
             self.logger.error(f"Error optimizing image: {e}")
             return None
+
+
+class MaskCompositor:
+    """Server-side mask overlay engine.
+
+    Every mask PNG is decoded once into a premultiplied RGBA array. Scaled
+    copies are kept in an LRU cache keyed by (mask_id, width, height) and
+    blended onto frames with vectorized integer math, touching only the
+    region the mask covers.
+
+    When a face comes with MediaPipe ``landmarks_px`` and the mask has
+    ``anchors`` (normalized eye/nose/mouth/chin points, as computed by
+    the MaskRegistry), the mask is instead warped onto the landmarks with
+    an affine or perspective fit, so it follows head tilt and turn. Warped
+    masks are cached by (mask, quantized pose), the pose being the
+    landmarks relative to the point between the eyes, so a steady or
+    sliding head reuses them and only pays for the blend.
+    """
+    
+    SIZE_QUANTUM = 4  # round target sizes so jittery boxes share cache entries
+    
+    def __init__(self, masks_dir, aliases=None, cache_size=64, anchors=None, warp_mode='affine',
+                 pose_quantum=2.0, warp_cache_size=256):
+        self.logger = logging.getLogger(__name__)
+        self.cache_size = cache_size
+        self._masks = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.anchors = anchors or {}
+        self.warp_mode = warp_mode if warp_mode in WARP_MODES else None
+        self.pose_quantum = pose_quantum
+        self.warp_cache_size = warp_cache_size
+        self._warp_cache = OrderedDict()
+        self.warp_counters = {'hits': 0, 'misses': 0, 'fallbacks': 0}
+        
+        if os.path.isdir(masks_dir):
+            for name in sorted(os.listdir(masks_dir)):
+                if name.lower().endswith('.png'):
+                    try:
+                        self._masks[os.path.splitext(name)[0]] = self._load_premultiplied(
+                            os.path.join(masks_dir, name)
+                        )
+                    except Exception as e:
+                        self.logger.warning(f"Skipping unreadable mask {name}: {e}")
+        
+        # Mask ids used by the API may differ from file stems
+        for mask_id, stem in (aliases or {}).items():
+            if stem in self._masks:
+                self._masks[mask_id] = self._masks[stem]
+    
+    @staticmethod
+    def _load_premultiplied(path):
+        import numpy as np
+        with Image.open(path) as image:
+            rgba = np.array(image.convert('RGBA'), dtype=np.uint16)
+        alpha = rgba[..., 3:4]
+        rgba[..., :3] = (rgba[..., :3] * alpha + 127) // 255
+        return np.ascontiguousarray(rgba.astype(np.uint8))
+    
+    def has_mask(self, mask_id):
+        return mask_id in self._masks
+    
+    def mask_size(self, mask_id):
+        """(width, height) of the source mask image"""
+        mask = self._masks[mask_id]
+        return mask.shape[1], mask.shape[0]
+    
+    def scaled_mask(self, mask_id, width, height):
+        """Premultiplied mask resized to (width, height), served from the LRU cache"""
+        import cv2
+        key = (mask_id, width, height)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        
+        source = self._masks[mask_id]
+        shrinking = width < source.shape[1]
+        scaled = cv2.resize(
+            source, (width, height),
+            interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        )
+        with self._lock:
+            self._cache[key] = scaled
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scaled
+    
+    def placement(self, mask_id, face_data, frame_width, frame_height):
+        """Compute (x, y, width, height) for a mask, matching maskManager.js"""
+        mask_width, mask_height = self.mask_size(mask_id)
+        aspect = mask_height / mask_width if mask_width else 1.0
+        
+        face = self._face_box(face_data or {}, frame_width, frame_height)
+        if face is None:
+            # No face: centered, 40% of the frame width, slightly high
+            width = frame_width * 0.4
+            height = width * aspect
+            x = (frame_width - width) / 2
+            y = (frame_height - height) / 2.5
+        else:
+            center_x, center_y, face_width, face_height, has_landmarks = face
+            width = face_width * MASK_SCALE_FACTORS.get(mask_id, 1.2) * BASE_MASK_SCALE
+            height = width * aspect
+            if width > frame_width * 0.8:
+                width = frame_width * 0.8
+                height = width * aspect
+            if height > frame_height * 0.8:
+                height = frame_height * 0.8
+                width = height / aspect
+            
+            x = center_x - width / 2
+            y = center_y - height / 2
+            if not has_landmarks:
+                if mask_id in HELMET_MASKS:
+                    y = center_y - height * 0.55
+                elif mask_id in FACE_MASKS:
+                    nose_y = center_y - face_height * 0.05
+                    y = nose_y - height * 0.45
+            y += face_height * MASK_Y_ADJUSTMENTS.get(mask_id, 0.0)
+        
+        q = self.SIZE_QUANTUM
+        width = max(q, int(round(width / q)) * q)
+        height = max(q, int(round(height / q)) * q)
+        x = int(round(max(0, min(x, frame_width - width))))
+        y = int(round(max(0, min(y, frame_height - height))))
+        return x, y, width, height
+    
+    @staticmethod
+    def _face_box(face_data, frame_width, frame_height):
+        """Normalize client face_data to (center_x, center_y, width, height, has_landmarks)"""
+        landmarks = face_data.get('landmarks_px')
+        if landmarks:
+            xs = [float(p.get('x', 0)) for p in landmarks]
+            ys = [float(p.get('y', 0)) for p in landmarks]
+            width = max(1.0, max(xs) - min(xs))
+            height = max(1.0, max(ys) - min(ys))
+            return min(xs) + width / 2, min(ys) + height / 2, width, height, True
+        
+        def pick(absolute, normalized, scale):
+            value = face_data.get(normalized)
+            if value is not None and value <= 1:
+                return value * scale
+            value = face_data.get(absolute)
+            if value is None:
+                return None
+            return value * scale if value <= 1 else value
+        
+        width = pick('width', 'normalizedWidth', frame_width)
+        height = pick('height', 'normalizedHeight', frame_height)
+        if width is None and height is None:
+            return None
+        if width is None:
+            width = height / 1.3
+        if height is None:
+            height = width * 1.3
+        
+        center_x = face_data.get('centerX')
+        center_y = face_data.get('centerY')
+        left = pick('x', 'normalizedX', frame_width)
+        top = pick('y', 'normalizedY', frame_height)
+        if center_x is None:
+            center_x = left + width / 2 if left is not None else frame_width / 2
+        elif center_x <= 1:
+            center_x *= frame_width
+        if center_y is None:
+            center_y = top + height / 2 if top is not None else frame_height / 2
+        elif center_y <= 1:
+            center_y *= frame_height
+        return center_x, center_y, width, height, False
+    
+    @staticmethod
+    def face_landmarks(face_data):
+        """The warp landmarks of a face as a (5, 2) array in WARP_ANCHORS order, or None"""
+        import numpy as np
+        points = (face_data or {}).get('landmarks_px')
+        if not points or len(points) <= max(max(indices) for indices in WARP_LANDMARKS.values()):
+            return None
+        try:
+            landmarks = np.array([
+                np.mean([(float(points[i]['x']), float(points[i]['y'])) for i in WARP_LANDMARKS[name]], axis=0)
+                for name in WARP_ANCHORS
+            ])
+        except (KeyError, TypeError, ValueError):
+            return None
+        # Landmark 33 is on the image's left only in an unmirrored frame; on
+        # a mirrored (selfie) frame the eyes swap, which would flip the mask
+        left_eye, right_eye, chin = landmarks[0], landmarks[1], landmarks[4]
+        across, down = right_eye - left_eye, chin - (left_eye + right_eye) / 2
+        if across[0] * down[1] - across[1] * down[0] < 0:
+            landmarks[[0, 1]] = landmarks[[1, 0]]
+        return landmarks
+    
+    def anchor_points(self, mask_id):
+        """The mask's anchors in source pixels, in WARP_ANCHORS order, or None"""
+        import numpy as np
+        anchors = self.anchors.get(mask_id)
+        if not anchors or any(name not in anchors for name in WARP_ANCHORS):
+            return None
+        width, height = self.mask_size(mask_id)
+        return np.array([(anchors[name]['x'] * width, anchors[name]['y'] * height) for name in WARP_ANCHORS])
+    
+    @staticmethod
+    def fit_transform(source_points, target_points, mode='affine'):
+        """3x3 least-squares transform taking source points onto target points"""
+        import numpy as np
+        if mode == 'perspective':
+            import cv2
+            matrix, _ = cv2.findHomography(source_points, target_points, 0)
+            if matrix is not None:
+                return matrix / matrix[2, 2]
+        design = np.hstack([source_points, np.ones((len(source_points), 1))])
+        solution = np.linalg.lstsq(design, target_points, rcond=None)[0]
+        matrix = np.eye(3)
+        matrix[:2] = solution.T
+        return matrix
+    
+    def warped_mask(self, mask_id, landmarks):
+        """``(patch, x, y)``: the premultiplied mask warped onto a face's landmarks
+        and where its top-left corner goes in the frame, or None if the fit is
+        degenerate (e.g. a profile view)
+        """
+        import numpy as np
+        origin = np.round(landmarks[:2].mean(axis=0))
+        pose = np.round((landmarks - origin) / self.pose_quantum).astype(np.int32)
+        key = (mask_id, self.warp_mode, pose.tobytes())
+        with self._lock:
+            found = key in self._warp_cache
+            if found:
+                self._warp_cache.move_to_end(key)
+                cached = self._warp_cache[key]
+            self.warp_counters['hits' if found else 'misses'] += 1
+        if not found:
+            with timed('compositor.warp'):
+                cached = self._warp(mask_id, pose * self.pose_quantum)
+            with self._lock:
+                self._warp_cache[key] = cached
+                while len(self._warp_cache) > self.warp_cache_size:
+                    self._warp_cache.popitem(last=False)
+        if cached is None:
+            return None
+        patch, dx, dy = cached
+        return patch, int(origin[0]) + dx, int(origin[1]) + dy
+    
+    def _warp(self, mask_id, target_points):
+        """Warp a mask onto landmarks given relative to the frame origin (uncached)"""
+        import cv2
+        import numpy as np
+        source_points = self.anchor_points(mask_id)
+        matrix = self.fit_transform(source_points, target_points, self.warp_mode)
+        determinant = np.linalg.det(matrix[:2, :2])
+        if not determinant > 0:
+            return None  # mirrored or collapsed
+        scale = determinant ** 0.5
+        if not 0.02 <= scale <= 8:
+            return None
+        
+        # Shrink the source close to the target size first, so the remap
+        # never minifies by much (that would alias)
+        width, height = self.mask_size(mask_id)
+        if scale < 0.75:
+            q = self.SIZE_QUANTUM
+            scaled_width = max(q, int(round(width * scale / q)) * q)
+            scaled_height = max(q, int(round(height * scale / q)) * q)
+            source = self.scaled_mask(mask_id, scaled_width, scaled_height)
+            matrix = matrix @ np.diag([width / scaled_width, height / scaled_height, 1.0])
+        else:
+            source = self._masks[mask_id]
+        source_height, source_width = source.shape[:2]
+        
+        corners = matrix @ np.array([[0, source_width, 0, source_width],
+                                     [0, 0, source_height, source_height],
+                                     [1, 1, 1, 1]], dtype=np.float64)
+        if (corners[2] <= 0).any():
+            return None  # the perspective fit puts part of the mask behind the camera
+        corners = corners[:2] / corners[2]
+        x0, y0 = np.floor(corners.min(axis=1)).astype(int)
+        x1, y1 = np.ceil(corners.max(axis=1)).astype(int)
+        if (x1 - x0) * (y1 - y0) > 64 * source_width * source_height:
+            return None
+        
+        # One remap: every destination pixel samples the mask through the inverse transform
+        inverse = np.linalg.inv(matrix)
+        grid_x, grid_y = np.meshgrid(np.arange(x0, x1, dtype=np.float32), np.arange(y0, y1, dtype=np.float32))
+        map_x = inverse[0, 0] * grid_x + inverse[0, 1] * grid_y + inverse[0, 2]
+        map_y = inverse[1, 0] * grid_x + inverse[1, 1] * grid_y + inverse[1, 2]
+        if self.warp_mode == 'perspective':
+            w = inverse[2, 0] * grid_x + inverse[2, 1] * grid_y + inverse[2, 2]
+            map_x /= w
+            map_y /= w
+        patch = cv2.remap(source, map_x.astype(np.float32), map_y.astype(np.float32), cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return patch, int(x0), int(y0)
+    
+    def composite(self, frame, mask_id, face_data=None):
+        """Alpha-blend a mask onto an RGB uint8 frame in place and return it"""
+        if not self.has_mask(mask_id):
+            return frame
+        if self.warp_mode and mask_id in self.anchors:
+            landmarks = self.face_landmarks(face_data)
+            if landmarks is not None:
+                warped = self.warped_mask(mask_id, landmarks)
+                if warped is not None:
+                    return self._blend(frame, *warped)
+                with self._lock:
+                    self.warp_counters['fallbacks'] += 1
+        frame_height, frame_width = frame.shape[:2]
+        x, y, width, height = self.placement(mask_id, face_data, frame_width, frame_height)
+        return self._blend(frame, self.scaled_mask(mask_id, width, height), x, y)
+    
+    @staticmethod
+    def _blend(frame, mask, x, y):
+        """Blend a premultiplied RGBA patch onto the frame at (x, y), clipped to the frame"""
+        import numpy as np
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + mask.shape[1], frame_width), min(y + mask.shape[0], frame_height)
+        if x1 <= x0 or y1 <= y0:
+            return frame
+        mask = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+        roi = frame[y0:y1, x0:x1]
+        
+        # out = src * (1 - a) + premultiplied_mask
+        inverse_alpha = 255 - mask[..., 3:4].astype(np.uint16)
+        blended = (roi.astype(np.uint16) * inverse_alpha + 127) // 255
+        blended += mask[..., :3]
+        roi[...] = blended
+        return frame
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self.warp_counters)
+            stats['entries'] = len(self._warp_cache)
+            stats['scaled_entries'] = len(self._cache)
+        return stats
+    
+    @timed('compositor.composite')
+    def composite_image(self, image, mask_id, face_data=None):
+        """Composite a mask onto a PIL image and return a new RGB PIL image
+
+        ``face_data`` may be a single face record or a list of them.
+        """
+        import numpy as np
+        frame = np.array(image.convert('RGB'))
+        faces = face_data if isinstance(face_data, list) else [face_data]
+        for face in faces or [None]:
+            self.composite(frame, mask_id, face)
+        return Image.fromarray(frame)
@@ -0,0 +1,173 @@
+"""
+Derivative Service for Star Wars Photobooth
+Generates thumbnail and medium-size variants of captured photos
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from services.metrics import timed
+
+# Variant name -> (max_width, max_height, quality)
+DEFAULT_VARIANTS = {
+    'thumb': (320, 320, 75),
+    'medium': (1280, 1280, 82),
+}
+
+FORMAT_EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+}
+
+
+class DerivativeService:
+    """Background pipeline producing resized WebP/JPEG variants of photos.
+
+    Variants are cached as ``<cache_dir>/<shard>/<stem>.<variant>.<ext>``
+    (shard = first two hex digits of the filename's SHA-1) and built with
+    ``CameraService.optimize_image``. ``open_source(filename)`` returns a
+    binary file for the original photo, or None if it does not exist.
+    """
+
+    def __init__(self, camera_service, cache_dir, open_source, variants=None, formats=('WEBP',), max_workers=2):
+        self.logger = logging.getLogger(__name__)
+        self.camera_service = camera_service
+        self.cache_dir = cache_dir
+        self.open_source = open_source
+        self.variants = variants or DEFAULT_VARIANTS
+        self.formats = tuple(f.upper() for f in formats)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivatives')
+        self._pending = 0
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def is_derivative(self, filename):
+        """True for files produced by this service (``<stem>.<variant>.<ext>``)"""
+        stem = os.path.splitext(filename)[0]
+        return os.path.splitext(stem)[1].lstrip('.') in self.variants
+
+    def variant_filename(self, filename, variant, format='WEBP'):
+        stem = os.path.splitext(filename)[0]
+        return f"{stem}.{variant}.{FORMAT_EXTENSIONS[format.upper()]}"
+
+    def variant_path(self, filename, variant, format='WEBP'):
+        shard = hashlib.sha1(filename.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.cache_dir, shard, self.variant_filename(filename, variant, format))
+
+    def _lock_for(self, path):
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def schedule(self, filename):
+        """Queue generation of every configured variant off the request thread"""
+        with self._locks_guard:
+            self._pending += 1
+        future = self.executor.submit(self.generate_all, filename)
+        future.add_done_callback(self._job_finished)
+        return future
+
+    def _job_finished(self, future):
+        with self._locks_guard:
+            self._pending -= 1
+
+    def stats(self):
+        """Scheduled photos not yet finished (queued or in progress)"""
+        with self._locks_guard:
+            return {'workers': self.max_workers, 'pending': self._pending}
+
+    def generate_all(self, filename):
+        """Generate every missing variant of a photo; returns the number written"""
+        written = 0
+        for variant in self.variants:
+            for format in self.formats:
+                try:
+                    if not os.path.exists(self.variant_path(filename, variant, format)):
+                        if self.generate(filename, variant, format):
+                            written += 1
+                except Exception as e:
+                    self.logger.error(f"Error generating {variant} of {filename}: {e}")
+        return written
+
+    def ensure(self, filename, variant, format='WEBP'):
+        """Return the path of a variant, generating it synchronously if missing"""
+        if variant not in self.variants or format.upper() not in FORMAT_EXTENSIONS:
+            return None
+        path = self.variant_path(filename, variant, format)
+        if os.path.exists(path):
+            return path
+        return path if self.generate(filename, variant, format) else None
+
+    @timed('derivatives.generate')
+    def generate(self, filename, variant, format='WEBP'):
+        """Render one variant and write it atomically into the cache"""
+        path = self.variant_path(filename, variant, format)
+        max_width, max_height, quality = self.variants[variant]
+
+        try:
+            with self._lock_for(path):
+                # Another thread may have produced it while we waited
+                if os.path.exists(path):
+                    return True
+                try:
+                    source = self.open_source(filename)
+                except FileNotFoundError:
+                    source = None
+                if source is None:
+                    return False
+
+                with source, Image.open(source) as image:
+                    data = self.camera_service.optimize_image(
+                        image, max_width=max_width, max_height=max_height,
+                        quality=quality, format=format
+                    )
+                if data is None:
+                    return False
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            return True
+        finally:
+            # Drop the lock whatever happened, so failed paths don't pile up
+            with self._locks_guard:
+                self._locks.pop(path, None)
+
+    def remove(self, filename):
+        """Delete every stored variant of a photo"""
+        for variant in self.variants:
+            for format in FORMAT_EXTENSIONS:
+                path = self.variant_path(filename, variant, format)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def purge_directory(self, directory):
+        """Delete variants that older versions wrote flat into ``directory``"""
+        removed = 0
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.is_file() and self.is_derivative(entry.name):
+                    os.remove(entry.path)
+                    removed += 1
+        return removed
+
+    def backfill(self, filenames):
+        """Generate missing variants for existing uploads; returns (photos, written)"""
+        photos = written = 0
+        for filename in filenames:
+            photos += 1
+            written += self.generate_all(filename)
+        return photos, written
@@ -0,0 +1,173 @@
+"""
+Frame Cache for Star Wars Photobooth
+Short-lived, content-addressed store of uploaded and processed frames
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class FrameCache:
+    """Frames keyed by the SHA-256 of their bytes (the ``frame_id``).
+
+    Lets a client upload a frame once and refer to it by handle for every
+    mask preview, and lets results be fetched as binary instead of being
+    base64-echoed in JSON. An in-memory LRU bounded by ``max_bytes`` sits in
+    front of an optional ``cache_dir`` shared by all gunicorn workers, so a
+    handle issued by one worker resolves on another. Entries expire after
+    ``ttl`` seconds; an unknown or expired handle means "upload again".
+    Every ``prune_every`` puts, expired files are swept from ``cache_dir``
+    on a background thread, so no request waits for the directory walk.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=64 * 1024 * 1024, ttl=600, prune_every=64):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._memory = OrderedDict()  # frame_id -> (created, bytes)
+        self._memory_bytes = 0
+        self._puts = 0
+        self._pruning = None  # the running background prune thread
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'duplicates': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def frame_id(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def is_valid_id(frame_id):
+        return isinstance(frame_id, str) and len(frame_id) == 64 and all(c in '0123456789abcdef' for c in frame_id)
+
+    def _path(self, frame_id):
+        return os.path.join(self.cache_dir, frame_id[:2], frame_id)
+
+    def put(self, data):
+        """Store frame bytes; returns their frame_id"""
+        frame_id = self.frame_id(data)
+        now = time.time()
+        with self._lock:
+            self._puts += 1
+            prune = self.prune_every and self._puts % self.prune_every == 0
+            known = frame_id in self._memory
+            self.counters['duplicates' if known else 'stores'] += 1
+        self._remember(frame_id, now, data)
+
+        if self.cache_dir:
+            path = self._path(frame_id)
+            try:
+                if os.path.exists(path):
+                    os.utime(path)  # refresh the TTL for other workers
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+            except Exception as e:
+                self.logger.warning(f"Could not persist frame {frame_id}: {e}")
+            if prune:
+                self._prune_in_background()
+        return frame_id
+
+    def get(self, frame_id):
+        """Frame bytes, or None if unknown or expired"""
+        if not self.is_valid_id(frame_id):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(frame_id)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(frame_id)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                self._forget(frame_id)
+
+        if self.cache_dir:
+            path = self._path(frame_id)
+            try:
+                created = os.path.getmtime(path)
+                if now - created <= self.ttl:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    self._remember(frame_id, created, data)
+                    with self._lock:
+                        self.counters['disk_hits'] += 1
+                    return data
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                self.logger.warning(f"Ignoring unreadable frame {frame_id}: {e}")
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def _remember(self, frame_id, created, data):
+        with self._lock:
+            if frame_id in self._memory:
+                self._forget(frame_id)
+            if len(data) > self.max_bytes:
+                return
+            self._memory[frame_id] = (created, data)
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _forget(self, frame_id):
+        """Drop a memory entry; caller holds the lock"""
+        _, data = self._memory.pop(frame_id)
+        self._memory_bytes -= len(data)
+
+    def _prune_in_background(self):
+        """Start a prune thread unless one is still walking the directory"""
+        with self._lock:
+            if self._pruning is not None and self._pruning.is_alive():
+                return None
+            self._pruning = threading.Thread(target=self._run_prune, name='frame-cache-prune', daemon=True)
+            self._pruning.start()
+            return self._pruning
+
+    def _run_prune(self):
+        try:
+            self.prune()
+        except Exception as e:
+            self.logger.warning(f"Frame cache prune failed: {e}")
+
+    def prune(self):
+        """Delete expired frames from ``cache_dir``; returns how many were removed"""
+        if not self.cache_dir:
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
@@ -1,21 +1,278 @@
-import google.generativeai as genai
 from PIL import Image
 import io
+import os
 import base64
+import hashlib
 import json
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from services.call_guard import CallRejected
+from services.job_queue import remaining_time
+from services.metrics import timed
+
+
+def image_fingerprint(image_bytes, perceptual=False):
+    """Cache key component for an image.
+
+    By default this is the SHA-256 of the encoded bytes. With ``perceptual``
+    it is a 64-bit difference hash, so re-encoded or near-identical frames
+    (double-taps on the capture button) share a key.
+    """
+    if not perceptual:
+        return hashlib.sha256(image_bytes).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('L', (64, 64))  # JPEG: decode at reduced scale
+        pixels = list(image.convert('L').resize((9, 8), Image.Resampling.BILINEAR).getdata())
+    except Exception:
+        return hashlib.sha256(image_bytes).hexdigest()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"dhash:{bits:016x}"
+
+
+def normalize_payload(payload, precision=3):
+    """Canonical JSON for a payload: sorted keys, rounded floats"""
+    def normalize(value):
+        if isinstance(value, float):
+            return round(value, precision)
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+    return json.dumps(normalize(payload), sort_keys=True, separators=(',', ':'), default=str)
+
+
+class GeminiResponseCache:
+    """Content-addressed cache for Gemini responses.
+
+    An in-memory LRU with TTL sits in front of an on-disk store of JSON
+    files (one per key, written atomically) that every gunicorn worker
+    sharing ``cache_dir`` can read.
+    """
+    
+    def __init__(self, cache_dir=None, max_entries=256, ttl=24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(normalize_payload(parts).encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+    
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+        
+        if self.cache_dir:
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if now - stored['created'] <= self.ttl:
+                    self._remember(key, stored['created'], stored['value'])
+                    with self._lock:
+                        self.counters['disk_hits'] += 1
+                    return stored['value']
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                self.logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+        
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+    
+    def set(self, key, value):
+        created = time.time()
+        self._remember(key, created, value)
+        with self._lock:
+            self.counters['stores'] += 1
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'created': created, 'value': value}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning(f"Could not persist cache entry {key}: {e}")
+    
+    def _remember(self, key, created, value):
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._memory)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+class StubResponse:
+    """Minimal stand-in for a generate_content response"""
+    
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """Offline stand-in for genai.GenerativeModel.
+
+    Sleeps for ``latency`` seconds to mimic the model round trip and can be
+    told to fail, so queueing and caching can be exercised without network
+    access or API quota.
+    """
+    
+    def __init__(self, latency=0.5, text=None, error=None):
+        self.latency = latency
+        self.text = text or 'Stub response: boost contrast and lighting, deepen red color tones.'
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()  # called from several job workers at once
+    
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error:
+            raise RuntimeError(self.error)
+        return StubResponse(self.text)
+
 
 class GeminiService:
-    """Service for interacting with Google Gemini API"""
+    """Service for interacting with Google Gemini API.
+
+    Model calls go through an optional CallGuard (rate limit, concurrency
+    cap, circuit breaker). When a mask enhancement is refused or fails,
+    ``fallback(image_bytes, mask_id)`` supplies a local result instead.
+    """
     
-    def __init__(self, api_key):
+    MODEL_NAME = 'gemini-1.5-pro-vision-latest'
+    
+    def __init__(self, api_key, cache=None, perceptual_cache_keys=False, model=None, guard=None, fallback=None):
+        self.logger = logging.getLogger(__name__)
         self.api_key = api_key
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-pro-vision-latest')
-        
-    def process_image_with_filter(self, image_bytes, prompt):
+        self._model = model
+        self._model_lock = threading.Lock()
+        self.cache = cache
+        self.perceptual_cache_keys = perceptual_cache_keys
+        self.guard = guard
+        self.fallback = fallback
+        self._counters_lock = threading.Lock()
+        self.counters = {'fallbacks': 0, 'fallback_errors': 0}
+    
+    @property
+    def model(self):
+        """The generative model, created on first use.
+
+        google.generativeai is imported here rather than at module load so
+        requests that never reach the model don't pay for it.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.MODEL_NAME)
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    def accepting_calls(self):
+        """False while the circuit breaker is open and calls would be refused"""
+        return self.guard is None or self.guard.allows()
+    
+    def _generate(self, contents):
+        """Call the model, through the guard if there is one.
+
+        Inside a queued job the guard also bounds the call by the job's
+        deadline, so a hung call frees the job worker when the job expires.
+        """
+        if self.guard is None:
+            return self._timed_generate(contents)
+        return self.guard.call(self._timed_generate, contents, timeout=remaining_time())
+    
+    def _timed_generate(self, contents):
+        with timed('gemini.generate_content'):
+            return self.model.generate_content(contents)
+    
+    @staticmethod
+    def _failure(error, **fields):
+        """Result dict for a failed call; refusals say why and when to retry"""
+        result = dict(success=False, error=str(error), **fields)
+        if isinstance(error, CallRejected):
+            result['rejected'] = error.reason
+            result['retry_after'] = error.retry_after
+        return result
+    
+    def _cached(self, key, compute):
+        """Return a cached successful result for key, or compute and store it"""
+        if self.cache is None:
+            return compute()
+        with timed('gemini.cache_lookup'):
+            cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        result = compute()
+        if result.get('success'):
+            self.cache.set(key, result)
+        return result
+    
+    def process_image_with_filter(self, image_bytes, prompt, mask_id=None, key_prompt=None):
         """
         Process image with Gemini AI for face filter application
+        
+        Results are cached by image fingerprint, mask_id and ``key_prompt``
+        (the prompt itself by default). Callers whose prompt carries
+        per-request detail, like face landmarks that jitter between two
+        taps on the same frame, pass its stable part as ``key_prompt``.
         """
+        if self.cache is not None:
+            key = self.cache.make_key(
+                'process_image_with_filter',
+                image_fingerprint(image_bytes, self.perceptual_cache_keys),
+                mask_id,
+                key_prompt if key_prompt is not None else prompt
+            )
+            return self._cached(key, lambda: self._process_image_with_filter(image_bytes, prompt))
+        return self._process_image_with_filter(image_bytes, prompt)
+    
+    def _process_image_with_filter(self, image_bytes, prompt):
         try:
             # Convert bytes to PIL Image
             image = Image.open(io.BytesIO(image_bytes))
@@ -35,7 +292,7 @@ class GeminiService:
             """
             
             # Generate content with Gemini
-            response = self.model.generate_content([enhanced_prompt, image])
+            response = self._generate([enhanced_prompt, image])
             
             # Process the response
             result = {
@@ -48,11 +305,7 @@ class GeminiService:
             return result
             
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'description': 'Failed to process image with Gemini AI'
-            }
+            return self._failure(e, description='Failed to process image with Gemini AI')
     
     def _extract_suggestions(self, response_text):
         """Extract filter improvement suggestions from Gemini response"""
@@ -70,6 +323,12 @@ class GeminiService:
     
     def get_filter_recommendations(self, face_analysis):
         """Get personalized filter recommendations based on face analysis"""
+        if self.cache is not None:
+            key = self.cache.make_key('get_filter_recommendations', face_analysis)
+            return self._cached(key, lambda: self._get_filter_recommendations(face_analysis))
+        return self._get_filter_recommendations(face_analysis)
+    
+    def _get_filter_recommendations(self, face_analysis):
         try:
             prompt = f"""
             Based on this facial analysis: {face_analysis}
@@ -83,7 +342,7 @@ class GeminiService:
             Provide 3 specific recommendations with brief explanations.
             """
             
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             
             return {
                 'success': True,
@@ -91,18 +350,14 @@ class GeminiService:
             }
             
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
+            return self._failure(e)
 
     def enhance_mask_image(self, image_base64, mask_id, face_data=None):
         """Compatibility wrapper used by the Flask app.
 
-        For now this method will attempt to call the AI pipeline to get
-        enhancement metadata but will return the original image data as
-        `processed_image`. This avoids breaking the app if the external
-        API does not return image bytes directly.
+        Returns the AI metadata from ``enhance_mask_bytes`` plus the
+        original image data as `processed_image`, since the external API
+        does not return image bytes directly.
         """
         try:
             # image_base64 may be a data URL like 'data:image/jpeg;base64,...'
@@ -110,21 +365,38 @@ class GeminiService:
                 b64 = image_base64.split(',', 1)[1]
             else:
                 b64 = image_base64
-
             image_bytes = base64.b64decode(b64)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        result = self.enhance_mask_bytes(image_bytes, mask_id, face_data)
+        if result.get('success'):
+            result['processed_image'] = image_base64
+        return result
 
-            # Use the existing AI image processing pipeline (best-effort).
-            prompt = f"Apply Star Wars themed mask overlay: {mask_id}. Face data: {json.dumps(face_data or {})}"
-            ai_result = self.process_image_with_filter(image_bytes, prompt)
+    @timed('gemini.enhance_mask_image')
+    def enhance_mask_bytes(self, image_bytes, mask_id, face_data=None):
+        """AI enhancement metadata for a mask, without any image in the result.
 
-            # The current process_image_with_filter returns metadata/descriptions
-            # but not modified image bytes. Return the original image as the
-            # processed image so the client still receives an image.
+        The model never changes the image, so callers that already hold
+        the frame (or a handle to it) don't need it sent back. If the call
+        is refused or fails, the local fallback's result is returned with
+        ``degraded: True`` (that one may describe a changed image).
+        """
+        try:
+            # Use the existing AI image processing pipeline (best-effort).
+            base_prompt = f"Apply Star Wars themed mask overlay: {mask_id}."
+            prompt = f"{base_prompt} Face data: {json.dumps(face_data or {})}"
+            ai_result = self.process_image_with_filter(image_bytes, prompt, mask_id=mask_id, key_prompt=base_prompt)
+            if not ai_result.get('success') and self.fallback is not None:
+                return self._fallback_result(image_bytes, mask_id, ai_result)
             return {
                 'success': ai_result.get('success', False),
-                'processed_image': image_base64,
                 'description': ai_result.get('description'),
-                'suggestions': ai_result.get('suggestions')
+                'suggestions': ai_result.get('suggestions'),
+                'cached': ai_result.get('cached', False)
             }
 
         except Exception as e:
@@ -132,3 +404,33 @@ class GeminiService:
                 'success': False,
                 'error': str(e)
             }
+
+    def _fallback_result(self, image_bytes, mask_id, ai_result):
+        """Local stand-in for a mask enhancement the model could not serve"""
+        reason = ai_result.get('rejected') or 'error'
+        try:
+            local = self.fallback(image_bytes, mask_id)
+        except Exception as e:
+            self.logger.error(f"Local fallback for {mask_id} failed: {e}")
+            local = None
+        with self._counters_lock:
+            self.counters['fallbacks' if local is not None else 'fallback_errors'] += 1
+        if local is None:
+            return {'success': False, 'error': ai_result.get('error'), 'degraded': True, 'reason': reason}
+        return dict(
+            local,
+            success=True,
+            degraded=True,
+            reason=reason,
+            retry_after=ai_result.get('retry_after'),
+            description='AI enhancement unavailable; applied the local Sith filter instead',
+            suggestions=[],
+            cached=False
+        )
+
+    def stats(self):
+        """Guard state and counters plus fallback counts"""
+        stats = self.guard.stats() if self.guard is not None else {'state': 'unguarded'}
+        with self._counters_lock:
+            stats.update(self.counters)
+        return stats
@@ -0,0 +1,415 @@
+"""
+Image Executor for Star Wars Photobooth
+Process pool for CPU-bound image work, with frames passed in shared memory
+"""
+
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from services.camera_service import CameraService
+from services.metrics import record_stage
+
+# Byte payloads smaller than this go through the pipe; larger ones through shared memory
+SHARED_BYTES_THRESHOLD = 64 * 1024
+FRAME_MODES = ('RGB', 'RGBA', 'L')
+
+
+class TaskTimeout(TimeoutError):
+    """Raised when a task overruns its time limit (its worker is killed)"""
+
+
+class WorkerCrashed(RuntimeError):
+    """Raised when a worker process dies while running a task"""
+
+
+class SharedFrame:
+    """Pixels of a PIL image in a shared memory block, referenced by name.
+
+    Only this small descriptor is pickled between processes; the pixels are
+    copied once into the block and once out of it, never through the pipe.
+    """
+
+    __slots__ = ('name', 'mode', 'size', 'nbytes')
+
+    def __init__(self, name, mode, size, nbytes):
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.nbytes = nbytes
+
+    @classmethod
+    def create(cls, image):
+        if image.mode not in FRAME_MODES:
+            image = image.convert('RGB')
+        data = image.tobytes()
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            block.buf[:len(data)] = data
+        finally:
+            block.close()
+        return cls(block.name, image.mode, image.size, len(data))
+
+    def load(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            with block.buf[:self.nbytes] as view:
+                return Image.frombytes(self.mode, self.size, view)
+        finally:
+            block.close()
+
+    def unlink(self):
+        _unlink(self.name)
+
+
+class SharedBytes:
+    """An encoded image (JPEG, WebP, ...) in a shared memory block"""
+
+    __slots__ = ('name', 'nbytes')
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+
+    @classmethod
+    def create(cls, data):
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            block.buf[:len(data)] = data
+        finally:
+            block.close()
+        return cls(block.name, len(data))
+
+    def load(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(block.buf[:self.nbytes])
+        finally:
+            block.close()
+
+    def unlink(self):
+        _unlink(self.name)
+
+
+def _unlink(name):
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def _share(value, created):
+    """Move images and large byte strings into shared memory"""
+    if isinstance(value, Image.Image):
+        shared = SharedFrame.create(value)
+    elif isinstance(value, (bytes, bytearray)) and len(value) >= SHARED_BYTES_THRESHOLD:
+        shared = SharedBytes.create(value)
+    else:
+        return value
+    created.append(shared)
+    return shared
+
+
+def _unshare(value, unlink=False):
+    """Inverse of ``_share``; ``unlink`` frees blocks created by the other side"""
+    if isinstance(value, (SharedFrame, SharedBytes)):
+        try:
+            return value.load()
+        finally:
+            if unlink:
+                value.unlink()
+    return value
+
+
+def _share_result(result, created):
+    if isinstance(result, tuple):
+        return tuple(_share(value, created) for value in result)
+    return _share(result, created)
+
+
+def _unshare_result(result):
+    if isinstance(result, tuple):
+        return tuple(_unshare(value, unlink=True) for value in result)
+    return _unshare(result, unlink=True)
+
+
+def _worker_main(conn):
+    """Loop of a worker process: receive ``(fn, args, kwargs)``, reply ``(ok, result)``"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        fn, args, kwargs = task
+        try:
+            args = [_unshare(value) for value in args]
+            kwargs = {key: _unshare(value) for key, value in kwargs.items()}
+            created = []
+            reply = (True, _share_result(fn(*args, **kwargs), created))
+        except BaseException as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send((False, f"Could not return the result of {fn.__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, name):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), name=name, daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ImageExecutor:
+    """Runs module-level functions in a pool of ``max_workers`` processes.
+
+    Each worker runs one task at a time behind a dispatch thread, so image
+    work uses other cores instead of holding the GIL of a request worker.
+    PIL images and large byte strings in the arguments and result travel
+    in shared memory blocks, not pickled through the pipe. A task that
+    overruns ``task_timeout`` gets its worker killed and raises TaskTimeout;
+    a worker that dies raises WorkerCrashed. Either way a fresh worker is
+    started for the next task. Workers are spawned (not forked) on first
+    use; ``run`` is the blocking API and ``submit`` returns a Future.
+    """
+
+    def __init__(self, max_workers=2, task_timeout=30, name='image-worker'):
+        self.logger = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self.name = name
+        self._context = multiprocessing.get_context('spawn')
+        self._dispatch = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-dispatch')
+        # Idle workers; None is a slot whose worker has not been started yet
+        self._idle = queue.Queue()
+        for _ in range(max_workers):
+            self._idle.put(None)
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._queued = 0
+        self._closed = False
+        self.counters = {'tasks': 0, 'failed': 0, 'timeouts': 0, 'crashes': 0, 'started': 0}
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    def _start_worker(self):
+        worker = _Worker(self._context, f'{self.name}-{self.counters["started"]}')
+        with self._lock:
+            self._workers.add(worker)
+            self.counters['started'] += 1
+        return worker
+
+    def _discard_worker(self, worker, kill=False):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop(kill=kill)
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in a worker; returns a concurrent.futures.Future"""
+        if self._closed:
+            raise RuntimeError('Image executor is shut down')
+        with self._lock:
+            self._queued += 1
+        return self._dispatch.submit(self._run_task, fn, args, kwargs, timeout)
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Blocking ``submit``: the request thread waits without holding the GIL"""
+        return self.submit(fn, *args, timeout=timeout, **kwargs).result()
+
+    def map(self, fn, items, *args, timeout=None, **kwargs):
+        """``fn(item, *args, **kwargs)`` for every item, spread over the workers"""
+        futures = [self.submit(fn, item, *args, timeout=timeout, **kwargs) for item in items]
+        return [future.result() for future in futures]
+
+    def _run_task(self, fn, args, kwargs, timeout):
+        timeout = timeout or self.task_timeout
+        created = []
+        worker = self._idle.get()
+        started = time.perf_counter()
+        failed = True
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+        try:
+            if worker is None or not worker.process.is_alive():
+                if worker is not None:
+                    self._discard_worker(worker)
+                worker = self._start_worker()
+            shared_args = tuple(_share(value, created) for value in args)
+            shared_kwargs = {key: _share(value, created) for key, value in kwargs.items()}
+            try:
+                worker.conn.send((fn, shared_args, shared_kwargs))
+                finished = worker.conn.poll(timeout)
+                if finished:
+                    ok, result = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                self._discard_worker(worker, kill=True)
+                exitcode = worker.process.exitcode
+                worker = None
+                self._count(crashes=1)
+                raise WorkerCrashed(f"Image worker died running {fn.__name__} (exit code {exitcode})") from e
+            if not finished:
+                self._discard_worker(worker, kill=True)
+                worker = None
+                self._count(timeouts=1)
+                raise TaskTimeout(f"{fn.__name__} did not finish within {timeout}s")
+            if not ok:
+                raise RuntimeError(result)
+            result = _unshare_result(result)
+            failed = False
+            return result
+        finally:
+            for shared in created:
+                shared.unlink()
+            with self._lock:
+                self._busy -= 1
+            self._count(tasks=1, failed=int(failed))
+            record_stage(f'executor.{fn.__name__}', time.perf_counter() - started, failed=failed)
+            self._idle.put(worker)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['busy'] = self._busy
+            stats['queued'] = self._queued
+            stats['alive'] = sum(1 for worker in self._workers if worker.process.is_alive())
+        stats['workers'] = self.max_workers
+        return stats
+
+    def shutdown(self):
+        self._closed = True
+        self._dispatch.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+# Tasks run inside the workers. Each worker keeps one CameraService.
+
+_camera_service = None
+
+
+def _camera():
+    global _camera_service
+    if _camera_service is None:
+        _camera_service = CameraService()
+    return _camera_service
+
+
+def decode_image(image_bytes, target_size=None):
+    image = _camera().process_image_bytes(image_bytes, target_size)
+    if image is None:
+        return None
+    image.load()
+    return image if image.mode in FRAME_MODES else image.convert('RGB')
+
+
+def apply_sith_filter(image, filter_type):
+    return _camera().apply_sith_filter(image, filter_type)
+
+
+def detect_faces(image, min_face_size=None):
+    return _camera().detect_faces(image, min_face_size=min_face_size)
+
+
+def encode_image_bytes(image, quality=90):
+    return _camera().encode_image_bytes(image, quality)
+
+
+def optimize_image(image, **kwargs):
+    return _camera().optimize_image(image, **kwargs)
+
+
+class PooledCameraService(CameraService):
+    """CameraService whose CPU-heavy methods run in an ImageExecutor.
+
+    Same methods and failure contract as CameraService (errors are logged
+    and turned into the usual None / unfiltered / no-faces results), so it
+    can be handed to anything that takes a camera service.
+    """
+
+    def __init__(self, executor, face_detector=None):
+        super().__init__(face_detector)
+        self.executor = executor
+
+    def _run(self, fn, *args, fallback=None, **kwargs):
+        try:
+            return self.executor.run(fn, *args, **kwargs)
+        except Exception as e:
+            self.logger.error(f"Pooled {fn.__name__} failed: {e}")
+            return fallback
+
+    def process_image_bytes(self, image_bytes, target_size=None):
+        return self._run(decode_image, image_bytes, target_size)
+
+    def encode_image_bytes(self, image, quality=90):
+        return self._run(encode_image_bytes, image, quality)
+
+    def apply_sith_filter(self, image, filter_type):
+        if not image:
+            return None
+        return self._run(apply_sith_filter, image, filter_type, fallback=image)
+
+    def apply_sith_filter_batch(self, images, filter_type):
+        futures = [self.executor.submit(apply_sith_filter, image, filter_type) if image is not None else None
+                   for image in images]
+        results = []
+        for image, future in zip(images, futures):
+            try:
+                results.append(future.result() if future else image)
+            except Exception as e:
+                self.logger.error(f"Error applying filter {filter_type}: {e}")
+                results.append(image)
+        return results
+
+    def detect_faces(self, image, min_face_size=None):
+        return self._run(detect_faces, image, min_face_size=min_face_size, fallback=(False, []))
+
+    def detect_faces_batch(self, images, min_face_size=None):
+        futures = [self.executor.submit(detect_faces, image, min_face_size=min_face_size) for image in images]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result()[1])
+            except Exception as e:
+                self.logger.error(f"Error detecting faces: {e}")
+                results.append([])
+        return results
+
+    def optimize_image(self, image, max_width=1280, max_height=720, quality=85, format='JPEG', progressive=False):
+        # Shrink a lazily opened JPEG here with a reduced decode, so only the
+        # pixels the output needs are copied into shared memory
+        image = self.reduce_image(image, (max_width, max_height), Image.Resampling.LANCZOS)
+        return self._run(optimize_image, image, max_width=max_width, max_height=max_height,
+                         quality=quality, format=format, progressive=progressive)
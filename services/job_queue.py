@@ -0,0 +1,205 @@
+"""
+Job Queue for Star Wars Photobooth
+Bounded in-process worker pool for slow background work (AI calls)
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from services.metrics import record_stage
+
+# The job the current worker thread is running, for remaining_time()
+_current = threading.local()
+
+
+def remaining_time():
+    """Seconds left before the calling thread's job deadline.
+
+    None outside a job or for jobs without a deadline. Blocking calls made
+    by a job pass this down as their own timeout, so an overrunning call
+    gives its worker back instead of holding it past the deadline.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None or not job.deadline:
+        return None
+    return job.deadline - time.time()
+
+
+class QueueFull(Exception):
+    """Raised when the queue has no room for another job"""
+
+
+class Job:
+    """A unit of background work and its outcome"""
+
+    def __init__(self, fn, args, kwargs, timeout):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.deadline = self.created + timeout if timeout else None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _start(self):
+        """Mark a queued job running; False if it was cancelled first"""
+        with self._lock:
+            if self.done:
+                return False
+            self.status = 'running'
+            self.started = time.time()
+            return True
+
+    def _finish(self, status, result=None, error=None):
+        """Record the outcome; False if the job already had one (e.g. cancelled)"""
+        with self._lock:
+            if self.done:
+                return False
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            self._done.set()
+            return True
+
+    def to_dict(self):
+        status = self.status
+        # A running job past its deadline is reported as timed out right
+        # away; its eventual result is discarded
+        if status == 'running' and self.deadline and time.time() > self.deadline:
+            status = 'timeout'
+        data = {
+            'job_id': self.id,
+            'status': status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+        if status == 'done':
+            data['result'] = self.result
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded queue drained by a fixed pool of daemon worker threads.
+
+    ``submit`` raises QueueFull instead of blocking once ``max_pending``
+    jobs are waiting, so callers can shed load (HTTP 429). Jobs have a
+    deadline: a job still queued at its deadline is never started, and a
+    running job that overruns it is marked ``timeout``. Threads cannot be
+    interrupted, so jobs bound their blocking calls with ``remaining_time()``
+    to actually free the worker. Queued or running jobs can be cancelled;
+    a running job's result is then dropped.
+    """
+
+    def __init__(self, workers=2, max_pending=16, default_timeout=60, result_ttl=300):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.default_timeout = default_timeout
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; returns the Job or raises QueueFull"""
+        self._prune()
+        job = Job(fn, args, kwargs, timeout if timeout is not None else self.default_timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f"Job queue is full ({self.max_pending} pending)")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        job = self.get(job_id)
+        return job is not None and job._finish('cancelled')
+
+    def stats(self):
+        with self._lock:
+            running = self._running
+            tracked = len(self._jobs)
+        return {
+            'workers': self.workers,
+            'running': running,
+            'queued': self._queue.qsize(),
+            'capacity': self.max_pending,
+            'tracked_jobs': tracked
+        }
+
+    def _prune(self):
+        """Forget finished jobs whose results have not been collected in time"""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.deadline and time.time() > job.deadline:
+                    job._finish('timeout', error='Job expired before it started')
+                    continue
+                if not job._start():  # cancelled while queued
+                    continue
+
+                record_stage('jobs.queue_wait', job.started - job.created)
+                with self._lock:
+                    self._running += 1
+                _current.job = job
+                try:
+                    result = job.fn(*job.args, **job.kwargs)
+                    outcome = ('done', result, None)
+                except Exception as e:
+                    self.logger.error(f"Job {job.id} failed: {e}")
+                    outcome = ('failed', None, str(e))
+                finally:
+                    _current.job = None
+                    with self._lock:
+                        self._running -= 1
+                record_stage('jobs.run', time.time() - job.started, failed=outcome[0] == 'failed')
+
+                # Cancelled while running: _finish keeps 'cancelled'
+                if job.deadline and time.time() > job.deadline:
+                    job._finish('timeout', error='Job exceeded its time limit')
+                else:
+                    job._finish(*outcome)
+            finally:
+                self._queue.task_done()
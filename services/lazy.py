@@ -0,0 +1,37 @@
+"""
+Lazy service construction for Star Wars Photobooth
+Defers building services until the first request that needs them
+"""
+
+import functools
+import threading
+
+
+def lazy_service(factory):
+    """Turn a zero-argument factory into an accessor that builds once.
+
+    The first call runs the factory under a lock; later calls return the
+    same instance without locking. ``accessor.peek()`` returns the instance
+    only if it has already been built, and ``accessor.reset()`` drops it.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def accessor():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    def peek():
+        return instance[0] if instance else None
+
+    def reset():
+        with lock:
+            instance.clear()
+
+    accessor.peek = peek
+    accessor.reset = reset
+    return accessor
@@ -0,0 +1,341 @@
+"""
+Mask Registry for Star Wars Photobooth
+Mask catalog from static/masks and its manifest, with precomputed geometry
+"""
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from services.camera_service import FACE_MASKS, HELMET_MASKS, MASK_SCALE_FACTORS, MASK_Y_ADJUSTMENTS
+
+MANIFEST_NAME = 'manifest.json'
+# analyze_mask() results stored in a manifest entry, under 'analysis'
+ANALYSIS_FIELDS = ('width', 'height', 'aspect', 'alpha_bbox', 'coverage', 'anchors', 'anchor_source', 'thumbnail')
+ALPHA_THRESHOLD = 128
+# Anchors as fractions of the alpha bounding box, used when the mask has no
+# eye or mouth holes to measure (helmets with opaque visors)
+DEFAULT_ANCHORS = {'left_eye': (0.3, 0.43), 'right_eye': (0.7, 0.43), 'mouth': (0.5, 0.72)}
+# Nose tip and chin along the eyes-to-mouth line, in units of its length
+NOSE_DROP = 0.6
+CHIN_DROP = 0.7
+
+
+def _point(x, y, width, height):
+    return {'x': round(x / width, 4), 'y': round(y / height, 4)}
+
+
+def find_anchors(alpha, bbox):
+    """Eye, nose, mouth and chin anchors from the holes in a mask's alpha channel.
+
+    ``alpha`` is an HxW uint8 array and ``bbox`` the (left, top, right,
+    bottom) of its opaque pixels. Holes are transparent regions enclosed
+    by the mask; the two largest in the eye band become the eyes and the
+    largest below them the mouth. Missing anchors are estimated from the
+    bounding box, and the nose and chin follow from the eyes and mouth.
+    Returns ``(anchors, source)`` with points normalized to the image size.
+    """
+    import cv2
+    height, width = alpha.shape
+    left, top, right, bottom = bbox
+    box_width, box_height = right - left, bottom - top
+    crop = (alpha[top:bottom, left:right] < ALPHA_THRESHOLD).astype('uint8')
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(crop, connectivity=4)
+
+    holes = []
+    for i in range(1, count):
+        x, y, w, h, area = stats[i]
+        # Transparent regions touching the box edge are outside the mask
+        if x == 0 or y == 0 or x + w >= box_width or y + h >= box_height:
+            continue
+        if area >= 0.001 * box_width * box_height:
+            holes.append((area, centroids[i][0] / box_width, centroids[i][1] / box_height))
+
+    found = {}
+    eyes = sorted((h for h in holes if 0.2 <= h[2] <= 0.6), reverse=True)[:2]
+    if len(eyes) == 2:
+        first, second = sorted(eyes, key=lambda h: h[1])
+        found['left_eye'], found['right_eye'] = first[1:], second[1:]
+        eye_line = max(first[2], second[2])
+        mouths = sorted((h for h in holes if h[2] > eye_line + 0.15), reverse=True)
+        if mouths:
+            found['mouth'] = mouths[0][1:]
+
+    points = {}
+    for name, default in DEFAULT_ANCHORS.items():
+        fx, fy = found.get(name, default)
+        points[name] = (left + fx * box_width, top + fy * box_height)
+    eye_x = (points['left_eye'][0] + points['right_eye'][0]) / 2
+    eye_y = (points['left_eye'][1] + points['right_eye'][1]) / 2
+    drop_x, drop_y = points['mouth'][0] - eye_x, points['mouth'][1] - eye_y
+    points['nose'] = (eye_x + NOSE_DROP * drop_x, eye_y + NOSE_DROP * drop_y)
+    points['chin'] = (points['mouth'][0] + CHIN_DROP * drop_x, points['mouth'][1] + CHIN_DROP * drop_y)
+
+    anchors = {name: _point(x, y, width, height) for name, (x, y) in points.items()}
+    source = 'holes' if len(found) == len(DEFAULT_ANCHORS) else 'partial' if found else 'estimated'
+    return anchors, source
+
+
+def analyze_mask(path, thumbnail_size=64):
+    """Size, alpha bounding box, anchors and a data-URL thumbnail for a mask file"""
+    import numpy as np
+    with Image.open(path) as image:
+        rgba = image.convert('RGBA')
+    width, height = rgba.size
+    alpha = np.asarray(rgba.getchannel('A'))
+    opaque = alpha >= ALPHA_THRESHOLD
+    if opaque.any():
+        rows, cols = np.flatnonzero(opaque.any(axis=1)), np.flatnonzero(opaque.any(axis=0))
+        bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    else:
+        bbox = (0, 0, width, height)
+    anchors, source = find_anchors(alpha, bbox)
+
+    thumbnail = rgba.crop(bbox)
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    thumbnail.save(output, format='WEBP', quality=80)
+
+    left, top, right, bottom = bbox
+    return {
+        'width': width,
+        'height': height,
+        'aspect': round(height / width, 4),
+        'alpha_bbox': {
+            'x': round(left / width, 4), 'y': round(top / height, 4),
+            'width': round((right - left) / width, 4), 'height': round((bottom - top) / height, 4)
+        },
+        'coverage': round(float(opaque.mean()), 4),
+        'anchors': anchors,
+        'anchor_source': source,
+        'thumbnail': 'data:image/webp;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+    }
+
+
+def _unlisted_entry(filename):
+    """Manifest entry for a PNG the manifest does not mention"""
+    stem = os.path.splitext(filename)[0]
+    return {'id': stem, 'name': stem.replace('-', ' ').replace('_', ' ').title(),
+            'file': filename, 'icon': '🎭', 'description': ''}
+
+
+def default_placement(mask_id):
+    """Placement hints the server compositor uses for a mask (see MaskCompositor.placement)"""
+    kind = 'helmet' if mask_id in HELMET_MASKS else 'face' if mask_id in FACE_MASKS else 'overlay'
+    return {
+        'kind': kind,
+        'scale': MASK_SCALE_FACTORS.get(mask_id, 1.2),
+        'y_adjust': MASK_Y_ADJUSTMENTS.get(mask_id, 0.0)
+    }
+
+
+class MaskRegistry:
+    """The mask catalog, built from ``masks_dir`` and its manifest.json.
+
+    The manifest lists masks in display order with their names, icons
+    and descriptions (and optional ``anchors``/``placement`` overrides);
+    PNGs it does not mention are added after it under their file stem.
+    Image analysis (OpenCV) is a deploy step: ``build_manifest`` stores
+    it in each entry's ``analysis``, which is used as long as the file
+    still has the recorded size. Only unlisted or changed files are
+    analyzed at runtime, once per version of the file. ``refresh``
+    rebuilds the catalog when the manifest or any mask file changes, at
+    most once every ``check_interval`` seconds. ``version`` changes with
+    the catalog, so it can serve as an ETag.
+    """
+
+    def __init__(self, masks_dir, url_prefix='/static/masks/', thumbnail_size=64, check_interval=2.0):
+        self.logger = logging.getLogger(__name__)
+        self.masks_dir = masks_dir
+        self.url_prefix = url_prefix
+        self.thumbnail_size = thumbnail_size
+        self.check_interval = check_interval
+        self._analyses = {}  # filename -> (signature, analysis)
+        self._signature = None
+        self._checked = 0.0
+        self._masks = []
+        self._by_id = {}
+        self.version = None
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _scan(self):
+        """``{filename: (mtime_ns, size)}`` for the manifest and every PNG"""
+        files = {}
+        try:
+            with os.scandir(self.masks_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and (entry.name == MANIFEST_NAME or entry.name.lower().endswith('.png')):
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+        return files
+
+    def refresh(self, force=False):
+        """Rebuild the catalog if files changed; returns True when it was rebuilt"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            if not force and now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            files = self._scan()
+            signature = tuple(sorted(files.items()))
+            if signature == self._signature:
+                return False
+            self._load(files)
+            self._signature = signature
+            self.reloads += 1
+        self.logger.info(f"Loaded {len(self._masks)} masks (version {self.version})")
+        return True
+
+    def _read_manifest(self):
+        path = os.path.join(self.masks_dir, MANIFEST_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('masks', [])
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable mask manifest: {e}")
+            return []
+
+    def _analysis(self, filename, signature, precomputed=None):
+        cached = self._analyses.get(filename)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        if precomputed and precomputed.get('file_size') == signature[1] \
+                and precomputed.get('thumbnail_size') == self.thumbnail_size:
+            if 'error' in precomputed:
+                analysis = None  # known to be unreadable; don't retry on every start
+            elif all(field in precomputed for field in ANALYSIS_FIELDS):
+                analysis = {field: precomputed[field] for field in ANALYSIS_FIELDS}
+            else:
+                precomputed = None
+            if precomputed:
+                self._analyses[filename] = (signature, analysis)
+                return analysis
+        try:
+            analysis = analyze_mask(os.path.join(self.masks_dir, filename), self.thumbnail_size)
+        except Exception as e:
+            self.logger.warning(f"Skipping unreadable mask {filename}: {e}")
+            analysis = None
+        self._analyses[filename] = (signature, analysis)
+        return analysis
+
+    def _load(self, files):
+        """Build the catalog from the manifest and scanned files; caller holds the lock"""
+        entries = list(self._read_manifest())
+        listed = {entry.get('file') for entry in entries}
+        for filename in sorted(files):
+            if filename != MANIFEST_NAME and filename not in listed:
+                entries.append(_unlisted_entry(filename))
+
+        masks = []
+        for entry in entries:
+            mask_id, filename = entry.get('id'), entry.get('file')
+            if not mask_id:
+                continue
+            mask = {
+                'id': mask_id,
+                'name': entry.get('name', mask_id),
+                'image': None,
+                'icon': entry.get('icon', ''),
+                'description': entry.get('description', '')
+            }
+            if filename:
+                if filename not in files:
+                    self.logger.warning(f"Mask {mask_id} lists missing file {filename}")
+                    continue
+                analysis = self._analysis(filename, files[filename], entry.get('analysis'))
+                if analysis is None:
+                    continue
+                mask['image'] = self.url_prefix + filename
+                mask['file'] = filename
+                mask.update(analysis)
+                if entry.get('anchors'):
+                    mask['anchors'] = dict(mask['anchors'], **entry['anchors'])
+                    mask['anchor_source'] = 'manifest'
+                mask['placement'] = dict(default_placement(mask_id), **entry.get('placement', {}))
+            masks.append(mask)
+
+        # Forget analyses of files that are gone
+        for filename in [name for name in self._analyses if name not in files]:
+            del self._analyses[filename]
+        self._masks = masks
+        self._by_id = {mask['id']: mask for mask in masks}
+        self.version = hashlib.sha256(
+            json.dumps(masks, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:20]
+
+    def build_manifest(self):
+        """Analyze every mask and store the results in manifest.json.
+
+        Run at deploy time (``flask build-assets``) so serving /api/masks
+        never needs OpenCV. Unlisted PNGs get entries of their own.
+        Returns the number of masks analyzed.
+        """
+        with self._lock:
+            files = self._scan()
+            entries = [dict(entry) for entry in self._read_manifest()]
+            listed = {entry.get('file') for entry in entries}
+            for filename in sorted(files):
+                if filename != MANIFEST_NAME and filename not in listed:
+                    entries.append(_unlisted_entry(filename))
+            analyzed = 0
+            for entry in entries:
+                filename = entry.get('file')
+                entry.pop('analysis', None)
+                if not filename or filename not in files:
+                    continue
+                stored = {'file_size': files[filename][1], 'thumbnail_size': self.thumbnail_size}
+                try:
+                    stored.update(analyze_mask(os.path.join(self.masks_dir, filename), self.thumbnail_size))
+                    analyzed += 1
+                except Exception as e:
+                    self.logger.warning(f"Recording unreadable mask {filename}: {e}")
+                    stored['error'] = type(e).__name__
+                entry['analysis'] = stored
+
+            path = os.path.join(self.masks_dir, MANIFEST_NAME)
+            fd, tmp_path = tempfile.mkstemp(dir=self.masks_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'masks': entries}, f, indent=4, ensure_ascii=False)
+                    f.write('\n')
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        self.refresh(force=True)
+        return analyzed
+
+    def masks(self):
+        return self._masks
+
+    def get(self, mask_id):
+        return self._by_id.get(mask_id)
+
+    def aliases(self):
+        """``{mask_id: file stem}`` for MaskCompositor"""
+        return {mask['id']: os.path.splitext(mask['file'])[0] for mask in self._masks if mask.get('file')}
+
+    def stats(self):
+        return {
+            'masks': len(self._masks),
+            'version': self.version,
+            'reloads': self.reloads,
+            'analyzed_files': sum(1 for _, analysis in self._analyses.values() if analysis is not None)
+        }
@@ -0,0 +1,309 @@
+"""
+Metrics for Star Wars Photobooth
+Thread-safe counters, gauges and latency histograms with Prometheus text output
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+# Upper bounds in seconds; spans sub-millisecond decodes to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request being handled on this thread/context, so a
+# structured timing log line can break a request down by stage
+_current_stages = contextvars.ContextVar('photobooth_stages', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing count; the name should end in ``_total``"""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Point-in-time value, either set directly or read at scrape time.
+
+    ``collect`` is an optional callable returning ``{label_values: value}``
+    (or a bare number for an unlabelled gauge); it is called on every render
+    so values like queue depth are never stale.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.collect is not None:
+            try:
+                collected = self.collect()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Gauge {self.name} collection failed: {e}")
+                collected = None
+            if isinstance(collected, dict):
+                values.update({self._key(k if isinstance(k, tuple) else (k,)): v for k, v in collected.items()})
+            elif collected is not None:
+                values[()] = collected
+        lines = self._header()
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observations (seconds or bytes)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last slot is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self, *labels):
+        """(count, sum) for one label set"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(round(total, 6))}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics for one process.
+
+    Registering a name twice returns the existing metric, so modules can
+    declare what they record at import time. Under gunicorn each worker
+    has its own registry; scrape every worker or aggregate downstream.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        gauge = self._register(Gauge, name, help, labelnames)
+        if collect is not None:
+            gauge.collect = collect
+        return gauge
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'photobooth_stage_duration_seconds',
+    'Time spent in one processing stage (decode, filter, disk write, model call, ...)',
+    ('stage',)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    'photobooth_stage_errors_total',
+    'Stages that raised an exception',
+    ('stage',)
+)
+
+
+class timed:
+    """Record the duration of a stage, as a context manager or decorator.
+
+        with timed('capture.disk_write'):
+            ...
+
+        @timed('camera.decode')
+        def process_image_data(self, image_data): ...
+
+    The cost is two perf_counter calls and one locked histogram update, so
+    it is cheap enough to leave on in production.
+    """
+
+    __slots__ = ('stage', '_started')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.stage, time.perf_counter() - self._started, failed=exc_type is not None)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_stage(stage, time.perf_counter() - started, failed=failed)
+        return wrapper
+
+
+def record_stage(stage, seconds, failed=False):
+    STAGE_SECONDS.observe(seconds, stage)
+    if failed:
+        STAGE_ERRORS.inc(stage)
+    stages = _current_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def begin_request_stages():
+    """Start collecting stage timings for the current request; returns a reset token"""
+    return _current_stages.set({})
+
+
+def end_request_stages(token):
+    """Stop collecting and return ``{stage: seconds}`` for the current request"""
+    stages = _current_stages.get() or {}
+    _current_stages.reset(token)
+    return stages
+
+
+class TimingLogger:
+    """Writes one JSON line per request with its latency, sizes and stages"""
+
+    def __init__(self, logger_name='photobooth.timing'):
+        self.logger = logging.getLogger(logger_name)
+
+    def log(self, **fields):
+        if 'stages' in fields:
+            fields['stages'] = {stage: round(seconds * 1000, 3) for stage, seconds in fields['stages'].items()}
+        self.logger.info(json.dumps(fields, separators=(',', ':'), default=str))
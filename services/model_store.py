@@ -0,0 +1,305 @@
+"""
+Model Store for Star Wars Photobooth
+Streaming, deduplicated and resumable uploads of MediaPipe .task models
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialized within the process only
+    fcntl = None
+
+from services.upload_stream import DEFAULT_CHUNK_SIZE, StreamedUpload, UploadTooLarge, stream_to_tempfile
+
+SESSIONS_DIRNAME = '.uploads'
+
+
+class ModelRejected(ValueError):
+    """Raised when an uploaded model fails validation (size, checksum, name)"""
+
+
+class UploadSessionConflict(Exception):
+    """Raised when a chunk does not start where the stored upload ends"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """Model files in ``models_dir``, addressed by name and SHA-256.
+
+    Uploads are streamed to a temp file and renamed into place, so a model
+    is never held in memory and readers never see a partial file. Content
+    that is already stored (under any name) is not written again. Resumable
+    upload sessions keep their bytes in ``<models_dir>/.uploads`` so any
+    worker can continue them after a dropped connection.
+    """
+
+    def __init__(self, models_dir, min_bytes=50 * 1024, max_bytes=64 * 1024 * 1024, session_ttl=24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.models_dir = models_dir
+        self.sessions_dir = os.path.join(models_dir, SESSIONS_DIRNAME)
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self._digests = {}  # filename -> (size, mtime_ns, sha256)
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()  # only used without fcntl
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    def path(self, filename):
+        return os.path.join(self.models_dir, filename)
+
+    def _model_files(self):
+        for name in os.listdir(self.models_dir):
+            if not name.startswith('.') and os.path.isfile(self.path(name)):
+                yield name
+
+    def digest(self, filename):
+        """SHA-256 of a stored model, cached until the file's size or mtime changes"""
+        stat = os.stat(self.path(filename))
+        with self._lock:
+            cached = self._digests.get(filename)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        sha256 = _file_sha256(self.path(filename))
+        with self._lock:
+            self._digests[filename] = (stat.st_size, stat.st_mtime_ns, sha256)
+        return sha256
+
+    def find_by_digest(self, sha256):
+        for name in self._model_files():
+            if self.digest(name) == sha256:
+                return name
+        return None
+
+    def _check_size(self, size):
+        if size < self.min_bytes:
+            raise ModelRejected('Uploaded file is too small to be a valid model')
+        if self.max_bytes and size > self.max_bytes:
+            raise UploadTooLarge(f"Model exceeds {self.max_bytes} bytes")
+
+    def save_stream(self, stream, filename):
+        """Stream a request body into the store; see ``commit``"""
+        upload = stream_to_tempfile(stream, self.sessions_dir, max_bytes=self.max_bytes)
+        try:
+            return self.commit(upload, filename)
+        except BaseException:
+            upload.discard()
+            raise
+
+    def commit(self, upload, filename):
+        """Move a StreamedUpload into place under ``filename``.
+
+        Returns ``{'filename', 'size', 'sha256', 'deduplicated'}``. When the
+        content is already stored, the temp file is dropped; if it is stored
+        under another name, that file is hard-linked rather than copied. On
+        error the caller still owns (and should discard) the upload.
+        """
+        self._check_size(upload.size)
+        target = self.path(filename)
+        result = {'filename': filename, 'size': upload.size, 'sha256': upload.sha256, 'deduplicated': False}
+
+        if os.path.exists(target) and self.digest(filename) == upload.sha256:
+            upload.discard()
+            result['deduplicated'] = True
+            return result
+
+        existing = self.find_by_digest(upload.sha256)
+        if existing is not None and self._link(existing, target):
+            upload.discard()
+            result['deduplicated'] = True
+        else:
+            upload.commit(target)
+        self.digest(filename)
+        return result
+
+    def _link(self, source_name, target):
+        """Atomically point ``target`` at an existing model's content"""
+        tmp_path = os.path.join(self.sessions_dir, f"{uuid.uuid4().hex}.link")
+        try:
+            os.link(self.path(source_name), tmp_path)
+            os.replace(tmp_path, target)
+            return True
+        except OSError as e:
+            # No hard links on this filesystem; fall back to a normal write
+            self.logger.info(f"Could not link {source_name} to {target}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    # Resumable uploads
+
+    def _session_paths(self, session_id):
+        base = os.path.join(self.sessions_dir, session_id)
+        return base + '.json', base + '.part'
+
+    def _save_session(self, session):
+        meta_path, _ = self._session_paths(session['id'])
+        fd, tmp_path = tempfile.mkstemp(dir=self.sessions_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, meta_path)
+
+    def create_session(self, filename, size, sha256=None):
+        """Start a resumable upload of ``size`` bytes.
+
+        If ``sha256`` names content that is already stored, the model is
+        linked into place immediately and the returned session is complete.
+        """
+        self.prune_sessions()
+        self._check_size(size)
+        session = {
+            'id': uuid.uuid4().hex,
+            'filename': filename,
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'offset': 0,
+            'created': time.time(),
+            'result': None
+        }
+        if session['sha256']:
+            existing = self.find_by_digest(session['sha256'])
+            if existing == filename or (existing and self._link(existing, self.path(filename))):
+                session['offset'] = size
+                session['result'] = {'filename': filename, 'size': size,
+                                     'sha256': session['sha256'], 'deduplicated': True}
+                return session
+        self._save_session(session)
+        open(self._session_paths(session['id'])[1], 'wb').close()
+        return session
+
+    def get_session(self, session_id):
+        """Session metadata with the current offset, or None"""
+        if not session_id.isalnum():
+            return None
+        meta_path, part_path = self._session_paths(session_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            session['offset'] = os.path.getsize(part_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return session
+
+    def append(self, session_id, start, stream, total=None):
+        """Append a chunk at byte ``start``; finishes the upload on the last byte.
+
+        Raises UploadSessionConflict if ``start`` is not the stored offset
+        (the client should resume from ``offset``), ModelRejected if the
+        declared total or the final checksum disagree with the session.
+
+        The chunk is written straight into the part file under an exclusive
+        lock on it, so two requests for the same offset (a client retrying
+        over a slow link) cannot both append; a chunk that fails midway is
+        truncated away.
+        """
+        session = self.get_session(session_id)
+        if session is None:
+            return None
+        if total is not None and total != session['size']:
+            raise ModelRejected(f"Upload size is {session['size']} bytes, not {total}")
+        if start != session['offset']:
+            raise UploadSessionConflict(session['offset'])
+
+        _, part_path = self._session_paths(session_id)
+        try:
+            part = open(part_path, 'r+b')
+        except FileNotFoundError:
+            return None  # finished or aborted meanwhile
+        with part, self._part_lock(part):
+            if os.fstat(part.fileno()).st_nlink == 0:
+                return None  # finished or aborted while we waited for the lock
+            offset = os.fstat(part.fileno()).st_size
+            if start != offset:
+                raise UploadSessionConflict(offset)
+            part.seek(offset)
+            try:
+                written = self._copy_chunk(stream, part, session['size'] - offset)
+            except BaseException:
+                part.truncate(offset)
+                raise
+            session['offset'] = offset + written
+            if session['offset'] == session['size']:
+                session['result'] = self._finish(session)
+        return session
+
+    @contextlib.contextmanager
+    def _part_lock(self, part):
+        """Exclusive lock on a session's part file, shared by all workers"""
+        if fcntl is None:
+            with self._append_lock:
+                yield
+            return
+        fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(part.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _copy_chunk(stream, part, max_bytes):
+        """Copy a request body into the open part file; returns the bytes written"""
+        written = 0
+        while True:
+            block = stream.read(DEFAULT_CHUNK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > max_bytes:
+                raise UploadTooLarge(f"Chunk runs past the declared size by {written - max_bytes} bytes")
+            part.write(block)
+        part.flush()
+        return written
+
+    def _finish(self, session):
+        meta_path, part_path = self._session_paths(session['id'])
+        sha256 = _file_sha256(part_path)
+        try:
+            if session['sha256'] and sha256 != session['sha256']:
+                raise ModelRejected('Uploaded model does not match the declared SHA-256')
+            upload = StreamedUpload(part_path, session['size'], sha256, b'')
+            return self.commit(upload, session['filename'])
+        finally:
+            for path in (meta_path, part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def abort_session(self, session_id):
+        if not session_id.isalnum():
+            return False
+        removed = False
+        for path in self._session_paths(session_id):
+            if os.path.exists(path):
+                os.remove(path)
+                removed = True
+        return removed
+
+    def prune_sessions(self):
+        """Delete abandoned sessions and stray temp files older than the TTL"""
+        cutoff = time.time() - self.session_ttl
+        for name in os.listdir(self.sessions_dir):
+            path = os.path.join(self.sessions_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
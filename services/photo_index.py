@@ -0,0 +1,362 @@
+"""
+Photo Index for Star Wars Photobooth
+Persistent SQLite metadata store for captured photos
+"""
+
+import base64
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class PhotoIndex:
+    """SQLite (WAL) index of captured photos used by the gallery
+
+    Each record maps a photo's public filename to the PhotoStore blob that
+    holds its bytes (``blob``); records from before the store existed have
+    no blob until ``migrate_flat_photos`` moves their files. Burst captures
+    are records of ``kind`` 'animation' (an animated WebP/GIF blob, plus an
+    MP4 in ``video_blob`` when one was encoded).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS photos (
+            filename TEXT PRIMARY KEY,
+            mask TEXT NOT NULL DEFAULT 'none',
+            size INTEGER NOT NULL DEFAULT 0,
+            timestamp REAL NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            blob TEXT,
+            optimized INTEGER NOT NULL DEFAULT 0,
+            last_access REAL,
+            kind TEXT NOT NULL DEFAULT 'photo',
+            video_blob TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_photos_timestamp
+            ON photos (timestamp DESC, filename DESC);
+        CREATE INDEX IF NOT EXISTS idx_photos_mask_timestamp
+            ON photos (mask, timestamp DESC, filename DESC);
+        CREATE INDEX IF NOT EXISTS idx_photos_blob ON photos (blob);
+        CREATE INDEX IF NOT EXISTS idx_photos_video_blob ON photos (video_blob);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path, uploads_dir, exclude=None):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path
+        self.uploads_dir = uploads_dir
+        # Optional predicate for files in uploads_dir that are not photos
+        # (e.g. generated thumbnails)
+        self.exclude = exclude
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        self._upgrade_schema(conn)
+        conn.executescript(self.SCHEMA)
+        if self._get_meta(conn, 'synced') is None:
+            self.sync_from_directory()
+
+    def _connect(self):
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self, immediate=False):
+        """The calling thread's connection inside a transaction, committed on exit.
+
+        Nested uses join the outermost transaction. ``immediate`` takes the
+        database write lock up front (BEGIN IMMEDIATE) instead of at the
+        first write.
+        """
+        conn = self._connect()
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            if depth:
+                yield conn
+                return
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            with conn:
+                yield conn
+        finally:
+            self._local.depth = depth
+
+    def blob_lock(self):
+        """Hold the database write lock across a blob operation and its index writes.
+
+        PhotoStore.put_* skip content that is already stored, so storing a
+        blob and recording the new reference must not interleave with
+        counting a blob's references and deleting it, or the new record
+        could point at a deleted blob. Both sides run inside this block,
+        which serializes them across threads and worker processes; index
+        writes made inside it commit when it exits.
+        """
+        return self._transaction(immediate=True)
+
+    # Columns added after the first release: name -> column definition
+    ADDED_COLUMNS = {
+        'blob': 'blob TEXT',
+        'optimized': 'optimized INTEGER NOT NULL DEFAULT 0',
+        'last_access': 'last_access REAL',
+        'kind': "kind TEXT NOT NULL DEFAULT 'photo'",
+        'video_blob': 'video_blob TEXT',
+    }
+
+    @classmethod
+    def _upgrade_schema(cls, conn):
+        """Add columns introduced after a database was created"""
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(photos)')]
+        if not columns:
+            return
+        with conn:
+            for name, definition in cls.ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE photos ADD COLUMN {definition}')
+
+    @staticmethod
+    def _get_meta(conn, key):
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    @staticmethod
+    def _bump_version(conn):
+        """Increment the index version; every write invalidates gallery ETags"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    @staticmethod
+    def read_dimensions(filepath):
+        """Read image dimensions from the file header without decoding pixels"""
+        try:
+            with Image.open(filepath) as image:
+                return image.size
+        except Exception:
+            return None, None
+
+    def version(self):
+        """Current index version, shared by all workers using the same database"""
+        return int(self._get_meta(self._connect(), 'version') or 0)
+
+    def add(self, filename, mask='none', size=0, timestamp=0.0, width=None, height=None, blob=None,
+            kind='photo', video_blob=None):
+        """Insert or replace a photo record"""
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO photos (filename, mask, size, timestamp, width, height, blob, kind, video_blob) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (filename, mask or 'none', size, timestamp, width, height, blob, kind, video_blob)
+            )
+            self._bump_version(conn)
+
+    def exists(self, filename):
+        row = self._connect().execute('SELECT 1 FROM photos WHERE filename = ?', (filename,)).fetchone()
+        return row is not None
+
+    def set_blob(self, filename, blob):
+        """Point an existing record at its PhotoStore blob"""
+        with self._transaction() as conn:
+            conn.execute('UPDATE photos SET blob = ? WHERE filename = ?', (blob, filename))
+
+    def blob_references(self, blob):
+        """Number of photos sharing a blob (identical captures are stored once)"""
+        row = self._connect().execute(
+            'SELECT (SELECT COUNT(*) FROM photos WHERE blob = ?) + '
+            '(SELECT COUNT(*) FROM photos WHERE video_blob = ?) AS n', (blob, blob)
+        ).fetchone()
+        return row['n']
+
+    def touch(self, filename, now, min_interval=3600):
+        """Record an access for eviction by last use; at most one write per interval"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'UPDATE photos SET last_access = ? WHERE filename = ? '
+                'AND (last_access IS NULL OR last_access < ?)',
+                (now, filename, now - min_interval)
+            )
+
+    def unoptimized(self, limit):
+        """Oldest stored photos that have not been through recompression yet"""
+        # Animations are encoded once at their final quality; re-encoding
+        # them as stills would drop every frame but the first
+        rows = self._connect().execute(
+            "SELECT * FROM photos WHERE optimized = 0 AND blob IS NOT NULL AND kind = 'photo' "
+            'ORDER BY timestamp ASC LIMIT ?', (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def replace_blob(self, old_blob, new_blob, size):
+        """Point every photo using ``old_blob`` at recompressed content"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE photos SET blob = ?, size = ?, optimized = 1 WHERE blob = ?',
+                (new_blob, size, old_blob)
+            )
+            self._bump_version(conn)
+
+    def mark_optimized(self, blob):
+        conn = self._connect()
+        with conn:
+            conn.execute('UPDATE photos SET optimized = 1 WHERE blob = ?', (blob,))
+
+    def eviction_candidates(self, order='age', limit=50):
+        """Photos to evict first: oldest capture, or least recently accessed"""
+        key = 'COALESCE(last_access, timestamp)' if order == 'access' else 'timestamp'
+        rows = self._connect().execute(
+            f'SELECT * FROM photos ORDER BY {key} ASC, filename ASC LIMIT ?', (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def storage_stats(self):
+        """Photo count, pending recompression and bytes held by distinct blobs"""
+        conn = self._connect()
+        counts = conn.execute(
+            "SELECT COUNT(*) AS photos, COALESCE(SUM(optimized = 0 AND kind = 'photo'), 0) AS unoptimized FROM photos"
+        ).fetchone()
+        usage = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) AS bytes FROM '
+            '(SELECT MAX(size) AS size FROM photos WHERE blob IS NOT NULL GROUP BY blob)'
+        ).fetchone()
+        return {'photos': counts['photos'], 'unoptimized': counts['unoptimized'], 'bytes': usage['bytes']}
+
+    def iter_unstored(self):
+        """Yield filenames of records whose file has not been moved into the store"""
+        rows = self._connect().execute('SELECT filename FROM photos WHERE blob IS NULL')
+        for row in rows.fetchall():
+            yield row['filename']
+
+    def add_file(self, filename, filepath, mask='none', blob=None):
+        """Index a photo from a file on disk (its dimensions come from the header)"""
+        stat = os.stat(filepath)
+        width, height = self.read_dimensions(filepath)
+        self.add(filename, mask, stat.st_size, stat.st_mtime, width, height, blob)
+
+    def remove(self, filename):
+        """Remove a photo record; returns True if a record was deleted"""
+        with self._transaction() as conn:
+            cursor = conn.execute('DELETE FROM photos WHERE filename = ?', (filename,))
+            if cursor.rowcount:
+                self._bump_version(conn)
+            return cursor.rowcount > 0
+
+    def get(self, filename):
+        """Return the record for a single photo, or None"""
+        row = self._connect().execute(
+            'SELECT * FROM photos WHERE filename = ?', (filename,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def iter_filenames(self):
+        """Yield every indexed filename, newest first"""
+        rows = self._connect().execute('SELECT filename FROM photos ORDER BY timestamp DESC')
+        for row in rows.fetchall():
+            yield row['filename']
+
+    def page(self, limit=50, cursor=None, mask=None):
+        """Return (records, next_cursor) ordered newest first.
+
+        Uses keyset pagination on (timestamp, filename) so each page costs
+        O(limit) regardless of how many photos are indexed.
+        """
+        clauses = []
+        params = []
+        if mask:
+            clauses.append('mask = ?')
+            params.append(mask)
+        if cursor:
+            timestamp, filename = self.decode_cursor(cursor)
+            clauses.append('(timestamp < ? OR (timestamp = ? AND filename < ?))')
+            params.extend([timestamp, timestamp, filename])
+
+        sql = 'SELECT * FROM photos'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY timestamp DESC, filename DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = [dict(row) for row in self._connect().execute(sql, params)]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = self.encode_cursor(last['timestamp'], last['filename'])
+        return rows, next_cursor
+
+    def etag(self, *parts):
+        """Build an ETag from the index version and the query parameters"""
+        key = json.dumps([self.version(), *parts])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def encode_cursor(timestamp, filename):
+        raw = json.dumps([timestamp, filename]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, filename = json.loads(base64.urlsafe_b64decode(padded))
+            return float(timestamp), str(filename)
+        except Exception as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    def sync_from_directory(self):
+        """Rebuild the index from the uploads directory (one-time migration)"""
+        records = []
+        if os.path.isdir(self.uploads_dir):
+            for entry in os.scandir(self.uploads_dir):
+                if not entry.is_file() or not entry.name.lower().endswith(PHOTO_EXTENSIONS):
+                    continue
+                if self.exclude and self.exclude(entry.name):
+                    continue
+                stat = entry.stat()
+                width, height = self.read_dimensions(entry.path)
+                records.append((entry.name, self._mask_from_filename(entry.name),
+                                stat.st_size, stat.st_mtime, width, height))
+
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM photos')
+            conn.executemany(
+                'INSERT OR REPLACE INTO photos (filename, mask, size, timestamp, width, height) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                records
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced', '1')")
+            self._bump_version(conn)
+        self.logger.info(f"Indexed {len(records)} photos from {self.uploads_dir}")
+        return len(records)
+
+    @staticmethod
+    def _mask_from_filename(filename):
+        """Recover the mask id from sith_photo_<date>_<time>_<mask>.jpg names"""
+        stem = os.path.splitext(filename)[0]
+        parts = stem.split('_', 4)
+        if len(parts) == 5 and parts[0] == 'sith' and parts[1] == 'photo':
+            return parts[4]
+        return 'none'
@@ -0,0 +1,259 @@
+"""
+Photo Store for Star Wars Photobooth
+Content-addressed blob storage for captured photos
+"""
+
+import abc
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+
+from services.upload_stream import StreamedUpload
+
+
+def content_key(sha256, ext='.jpg'):
+    """Blob key for content with the given SHA-256"""
+    return f"{sha256}{ext}"
+
+
+def content_type(key):
+    """MIME type of a blob, from its key's extension"""
+    return mimetypes.guess_type(key)[0] or 'image/jpeg'
+
+
+class PhotoStore(abc.ABC):
+    """Interface of a content-addressed photo store.
+
+    Blobs are keyed by the SHA-256 of their bytes (``<sha256>.jpg``), so
+    storing the same capture twice keeps one copy and a key never points
+    at different content. Which photo uses which blob is recorded by the
+    PhotoIndex; the store only holds bytes.
+    """
+
+    @abc.abstractmethod
+    def put_upload(self, upload, ext='.jpg'):
+        """Store a StreamedUpload (consuming its temp file); returns the key"""
+
+    @abc.abstractmethod
+    def put_bytes(self, data, ext='.jpg'):
+        """Store bytes; returns the key"""
+
+    @abc.abstractmethod
+    def open(self, key):
+        """Binary file object for a blob; raises FileNotFoundError if missing"""
+
+    def local_path(self, key):
+        """Filesystem path of a blob if the backend has one, else None"""
+        return None
+
+    @abc.abstractmethod
+    def exists(self, key):
+        """Whether a blob is stored"""
+
+    @abc.abstractmethod
+    def size(self, key):
+        """Size of a blob in bytes"""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Delete a blob; returns False if it did not exist"""
+
+    def temp_dir(self):
+        """Directory for streaming uploads before they are stored"""
+        return tempfile.gettempdir()
+
+
+class FilesystemPhotoStore(PhotoStore):
+    """Blobs under ``root/objects/ab/cd/<sha256>.jpg``.
+
+    Two levels of hash-prefix shards keep every directory small no matter
+    how many photos are stored. Writes go to a temp file in ``root/tmp``
+    and are renamed into place, so readers never see partial files.
+    """
+
+    def __init__(self, root):
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self._tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def temp_dir(self):
+        return self._tmp_dir
+
+    def local_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key[2:4], key)
+
+    def put_upload(self, upload, ext='.jpg'):
+        key = content_key(upload.sha256, ext)
+        path = self.local_path(key)
+        if os.path.exists(path):
+            upload.discard()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            upload.commit(path)
+        return key
+
+    def put_bytes(self, data, ext='.jpg'):
+        sha256 = hashlib.sha256(data).hexdigest()
+        key = content_key(sha256, ext)
+        if os.path.exists(self.local_path(key)):
+            return key
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return self.put_upload(StreamedUpload(tmp_path, len(data), sha256, data[:16]), ext)
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.local_path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class S3PhotoStore(PhotoStore):
+    """Blobs in an S3-compatible bucket (e.g. a local MinIO) under sharded keys.
+
+    Needs the optional ``boto3`` package, imported when the store is built.
+    """
+
+    def __init__(self, bucket, prefix='photos/', endpoint_url=None, client=None, tmp_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.bucket = bucket
+        self.prefix = prefix
+        self._tmp_dir = tmp_dir or tempfile.gettempdir()
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+
+    def temp_dir(self):
+        return self._tmp_dir
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def _is_missing(self, error):
+        response = getattr(error, 'response', None) or {}
+        return response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put_upload(self, upload, ext='.jpg'):
+        key = content_key(upload.sha256, ext)
+        try:
+            if not self.exists(key):
+                self.client.upload_file(upload.path, self.bucket, self._object_key(key),
+                                        ExtraArgs={'ContentType': content_type(key)})
+        finally:
+            upload.discard()
+        return key
+
+    def put_bytes(self, data, ext='.jpg'):
+        key = content_key(hashlib.sha256(data).hexdigest(), ext)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data,
+                                   ContentType=content_type(key))
+        return key
+
+    def open(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return io.BytesIO(response['Body'].read())
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))['ContentLength']
+
+    def delete(self, key):
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+
+def create_photo_store(config):
+    """Build the store selected by PHOTO_STORE_BACKEND"""
+    backend = (config.get('PHOTO_STORE_BACKEND') or 'filesystem').lower()
+    if backend == 's3':
+        return S3PhotoStore(
+            config['PHOTO_STORE_S3_BUCKET'],
+            prefix=config.get('PHOTO_STORE_S3_PREFIX', 'photos/'),
+            endpoint_url=config.get('PHOTO_STORE_S3_ENDPOINT')
+        )
+    if backend != 'filesystem':
+        raise ValueError(f"Unknown PHOTO_STORE_BACKEND: {backend}")
+    return FilesystemPhotoStore(config.get('PHOTO_STORE_ROOT') or config['UPLOAD_FOLDER'])
+
+
+def migrate_flat_photos(store, index, uploads_dir):
+    """Move photos saved flat in ``uploads_dir`` into the store.
+
+    Index records without a blob (files from before the store existed) are
+    copied in, linked to their blob and removed from the flat directory.
+    Safe to re-run; returns the number of photos migrated.
+    """
+    logger = logging.getLogger(__name__)
+    migrated = 0
+    for filename in index.iter_unstored():
+        path = os.path.join(uploads_dir, filename)
+        if not os.path.isfile(path):
+            logger.warning(f"Dropping index entry for missing photo {filename}")
+            index.remove(filename)
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        with index.blob_lock():
+            key = store.put_bytes(data, os.path.splitext(filename)[1].lower() or '.jpg')
+            index.set_blob(filename, key)
+        os.remove(path)
+        migrated += 1
+    if migrated:
+        logger.info(f"Migrated {migrated} photos from {uploads_dir} into the photo store")
+    return migrated
+
+
+def delete_photo(store, index, filename):
+    """Remove a photo's record, and its blobs once no other photo shares them.
+
+    Returns the deleted record, or None if the photo is unknown. Runs under
+    the index's blob lock, so a concurrent capture of identical bytes either
+    adds its reference first (and the blob is kept) or stores the blob again.
+    """
+    with index.blob_lock():
+        record = index.get(filename)
+        if record is None:
+            return None
+        index.remove(filename)
+        for blob in (record['blob'], record.get('video_blob')):
+            if blob and index.blob_references(blob) == 0:
+                store.delete(blob)
+    return record
@@ -0,0 +1,231 @@
+"""
+Preview Service for Star Wars Photobooth
+Live mask previews: clients push frames, results stream back as MJPEG
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from services.job_queue import QueueFull
+from services.metrics import record_stage
+
+BOUNDARY = 'preview-frame'
+
+
+def _rate(timestamps, now, window=2.0):
+    """Events per second over the last ``window`` seconds"""
+    recent = [t for t in timestamps if now - t <= window]
+    return round(len(recent) / window, 2)
+
+
+class PreviewSession:
+    """One client's preview channel.
+
+    Holds at most one pending frame: a frame pushed while another is
+    still waiting replaces it (latest frame wins) and counts as dropped,
+    so a slow server skips frames instead of falling further behind.
+    """
+
+    def __init__(self, session_id, mask_id=None, face_data=None):
+        self.id = session_id
+        self.mask_id = mask_id
+        self.face_data = face_data
+        self.created = time.time()
+        self.last_seen = self.created
+        self.closed = False
+        self.streaming = False
+        self._pending = None  # (seq, frame_bytes, mask_id, face_data, received)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._received_at = deque(maxlen=64)
+        self._rendered_at = deque(maxlen=64)
+        self.last_latency = None
+        self.counters = {'received': 0, 'rendered': 0, 'dropped': 0, 'stale': 0, 'failed': 0}
+
+    def push(self, frame_bytes, mask_id=None, face_data=None):
+        """Make a frame the pending one; returns (seq, replaced_a_pending_frame)"""
+        now = time.monotonic()
+        with self._cond:
+            if mask_id:
+                self.mask_id = mask_id
+            if face_data is not None:
+                self.face_data = face_data
+            self._seq += 1
+            dropped = self._pending is not None
+            if dropped:
+                self.counters['dropped'] += 1
+            self._pending = (self._seq, frame_bytes, self.mask_id, self.face_data, now)
+            self.counters['received'] += 1
+            self._received_at.append(now)
+            self.last_seen = time.time()
+            self._cond.notify_all()
+            return self._seq, dropped
+
+    def take(self, timeout):
+        """Wait up to ``timeout`` for the pending frame and claim it"""
+        with self._cond:
+            if self._pending is None and not self.closed:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, None
+            return pending
+
+    def rendered(self, latency):
+        with self._cond:
+            self.counters['rendered'] += 1
+            self._rendered_at.append(time.monotonic())
+            self.last_latency = latency
+
+    def count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._pending = None
+            self._cond.notify_all()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update({
+                'session_id': self.id,
+                'mask_id': self.mask_id,
+                'streaming': self.streaming,
+                'closed': self.closed,
+                'input_fps': _rate(self._received_at, now),
+                'output_fps': _rate(self._rendered_at, now),
+                'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+                'pending': self._pending is not None
+            })
+        return stats
+
+
+class PreviewService:
+    """Preview sessions and the multipart stream that renders them.
+
+    ``render(frame_bytes, mask_id, face_data)`` returns JPEG bytes (or
+    None). Each open stream renders on its own request thread, one frame
+    at a time, skipping frames older than ``max_frame_age`` seconds and
+    rendering at most ``max_fps`` per second, so per-session latency stays
+    bounded whatever the push rate. Sessions live in this process: under
+    gunicorn, pushes and the stream must reach the same worker (one
+    worker with threads, or sticky routing).
+    """
+
+    def __init__(self, render, max_sessions=16, idle_timeout=30, max_frame_age=1.0, max_fps=15):
+        self.logger = logging.getLogger(__name__)
+        self.render = render
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_frame_age = max_frame_age
+        self.max_fps = max_fps
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.totals = {'sessions': 0, 'received': 0, 'rendered': 0, 'dropped': 0, 'stale': 0, 'failed': 0}
+
+    def create_session(self, mask_id=None, face_data=None):
+        """New session; raises QueueFull when all slots are taken"""
+        self.prune()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise QueueFull(f"At most {self.max_sessions} preview sessions")
+            session = PreviewSession(uuid.uuid4().hex, mask_id, face_data)
+            self._sessions[session.id] = session
+            self.totals['sessions'] += 1
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        session.close()
+        self._fold(session)
+        return session
+
+    def _fold(self, session):
+        """Add a finished session's counters to the service totals"""
+        with self._lock:
+            for name in ('received', 'rendered', 'dropped', 'stale', 'failed'):
+                self.totals[name] += session.counters[name]
+
+    def prune(self):
+        """Close sessions with no pushes for ``idle_timeout`` and no open stream"""
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            idle = [s.id for s in self._sessions.values() if s.last_seen < cutoff and not s.streaming]
+        for session_id in idle:
+            self.close(session_id)
+        return len(idle)
+
+    def stream(self, session):
+        """Generator of multipart/x-mixed-replace parts for a session.
+
+        Ends when the session is closed, goes ``idle_timeout`` seconds
+        without a frame, or the client disconnects.
+        """
+        session.streaming = True
+        min_interval = 1.0 / self.max_fps if self.max_fps else 0.0
+        last_render = 0.0
+        try:
+            while not session.closed:
+                # Throttle before claiming, so a frame pushed meanwhile still wins
+                wait = last_render + min_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                pending = session.take(timeout=1.0)
+                if pending is None:
+                    if time.time() - session.last_seen > self.idle_timeout:
+                        break
+                    continue
+                seq, frame_bytes, mask_id, face_data, received = pending
+                if time.monotonic() - received > self.max_frame_age:
+                    session.count('stale')
+                    continue
+                last_render = time.monotonic()
+                try:
+                    output = self.render(frame_bytes, mask_id, face_data)
+                except Exception as e:
+                    self.logger.warning(f"Preview render failed for session {session.id}: {e}")
+                    output = None
+                if not output:
+                    session.count('failed')
+                    continue
+                latency = time.monotonic() - received
+                session.rendered(latency)
+                record_stage('preview.frame', latency)
+                yield self._part(output, seq, latency)
+        finally:
+            session.streaming = False
+
+    @staticmethod
+    def _part(jpeg_bytes, seq, latency):
+        header = (
+            f"--{BOUNDARY}\r\n"
+            f"Content-Type: image/jpeg\r\n"
+            f"Content-Length: {len(jpeg_bytes)}\r\n"
+            f"X-Frame-Seq: {seq}\r\n"
+            f"X-Latency-Ms: {latency * 1000:.1f}\r\n\r\n"
+        ).encode('ascii')
+        return header + jpeg_bytes + b"\r\n"
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            stats = dict(self.totals)
+        for session in sessions:
+            for name in ('received', 'rendered', 'dropped', 'stale', 'failed'):
+                stats[name] += session.counters[name]
+        stats['active'] = len(sessions)
+        stats['streaming'] = sum(1 for session in sessions if session.streaming)
+        stats['capacity'] = self.max_sessions
+        return stats
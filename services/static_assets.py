@@ -0,0 +1,225 @@
+"""
+Static Assets for Star Wars Photobooth
+Content-hashed asset manifest with precompressed variants
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always produced
+    brotli = None
+
+# Text assets worth precompressing; audio and images are already compressed
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.json', '.svg', '.html', '.txt', '.map')
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+MANIFEST_NAME = 'asset-manifest.json'
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StaticAssets:
+    """Fingerprinted URLs for files under ``static/``.
+
+    Every file gets a name with a content hash (``js/main.3f2a9c01b7de.js``)
+    so it can be cached forever; changing the file changes its URL. The
+    manifest records size and mtime, so a restart only rehashes files that
+    changed. Compressing text assets to gzip (and, if the ``brotli``
+    package is installed, brotli) copies in ``build_dir`` is slow, so it
+    is a deploy step (``flask build-assets``, i.e. ``build(precompress=True)``);
+    at runtime only hashing happens unless ``precompress`` is set.
+    """
+
+    def __init__(self, static_dir, build_dir, exclude_dirs=('models',), hash_length=12, auto_reload=False,
+                 precompress=False):
+        self.logger = logging.getLogger(__name__)
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self.exclude_dirs = tuple(exclude_dirs)
+        self.hash_length = hash_length
+        self.auto_reload = auto_reload
+        self.precompress = precompress
+        self.encodings = tuple(e for e in ENCODING_SUFFIXES if e != 'br' or brotli is not None)
+        self._entries = {}
+        self._by_fingerprint = {}
+        self._lock = threading.Lock()
+        self.build()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.build_dir, MANIFEST_NAME)
+
+    def _walk(self):
+        for root, dirs, files in os.walk(self.static_dir):
+            if root == self.static_dir:
+                dirs[:] = [d for d in dirs if d not in self.exclude_dirs]
+            for name in files:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, self.static_dir).replace(os.sep, '/'), path
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('assets', {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable asset manifest: {e}")
+            return {}
+
+    def _fingerprint(self, relpath, digest):
+        stem, ext = os.path.splitext(relpath)
+        return f"{stem}.{digest[:self.hash_length]}{ext}"
+
+    def _build_entry(self, relpath, path, stat, previous=None, precompress=False):
+        if previous and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+            entry = dict(previous)
+            # Compressed copies from the last build may be gone (fresh build_dir)
+            entry['encodings'] = [e for e in previous.get('encodings', ())
+                                  if e in self.encodings and os.path.exists(self.encoded_path(entry, e))]
+        else:
+            digest = _file_sha256(path)
+            entry = {
+                'hash': digest,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'fingerprinted': self._fingerprint(relpath, digest),
+                'encodings': []
+            }
+        if precompress and os.path.splitext(relpath)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            entry['encodings'] = self._precompress(path, entry)
+        return entry
+
+    def _precompress(self, path, entry):
+        """Write missing compressed copies; keep only those that actually save space.
+
+        A copy that cannot be written (read-only build_dir) is skipped; the
+        asset is then served uncompressed but keeps its fingerprint.
+        """
+        available = []
+        data = None
+        for encoding in self.encodings:
+            target = self.encoded_path(entry, encoding)
+            if not os.path.exists(target):
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) >= entry['size'] * 0.9:
+                    continue
+                try:
+                    _write_atomic(target, compressed)
+                except OSError as e:
+                    self.logger.warning(f"Could not write {encoding} copy of {entry['fingerprinted']}: {e}")
+                    continue
+            available.append(encoding)
+        return available
+
+    def build(self, precompress=None):
+        """Hash new or changed files and save the manifest.
+
+        Text assets are also precompressed if ``precompress`` (default: the
+        instance setting) is true.
+        """
+        if precompress is None:
+            precompress = self.precompress
+        previous = self._load_manifest()
+        entries = {}
+        for relpath, path in self._walk():
+            try:
+                entries[relpath] = self._build_entry(relpath, path, os.stat(path), previous.get(relpath), precompress)
+            except OSError as e:
+                self.logger.warning(f"Skipping static asset {relpath}: {e}")
+
+        with self._lock:
+            self._entries = entries
+            self._by_fingerprint = {entry['fingerprinted']: relpath for relpath, entry in entries.items()}
+
+        if entries != previous:
+            try:
+                _write_atomic(self.manifest_path, json.dumps({'assets': entries}, indent=1).encode('utf-8'))
+            except OSError as e:
+                # Read-only deployments still work; the manifest is just rebuilt next start
+                self.logger.warning(f"Could not write asset manifest: {e}")
+        return len(entries)
+
+    def _refresh(self, relpath):
+        """Re-stat one asset (auto_reload, i.e. debug mode) and rebuild it if edited"""
+        path = os.path.join(self.static_dir, relpath)
+        entry = self._entries.get(relpath)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return entry
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry
+        entry = self._build_entry(relpath, path, stat, precompress=self.precompress)
+        with self._lock:
+            self._entries[relpath] = entry
+            self._by_fingerprint[entry['fingerprinted']] = relpath
+        return entry
+
+    def entry(self, relpath):
+        if self.auto_reload:
+            return self._refresh(relpath)
+        return self._entries.get(relpath)
+
+    def url(self, relpath, prefix='/assets/'):
+        """Fingerprinted URL for a path relative to static/, or None if unknown"""
+        entry = self.entry(relpath.lstrip('/'))
+        return prefix + entry['fingerprinted'] if entry else None
+
+    def urls(self, directory, prefix='/assets/'):
+        """``{relpath: url}`` for every asset under ``directory`` (e.g. ``audio/``)"""
+        with self._lock:
+            return {relpath: prefix + entry['fingerprinted']
+                    for relpath, entry in self._entries.items() if relpath.startswith(directory)}
+
+    def resolve(self, fingerprinted):
+        """``(relpath, entry)`` for a fingerprinted name, or None"""
+        relpath = self._by_fingerprint.get(fingerprinted)
+        if relpath is None:
+            return None
+        return relpath, self._entries[relpath]
+
+    def source_path(self, relpath):
+        return os.path.join(self.static_dir, relpath)
+
+    def encoded_path(self, entry, encoding):
+        return os.path.join(self.build_dir, entry['fingerprinted'] + ENCODING_SUFFIXES[encoding])
+
+    @staticmethod
+    def choose_encoding(entry, accepted):
+        """Best precompressed encoding the client accepts (brotli before gzip)"""
+        for encoding in ('br', 'gzip'):
+            if encoding in entry.get('encodings', ()) and encoding in accepted:
+                return encoding
+        return None
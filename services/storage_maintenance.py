@@ -0,0 +1,209 @@
+"""
+Storage Maintenance for Star Wars Photobooth
+Background recompression of originals and disk-budget retention
+"""
+
+import logging
+import os
+import threading
+import time
+
+from PIL import Image
+
+from services.photo_store import delete_photo
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every worker may run slices
+    fcntl = None
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+
+class StorageMaintenance:
+    """Keeps the photo store small without getting in the way of captures.
+
+    Work happens in slices of at most ``slice_seconds``: each slice first
+    evicts photos while usage is over ``budget_bytes`` (oldest capture or
+    least recently accessed first), then recompresses not-yet-optimized
+    originals with ``CameraService.optimize_image``, keeping the result only
+    if it saves at least ``min_savings`` of the size. The background thread
+    skips a slice whenever ``is_busy()`` reports live traffic, and a lock
+    file makes sure only one worker process runs maintenance at a time.
+    """
+
+    def __init__(self, photo_store, photo_index, derivative_service, camera_service,
+                 budget_bytes=None, eviction_order='age', quality=82, format='JPEG',
+                 min_savings=0.1, slice_seconds=0.2, interval=5.0, is_busy=None, lock_path=None):
+        self.logger = logging.getLogger(__name__)
+        self.photo_store = photo_store
+        self.photo_index = photo_index
+        self.derivative_service = derivative_service
+        self.camera_service = camera_service
+        self.budget_bytes = budget_bytes
+        self.eviction_order = eviction_order
+        self.quality = quality
+        self.format = format.upper()
+        self.min_savings = min_savings
+        self.slice_seconds = slice_seconds
+        self.interval = interval
+        self.is_busy = is_busy or (lambda: False)
+        self.lock_path = lock_path
+        self.counters = {
+            'slices': 0,
+            'skipped_busy': 0,
+            'recompressed': 0,
+            'recompress_skipped': 0,
+            'recompress_failed': 0,
+            'recompress_bytes_reclaimed': 0,
+            'evicted': 0,
+            'eviction_bytes_reclaimed': 0,
+            'last_slice_ms': 0.0,
+        }
+        self._counters_lock = threading.Lock()
+        self._slice_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _count(self, **increments):
+        with self._counters_lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    def start(self):
+        """Start the background thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='storage-maintenance', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.is_busy():
+                self._count(skipped_busy=1)
+                continue
+            try:
+                self.run_slice()
+            except Exception as e:
+                self.logger.error(f"Storage maintenance slice failed: {e}")
+
+    def _acquire_process_lock(self):
+        if fcntl is None or not self.lock_path:
+            return True, None
+        handle = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True, handle
+        except OSError:
+            handle.close()
+            return False, None
+
+    def run_slice(self, seconds=None):
+        """Do up to ``seconds`` of work; returns True if work remains"""
+        deadline = time.perf_counter() + (seconds if seconds is not None else self.slice_seconds)
+        started = time.perf_counter()
+        if not self._slice_lock.acquire(blocking=False):
+            return True
+        acquired, handle = self._acquire_process_lock()
+        try:
+            if not acquired:
+                return True
+            remaining = self._evict_over_budget(deadline)
+            remaining = self._recompress(deadline) or remaining
+        finally:
+            if handle is not None:
+                handle.close()
+            self._slice_lock.release()
+        with self._counters_lock:
+            self.counters['slices'] += 1
+            self.counters['last_slice_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return remaining
+
+    def run_until_idle(self, max_seconds=None):
+        """Run slices back to back until nothing is left (CLI use)"""
+        started = time.perf_counter()
+        while self.run_slice():
+            if max_seconds is not None and time.perf_counter() - started > max_seconds:
+                return False
+        return True
+
+    def _evict_over_budget(self, deadline):
+        if not self.budget_bytes:
+            return False
+        usage = self.photo_index.storage_stats()['bytes']
+        while usage > self.budget_bytes:
+            if time.perf_counter() >= deadline:
+                return True
+            candidates = self.photo_index.eviction_candidates(self.eviction_order, limit=20)
+            if not candidates:
+                return False
+            for record in candidates:
+                if usage <= self.budget_bytes or time.perf_counter() >= deadline:
+                    break
+                shared = record['blob'] and self.photo_index.blob_references(record['blob']) > 1
+                delete_photo(self.photo_store, self.photo_index, record['filename'])
+                self.derivative_service.remove(record['filename'])
+                freed = 0 if shared else record['size']
+                usage -= freed
+                self._count(evicted=1, eviction_bytes_reclaimed=freed)
+                self.logger.info(f"Evicted {record['filename']} to stay under the storage budget")
+        return False
+
+    def _recompress(self, deadline):
+        while time.perf_counter() < deadline:
+            records = self.photo_index.unoptimized(limit=5)
+            if not records:
+                return False
+            for record in records:
+                if time.perf_counter() >= deadline:
+                    return True
+                self.recompress(record)
+        return True
+
+    def recompress(self, record):
+        """Re-encode one original; returns the bytes saved (0 if it was kept)"""
+        blob = record['blob']
+        try:
+            with self.photo_store.open(blob) as source, Image.open(source) as image:
+                data = self.camera_service.optimize_image(
+                    image, max_width=image.width, max_height=image.height,
+                    quality=self.quality, format=self.format, progressive=True
+                )
+        except Exception as e:
+            self.logger.warning(f"Could not recompress {record['filename']}: {e}")
+            data = None
+
+        if data is None:
+            self.photo_index.mark_optimized(blob)
+            self._count(recompress_failed=1)
+            return 0
+
+        old_size = record['size'] or self.photo_store.size(blob)
+        if len(data) > old_size * (1 - self.min_savings):
+            self.photo_index.mark_optimized(blob)
+            self._count(recompress_skipped=1)
+            return 0
+
+        # Under the blob lock, like delete_photo: a capture of the old bytes
+        # racing this must not lose its blob
+        with self.photo_index.blob_lock():
+            new_blob = self.photo_store.put_bytes(data, FORMAT_EXTENSIONS[self.format])
+            self.photo_index.replace_blob(blob, new_blob, len(data))
+            if new_blob != blob and self.photo_index.blob_references(blob) == 0:
+                self.photo_store.delete(blob)
+        saved = old_size - len(data)
+        self._count(recompressed=1, recompress_bytes_reclaimed=saved)
+        return saved
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats.update(self.photo_index.storage_stats())
+        stats['budget_bytes'] = self.budget_bytes
+        stats['eviction_order'] = self.eviction_order
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        return stats
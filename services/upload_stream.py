@@ -0,0 +1,66 @@
+"""
+Upload streaming helpers for Star Wars Photobooth
+Copies request bodies to disk in fixed-size chunks
+"""
+
+import hashlib
+import os
+import tempfile
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when a streamed upload exceeds its size limit"""
+
+
+class StreamedUpload:
+    """A request body that has been written to a temporary file"""
+
+    def __init__(self, path, size, sha256, head):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.head = head  # first bytes of the body, for magic-number checks
+
+    def commit(self, dest_path):
+        """Atomically move the temporary file into place"""
+        os.replace(self.path, dest_path)
+        self.path = dest_path
+        return dest_path
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream_to_tempfile(stream, directory, max_bytes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy ``stream`` into a temp file in ``directory`` chunk by chunk.
+
+    The size limit is checked after every chunk so an oversized body is
+    rejected without buffering it, and a SHA-256 of the content is computed
+    on the way through. The temp file lives in the destination directory so
+    that ``StreamedUpload.commit`` is a same-filesystem rename.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return StreamedUpload(tmp_path, size, digest.hexdigest(), head)
@@ -13,14 +13,15 @@ class AudioManager {
         this.volume = 0.5;
         this.backgroundVolume = 0.3;
         
-        // Audio file paths
+        // Audio file paths (fingerprinted URLs from the page when available)
+        const assetUrl = (path) => (window.STATIC_ASSETS && window.STATIC_ASSETS[path]) || `/static/${path}`;
         this.audioFiles = {
-            'imperial-march': '/static/audio/imperial-march.mp3',
-            'lightsaber-on': '/static/audio/lightsaber-on.mp3',
-            'vader-breathing': '/static/audio/vader-breathing.mp3',
-            'tie-fighter': '/static/audio/tie-fighter.mp3',
-            'force-push': '/static/audio/force-push.mp3',
-            'capture-sound': '/static/audio/camera-shutter.mp3'
+            'imperial-march': assetUrl('audio/imperial-march.mp3'),
+            'lightsaber-on': assetUrl('audio/lightsaber-on.mp3'),
+            'vader-breathing': assetUrl('audio/vader-breathing.mp3'),
+            'tie-fighter': assetUrl('audio/tie-fighter.mp3'),
+            'force-push': assetUrl('audio/force-push.mp3'),
+            'capture-sound': assetUrl('audio/camera-shutter.mp3')
         };
         
         this.initializeAudio();
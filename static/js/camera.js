@@ -298,6 +298,32 @@ class CameraManager {
         }
     }
     
+    capturePhotoBlob() {
+        // Binary capture: avoids the base64 data URL entirely
+        if (!this.outputCanvas || !this.isInitialized) {
+            console.error('Camera not ready for capture');
+            return Promise.resolve(null);
+        }
+        
+        if (typeof this.outputCanvas.toBlob !== 'function') {
+            return Promise.resolve(null);
+        }
+        
+        return new Promise((resolve) => {
+            try {
+                this.outputCanvas.toBlob((blob) => {
+                    if (blob && window.audioManager) {
+                        window.audioManager.playSound('camera-shutter');
+                    }
+                    resolve(blob);
+                }, 'image/jpeg', 0.9);
+            } catch (error) {
+                console.error('Error capturing photo:', error);
+                resolve(null);
+            }
+        });
+    }
+    
     // Handle window resize for responsive canvas
     handleResize() {
         if (this.video && this.video.videoWidth > 0) {
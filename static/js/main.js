@@ -222,8 +222,14 @@ class PhotoboothApp {
                 }
             }
             
-            // Capture image with mask overlay
-            const imageData = window.cameraManager.capturePhoto();
+            // Capture image with mask overlay (binary blob, data URL fallback)
+            let imageData = null;
+            if (typeof window.cameraManager.capturePhotoBlob === 'function') {
+                imageData = await window.cameraManager.capturePhotoBlob();
+            }
+            if (!imageData) {
+                imageData = window.cameraManager.capturePhoto();
+            }
             if (!imageData) {
                 throw new Error('Failed to capture image');
             }
@@ -246,16 +252,29 @@ class PhotoboothApp {
     
     async savePhoto(imageData, mask) {
         try {
-            const response = await fetch('/api/capture-photo', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    image: imageData,
-                    mask: mask ? mask.id : 'none'
-                })
-            });
+            const maskId = mask ? mask.id : 'none';
+            let response;
+            if (imageData instanceof Blob) {
+                // Raw JPEG body, streamed to disk by the server
+                response = await fetch(`/api/capture-photo/stream?mask=${encodeURIComponent(maskId)}`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'image/jpeg'
+                    },
+                    body: imageData
+                });
+            } else {
+                response = await fetch('/api/capture-photo', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        image: imageData,
+                        mask: maskId
+                    })
+                });
+            }
             
             if (!response.ok) {
                 throw new Error('Failed to save photo');
@@ -277,13 +296,8 @@ class PhotoboothApp {
     
     async showGallery() {
         try {
-            const response = await fetch('/api/gallery');
-            if (!response.ok) {
-                throw new Error('Failed to load gallery');
-            }
-            
-            const photos = await response.json();
-            this.renderGallery(photos);
+            const page = await this.fetchGalleryPage();
+            this.renderGallery(page.photos, page.next_cursor);
             
         } catch (error) {
             console.error('Gallery error:', error);
@@ -291,7 +305,28 @@ class PhotoboothApp {
         }
     }
     
-    renderGallery(photos) {
+    async fetchGalleryPage(cursor = null) {
+        // The server answers unchanged pages with 304 (ETag), which the
+        // browser transparently resolves from its HTTP cache
+        const url = cursor ? `/api/gallery?cursor=${encodeURIComponent(cursor)}` : '/api/gallery';
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error('Failed to load gallery');
+        }
+        return response.json();
+    }
+    
+    async loadMorePhotos(cursor) {
+        try {
+            const page = await this.fetchGalleryPage(cursor);
+            this.appendGalleryItems(page.photos, page.next_cursor);
+        } catch (error) {
+            console.error('Gallery error:', error);
+            this.showErrorMessage('Failed to load more photos');
+        }
+    }
+    
+    renderGallery(photos, nextCursor = null) {
         const galleryGrid = document.getElementById('gallery-grid');
         const galleryModal = document.getElementById('gallery-modal');
         
@@ -302,22 +337,48 @@ class PhotoboothApp {
         if (photos.length === 0) {
             galleryGrid.innerHTML = '<p class="empty-gallery">No photos yet. Start capturing with masks!</p>';
         } else {
-            photos.forEach(photo => {
-                const photoElement = this.createGalleryItem(photo);
-                galleryGrid.appendChild(photoElement);
-            });
+            this.appendGalleryItems(photos, nextCursor);
         }
         
         galleryModal.classList.add('open');
     }
     
+    appendGalleryItems(photos, nextCursor) {
+        const galleryGrid = document.getElementById('gallery-grid');
+        if (!galleryGrid) return;
+        
+        const existingButton = galleryGrid.querySelector('.gallery-load-more');
+        if (existingButton) {
+            existingButton.remove();
+        }
+        
+        photos.forEach(photo => {
+            const photoElement = this.createGalleryItem(photo);
+            galleryGrid.appendChild(photoElement);
+        });
+        
+        if (nextCursor) {
+            const loadMore = document.createElement('button');
+            loadMore.className = 'btn btn--small gallery-load-more';
+            loadMore.textContent = 'Load more';
+            loadMore.addEventListener('click', () => this.loadMorePhotos(nextCursor));
+            galleryGrid.appendChild(loadMore);
+        }
+    }
+    
     createGalleryItem(photo) {
         const item = document.createElement('div');
         item.className = 'gallery-item';
         
+        // Tiles use the small thumbnail variant; downloads still fetch the original.
+        // Thumbnails of bursts are stills, so animations show the (small) original.
+        const thumbUrl = photo.kind === 'animation'
+            ? photo.url
+            : (photo.variants && photo.variants.thumb) || photo.url;
+        
         // Set src directly so images appear immediately when gallery opens
         item.innerHTML = `
-            <img src="${photo.url}" alt="Sith Photo with Mask" loading="lazy">
+            <img src="${thumbUrl}" alt="Sith Photo with Mask" loading="lazy">
             <div class="gallery-overlay">
                 <div class="gallery-actions">
                     <button class="btn btn--small" onclick="downloadPhoto('${photo.filename}')">
@@ -65,7 +65,8 @@ class MaskManager {
     
     async loadMasks() {
         try {
-            const response = await fetch('/api/masks');
+            // The listing carries an ETag, so revalidation is usually a 304
+            const response = await fetch('/api/masks', { cache: 'no-cache' });
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
             }
@@ -73,7 +74,18 @@ class MaskManager {
             this.masks = await response.json();
             console.log(`Loaded ${this.masks.length} masks`);
             
-            await this.preloadMaskImages();
+            // Server-computed placement hints replace the built-in table
+            this.masks.forEach(mask => {
+                if (mask.placement && mask.placement.scale) {
+                    this.maskScaleFactors[mask.id] = mask.placement.scale;
+                }
+            });
+            
+            // With thumbnails in the listing, full mask images are fetched
+            // only when a mask is selected
+            if (!this.masks.every(mask => !mask.image || mask.thumbnail)) {
+                await this.preloadMaskImages();
+            }
             
         } catch (error) {
             console.error('Error loading masks:', error);
@@ -219,7 +231,11 @@ class MaskManager {
         card.setAttribute('data-mask-id', mask.id);
         
         let previewHtml = '';
-        if (mask.image && this.maskImages.has(mask.id)) {
+        if (mask.thumbnail) {
+            previewHtml = `<div class="mask-preview">
+                <img src="${mask.thumbnail}" alt="${mask.name}" class="mask-preview-img" width="64" height="64">
+            </div>`;
+        } else if (mask.image && this.maskImages.has(mask.id)) {
             previewHtml = `<div class="mask-preview">
                 <img src="${mask.image}" alt="${mask.name}" class="mask-preview-img">
             </div>`;
@@ -254,6 +270,9 @@ class MaskManager {
         
         // Set active mask
         this.activeMask = mask.id === 'none' ? null : mask;
+        if (mask.image && !this.maskImages.has(mask.id)) {
+            this.loadMaskImage(mask);
+        }
         
         // Reset manual offsets when changing masks
     // Load per-mask adjustments if available
@@ -863,13 +882,60 @@ class MaskManager {
         this.updateAdjustmentControls(id);
     }
 
+    // SHA-256 of a file as hex, so the server can skip models it already has
+    async hashFile(file) {
+        if (!window.crypto || !window.crypto.subtle) return null;
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // Resumable upload: send the file in chunks and, after a failed chunk,
+    // ask the server how much it has and continue from there
+    async uploadModelResumable(file) {
+        const sha256 = await this.hashFile(file);
+        let res = await fetch('/api/upload-model/sessions', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, sha256 })
+        });
+        let json = await res.json();
+        if (!res.ok) return { res, json };
+
+        const chunkSize = json.chunk_size || 4 * 1024 * 1024;
+        let offset = json.offset;
+        let failures = 0;
+        while (!json.complete) {
+            const end = Math.min(offset + chunkSize, file.size);
+            try {
+                res = await fetch(json.upload_url, {
+                    method: 'PUT',
+                    headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+                    body: file.slice(offset, end)
+                });
+                const body = await res.json();
+                if (res.status === 409) {
+                    offset = body.offset;
+                    continue;
+                }
+                if (!res.ok) return { res, json: body };
+                json = body;
+                offset = body.offset;
+                failures = 0;
+            } catch (err) {
+                // Network drop: back off, then resume from the server's offset
+                if (++failures > 5) throw err;
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                const status = await fetch(json.upload_url).then(r => r.json()).catch(() => null);
+                if (status && typeof status.offset === 'number') offset = status.offset;
+            }
+        }
+        return { res, json };
+    }
+
     // Upload a model file to the backend endpoint which saves it into static/models
     async uploadModel(file) {
         try {
-            const fd = new FormData();
-            fd.append('model', file, file.name);
-            const res = await fetch('/api/upload-model', { method: 'POST', body: fd });
-            const json = await res.json();
+            const { res, json } = await this.uploadModelResumable(file);
             if (res.ok && json.success) {
                 window.showNotification && window.showNotification('Model uploaded successfully', 'success');
                 // Optionally re-check and inform user
@@ -918,14 +984,19 @@ class MaskManager {
         // Otherwise, apply heuristics based on mask type and face size
         if (!face) return;
         const faceHeight = face.height || (face.normalizedHeight ? face.normalizedHeight * (document.querySelector('canvas')?.height || 480) : 100);
-        // Default mapping: helmets sit higher, require slightly larger scale
-        switch (maskId) {
+        // Default mapping: helmets sit higher, require slightly larger scale.
+        // The mask kind comes from /api/masks when the server provides it.
+        const mask = this.masks.find(m => m.id === maskId);
+        const kind = mask && mask.placement ? mask.placement.kind : null;
+        switch (kind || maskId) {
+            case 'helmet':
             case 'vader-mask':
             case 'storm-trooper':
             case 'kylo-ren':
                 this.baseMaskScale = 1.15 + Math.min(0.4, faceHeight / 300);
                 this.manualOffsetY = -Math.max(10, faceHeight * 0.08);
                 break;
+            case 'face':
             case 'sith-lord':
             case 'jedi':
                 this.baseMaskScale = 1.05 + Math.min(0.3, faceHeight / 400);
@@ -0,0 +1,57 @@
+"""Shared fixtures: the Flask app pointed at scratch directories"""
+
+import io
+import types
+
+import pytest
+from PIL import Image
+
+
+def _lazy_accessors(module):
+    """Every @lazy_service accessor defined in a module"""
+    return [value for value in vars(module).values()
+            if isinstance(value, types.FunctionType) and hasattr(value, 'peek') and hasattr(value, 'reset')]
+
+
+@pytest.fixture
+def flask_app(tmp_path, monkeypatch):
+    """The app with every service rebuilt against ``tmp_path``"""
+    import app as app_module
+    uploads = tmp_path / 'uploads'
+    overrides = {
+        'TESTING': True,
+        'UPLOAD_FOLDER': str(uploads),
+        'PHOTO_STORE_ROOT': str(uploads),
+        'PHOTO_INDEX_PATH': str(uploads / 'photo_index.sqlite3'),
+        'DERIVATIVE_DIR': str(uploads / 'derivatives'),
+        'BURST_DIR': str(uploads / 'bursts'),
+        'FRAME_CACHE_DIR': str(tmp_path / 'frames'),
+        'GEMINI_CACHE_DIR': str(tmp_path / 'gemini'),
+        'STATIC_BUILD_DIR': str(tmp_path / 'assets'),
+        'IMAGE_WORKERS': 0,
+        'ENABLE_STORAGE_MAINTENANCE': False,
+        'GEMINI_USE_STUB': True,
+        'GEMINI_STUB_LATENCY': 0.0,
+        'GEMINI_STUB_ERROR': None,
+    }
+    for key, value in overrides.items():
+        monkeypatch.setitem(app_module.app.config, key, value)
+    accessors = _lazy_accessors(app_module)
+    for accessor in accessors:
+        accessor.reset()
+    yield app_module.app
+    for accessor in accessors:
+        accessor.reset()
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def jpeg():
+    """A small JPEG frame"""
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (120, 90, 60)).save(output, format='JPEG')
+    return output.getvalue()
@@ -0,0 +1,142 @@
+"""Tests for /api/apply-mask: request parsing, response modes and AI degradation"""
+
+import io
+import time
+
+from PIL import Image
+
+
+def test_malformed_json_is_a_400(client):
+    response = client.post('/api/apply-mask', data='{not json', content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_json_that_is_not_an_object_is_a_400(client):
+    response = client.post('/api/apply-mask', json=['vader-mask'])
+    assert response.status_code == 400
+
+
+def test_unsupported_body_type_is_a_415(client):
+    response = client.post('/api/apply-mask', data='mask_id=vader-mask', content_type='text/plain')
+    assert response.status_code == 415
+    assert 'error' in response.get_json()
+
+
+def test_missing_image_is_a_400(client):
+    response = client.post('/api/apply-mask', json={'mask_id': 'vader-mask'})
+    assert response.status_code == 400
+
+
+def test_unchanged_binary_result_is_an_untyped_204(client, jpeg):
+    response = client.post('/api/apply-mask?mask_id=none&response=binary', data=jpeg, content_type='image/jpeg')
+    assert response.status_code == 204
+    assert 'Content-Type' not in response.headers
+    assert response.headers['X-Frame-Id'] and response.headers['X-Image-Changed'] == '0'
+
+
+def test_composited_binary_result_is_a_jpeg(client, jpeg):
+    response = client.post('/api/apply-mask?mask_id=vader-mask&response=binary', data=jpeg,
+                           content_type='image/jpeg')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg' and response.data.startswith(b'\xff\xd8')
+    assert response.headers['X-Image-Changed'] == '1'
+
+
+def test_handle_mode_returns_ids_without_image_data(client, jpeg):
+    response = client.post('/api/apply-mask?mask_id=vader-mask&response=handle', data=jpeg,
+                           content_type='image/jpeg')
+    result = response.get_json()
+    assert response.status_code == 200
+    assert result['frame_id'] and result['result_id'] and 'processed_image' not in result
+    assert client.get(result['result_url']).mimetype == 'image/jpeg'
+
+
+def test_malformed_face_data_is_a_400(client, jpeg):
+    response = client.post('/api/apply-mask?mask_id=vader-mask&face_data={oops', data=jpeg,
+                           content_type='image/jpeg')
+    assert response.status_code == 400
+
+
+def _frame(shade):
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (shade, 40, 40)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def _apply(client, shade):
+    return client.post('/api/apply-mask?mask_id=vader-mask&response=handle', data=_frame(shade),
+                       content_type='image/jpeg').get_json()
+
+
+def _enable_ai(flask_app, monkeypatch, **config):
+    settings = dict(ENABLE_AI_PROCESSING=True, GEMINI_RATE_LIMIT=0, GEMINI_BREAKER_FAILURES=2, **config)
+    for key, value in settings.items():
+        monkeypatch.setitem(flask_app.config, key, value)
+
+
+def test_apply_mask_uses_the_model_when_it_is_healthy(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch)
+    result = _apply(client, 10)
+    assert result['success'] and not result.get('degraded')
+    assert result['description'].startswith('Stub response')
+
+
+def test_failing_model_degrades_to_the_local_filter_and_opens_the_breaker(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch, GEMINI_STUB_ERROR='quota exceeded')
+    results = [_apply(client, shade) for shade in (10, 20, 30)]
+    for result in results:
+        assert result['success'] and result['degraded']
+        assert result['image_changed'] and result['result_id']
+        assert client.get(result['result_url']).mimetype == 'image/jpeg'
+    assert [r['reason'] for r in results] == ['error', 'error', 'circuit open']
+    assert results[2]['retry_after'] > 0
+
+    guard = client.get('/api/ai/status').get_json()['guard']
+    assert guard['state'] == 'open' and guard['failed'] == 2 and guard['rejected_open'] == 1
+    assert guard['fallbacks'] == 3
+
+
+def test_slow_model_trips_the_breaker(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch, GEMINI_STUB_LATENCY=0.05, GEMINI_SLOW_CALL_SECONDS=0.01)
+    results = [_apply(client, shade) for shade in (10, 20, 30)]
+    assert [bool(r.get('degraded')) for r in results] == [False, False, True]
+    assert results[2]['reason'] == 'circuit open'
+    assert client.get('/api/ai/status').get_json()['guard']['slow'] == 2
+
+
+def test_hung_model_call_times_out_to_the_fallback(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch, GEMINI_STUB_LATENCY=2.0, GEMINI_CALL_TIMEOUT=0.1)
+    started = time.monotonic()
+    result = _apply(client, 10)
+    assert time.monotonic() - started < 1.5
+    assert result['degraded'] and result['reason'] == 'error'
+    assert client.get('/api/ai/status').get_json()['guard']['timeouts'] == 1
+
+
+def test_open_breaker_skips_the_job_queue(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch, GEMINI_STUB_ERROR='quota exceeded')
+    _apply(client, 10)
+    _apply(client, 20)
+    response = client.post('/api/apply-mask?mask_id=vader-mask&response=handle&async=1', data=_frame(30),
+                           content_type='image/jpeg')
+    assert response.status_code == 200
+    assert response.get_json()['degraded'] and 'job_id' not in response.get_json()
+
+
+def test_failing_model_degrades_to_the_local_filter_in_an_async_job(flask_app, client, monkeypatch):
+    _enable_ai(flask_app, monkeypatch, GEMINI_STUB_ERROR='quota exceeded')
+    response = client.post('/api/apply-mask?mask_id=vader-mask&response=handle&async=1', data=_frame(10),
+                           content_type='image/jpeg')
+    assert response.status_code == 202
+    job_url = response.get_json()['job_url']
+
+    deadline = time.monotonic() + 5
+    while (job := client.get(job_url).get_json())['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline, job
+        time.sleep(0.02)
+    assert job['status'] == 'done', job
+    result = job['result']
+    assert result['success'] and result['degraded'] and result['reason'] == 'error'
+    assert result['result_url'] == f"/api/frames/{result['result_id']}"
+    assert client.get(result['result_url']).mimetype == 'image/jpeg'
@@ -0,0 +1,74 @@
+"""End-to-end test of burst capture: upload, encode in the pool, poll, gallery"""
+
+import io
+import time
+
+import pytest
+from PIL import Image
+
+
+def burst_frame(shade):
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), (shade, 40, 40)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def bursts(flask_app):
+    import app as app_module
+    yield app_module.get_animation_service()
+    app_module.get_animation_service().executor.shutdown()
+
+
+def wait_for_job(client, job_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(job_url).get_json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.1)
+    pytest.fail(f'{job_url} did not finish within {timeout}s')
+
+
+def test_burst_is_encoded_stored_and_listed(client, bursts):
+    frames = [(io.BytesIO(burst_frame(shade)), f'frame{i}.jpg') for i, shade in enumerate((60, 120, 180))]
+    response = client.post('/api/bursts', data={'frames': frames, 'mask': 'vader-mask', 'formats': 'WEBP,MP4'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_url = response.get_json()['job_url']
+
+    job = wait_for_job(client, job_url)
+    assert job['status'] == 'done', job
+    result = job['result']
+    filename = result['filename']
+    assert filename.startswith('sith_burst_') and filename.endswith('.webp')
+    assert result['url'] == f'/api/download/{filename}'
+    assert result['frames'] == 4  # three frames played forward and back
+    if bursts.video_available:
+        assert result['video_url'] == f'/api/download/{filename}?video=1'
+    else:
+        assert result['video_url'] is None
+
+    download = client.get(result['url'])
+    assert download.status_code == 200
+    with Image.open(io.BytesIO(download.data)) as image:
+        assert image.format == 'WEBP' and image.n_frames == 4
+
+    photos = client.get('/api/gallery').get_json()['photos']
+    entry = next(photo for photo in photos if photo['filename'] == filename)
+    assert entry['kind'] == 'animation'
+    assert entry['mask'] == 'vader-mask'
+    assert entry['video_url'] == result['video_url']
+    assert bursts.stats()['encoded'] == 1
+
+
+def test_streamed_burst_needs_two_frames(client, bursts):
+    burst = client.post('/api/bursts').get_json()
+    response = client.post(burst['frames_url'], data=burst_frame(90), content_type='image/jpeg')
+    assert response.get_json()['frames'] == 1
+    assert client.post(burst['encode_url']).status_code == 400
+
+    client.post(burst['frames_url'], data=burst_frame(150), content_type='image/jpeg')
+    response = client.post(burst['encode_url'])
+    assert response.status_code == 202
+    assert wait_for_job(client, response.get_json()['job_url'])['status'] == 'done'
@@ -0,0 +1,142 @@
+"""Tests for Gemini admission control: rate limit, concurrency cap, circuit breaker"""
+
+import threading
+import time
+
+import pytest
+
+from services.call_guard import CLOSED, HALF_OPEN, OPEN, CallGuard, CallRejected, TokenBucket
+from services.gemini_service import StubGenerativeModel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def fail():
+    raise RuntimeError('model unavailable')
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    guard = CallGuard(rate=1.0, burst=2, clock=clock)
+    assert guard.call(lambda: 'a') == 'a'
+    assert guard.call(lambda: 'b') == 'b'
+    with pytest.raises(CallRejected) as rejected:
+        guard.call(lambda: 'c')
+    assert rejected.value.reason == 'rate limited'
+    assert rejected.value.retry_after == pytest.approx(1.0)
+    clock.advance(1.0)
+    assert guard.call(lambda: 'c') == 'c'
+    assert guard.stats()['rejected_rate'] == 1
+
+
+def test_token_bucket_backs_off_and_recovers(clock):
+    bucket = TokenBucket(rate=4.0, min_rate=1.0, rate_step=1.0, clock=clock)
+    bucket.decrease()
+    bucket.decrease()
+    bucket.decrease()
+    assert bucket.rate == 1.0
+    bucket.increase()
+    assert bucket.rate == 2.0
+    for _ in range(5):
+        bucket.increase()
+    assert bucket.rate == 4.0
+
+
+def test_concurrency_cap_refuses_calls_beyond_the_limit():
+    guard = CallGuard(max_concurrency=1)
+    release = threading.Event()
+    entered = threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait(5)
+    thread = threading.Thread(target=guard.call, args=(slow,))
+    thread.start()
+    assert entered.wait(2)
+    with pytest.raises(CallRejected) as rejected:
+        guard.call(lambda: None)
+    assert rejected.value.reason == 'too many calls in flight'
+    release.set()
+    thread.join(5)
+    assert guard.call(lambda: 'free') == 'free'
+    assert guard.stats()['in_flight'] == 0
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    guard = CallGuard(failure_threshold=2, reset_timeout=10, clock=clock)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            guard.call(fail)
+    assert guard.breaker.state == OPEN and not guard.allows()
+
+    with pytest.raises(CallRejected) as rejected:
+        guard.call(lambda: 'never')
+    assert rejected.value.reason == 'circuit open'
+    assert rejected.value.retry_after == pytest.approx(10)
+
+    clock.advance(10)
+    assert guard.breaker.state == HALF_OPEN
+    with pytest.raises(RuntimeError):
+        guard.call(fail)  # the probe fails: open again at once
+    assert guard.breaker.state == OPEN
+
+    clock.advance(10)
+    assert guard.call(lambda: 'probe') == 'probe'
+    assert guard.breaker.state == CLOSED
+    assert guard.stats()['times_opened'] == 2
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    guard = CallGuard(failure_threshold=1, reset_timeout=5, clock=clock)
+    with pytest.raises(RuntimeError):
+        guard.call(fail)
+    clock.advance(5)
+    assert guard.breaker.allow() == 0
+    with pytest.raises(CallRejected):
+        guard.call(lambda: 'second')
+
+
+def test_slow_calls_count_as_failures():
+    model = StubGenerativeModel(latency=0.05)
+    guard = CallGuard(failure_threshold=2, slow_call_seconds=0.01)
+    guard.call(model.generate_content, 'prompt')
+    guard.call(model.generate_content, 'prompt')
+    assert guard.breaker.state == OPEN
+    assert guard.stats()['slow'] == 2
+
+
+def test_timed_out_call_keeps_its_slot_until_it_returns():
+    model = StubGenerativeModel(latency=0.3)
+    guard = CallGuard(max_concurrency=1, call_timeout=0.05)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        guard.call(model.generate_content, 'prompt')
+    assert time.monotonic() - started < 0.25
+    with pytest.raises(CallRejected):
+        guard.call(lambda: 'blocked')
+    assert guard.stats()['abandoned'] == 1
+
+    time.sleep(0.4)
+    assert guard.stats()['abandoned'] == 0
+    assert guard.call(lambda: 'free', timeout=1) == 'free'
+    assert guard.stats()['timeouts'] == 1
+
+
+def test_failures_from_the_stub_are_reraised():
+    guard = CallGuard()
+    with pytest.raises(RuntimeError, match='quota'):
+        guard.call(StubGenerativeModel(latency=0, error='quota exceeded').generate_content, 'prompt')
+    assert guard.stats()['failed'] == 1
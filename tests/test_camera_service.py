@@ -0,0 +1,49 @@
+"""Tests for CameraService image helpers"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from services.camera_service import SITH_FILTER_PRESETS, CameraService, compile_sith_filter
+
+ENHANCERS = {'contrast': ImageEnhance.Contrast, 'brightness': ImageEnhance.Brightness,
+             'color': ImageEnhance.Color}
+
+
+def enhance_chain(image, preset):
+    """The ImageEnhance chain the compiled filters replace"""
+    for name in ('contrast', 'brightness', 'color'):
+        if name in preset:
+            image = ENHANCERS[name](image).enhance(preset[name])
+    return image
+
+
+def sample_image(seed, size=(160, 120)):
+    """Gradients plus noise, so every channel covers most of its range"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, size[0])
+    y = np.linspace(0, 255, size[1])[:, None]
+    pixels = np.stack([np.broadcast_to(x, (size[1], size[0])),
+                       np.broadcast_to(y, (size[1], size[0])),
+                       (x + y) / 2], axis=2)
+    pixels = pixels + rng.normal(0, 25, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize('filter_type', sorted(SITH_FILTER_PRESETS))
+@pytest.mark.parametrize('seed', [1, 2])
+def test_compiled_filter_matches_the_enhance_chain(filter_type, seed):
+    image = sample_image(seed)
+    expected = np.asarray(enhance_chain(image, SITH_FILTER_PRESETS[filter_type]), dtype=int)
+    actual = np.asarray(compile_sith_filter(filter_type).apply(image), dtype=int)
+    assert np.abs(actual - expected).max() <= 1
+
+
+def test_camera_service_filters_and_batches_alike():
+    camera_service = CameraService()
+    images = [sample_image(3), sample_image(4).convert('RGBA')]
+    batch = camera_service.apply_sith_filter_batch(images, 'vader-mask')
+    for image, filtered in zip(images, batch):
+        single = camera_service.apply_sith_filter(image, 'vader-mask')
+        assert filtered.mode == 'RGB' and filtered.tobytes() == single.tobytes()
+    assert camera_service.apply_sith_filter(images[0], 'unknown') is images[0]
@@ -0,0 +1,93 @@
+"""Tests for photo variants: generation, the on-disk cache and removal"""
+
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from services.camera_service import CameraService
+from services.derivative_service import DerivativeService
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Original photos by filename, and how often each was opened"""
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    Image.new('RGB', (1600, 1200), (150, 40, 40)).save(photos / 'sith.jpg', quality=90)
+    opened = []
+
+    def open_source(filename):
+        opened.append(filename)
+        return open(photos / filename, 'rb')
+    return photos, opened, open_source
+
+
+@pytest.fixture
+def derivatives(tmp_path, sources):
+    service = DerivativeService(CameraService(), str(tmp_path / 'derivatives'), sources[2])
+    yield service
+    service.executor.shutdown()
+
+
+def test_variants_are_generated_cached_and_removed(derivatives, sources):
+    _, opened, _ = sources
+    assert derivatives.generate_all('sith.jpg') == 2
+    thumb = derivatives.variant_path('sith.jpg', 'thumb')
+    with Image.open(thumb) as image:
+        assert image.format == 'WEBP' and max(image.size) == 320
+    with Image.open(derivatives.variant_path('sith.jpg', 'medium')) as image:
+        assert image.size == (1280, 960)
+    assert opened == ['sith.jpg', 'sith.jpg']
+
+    # Cached: nothing is decoded again
+    assert derivatives.ensure('sith.jpg', 'thumb') == thumb
+    assert derivatives.generate_all('sith.jpg') == 0
+    assert len(opened) == 2
+
+    derivatives.remove('sith.jpg')
+    assert not os.path.exists(thumb)
+    assert derivatives.ensure('sith.jpg', 'thumb') == thumb
+    assert len(opened) == 3
+
+
+def test_jpeg_variants_are_made_on_demand(derivatives):
+    path = derivatives.ensure('sith.jpg', 'medium', 'JPEG')
+    assert path.endswith('sith.medium.jpg')
+    with Image.open(path) as image:
+        assert image.format == 'JPEG'
+    assert derivatives.ensure('sith.jpg', 'huge') is None
+
+
+def test_missing_source_writes_nothing_and_releases_its_lock(derivatives, sources):
+    photos, _, _ = sources
+    (photos / 'broken.jpg').write_bytes(b'not a jpeg')
+    assert derivatives.ensure('gone.jpg', 'thumb') is None
+    assert derivatives.generate_all('broken.jpg') == 0
+    assert derivatives._locks == {}
+    assert not os.path.exists(derivatives.variant_path('gone.jpg', 'thumb'))
+
+
+def test_deleting_a_photo_drops_its_variants(flask_app, client):
+    import app as app_module
+    frame = io.BytesIO()
+    Image.new('RGB', (800, 600), (90, 20, 20)).save(frame, format='JPEG')
+    filename = client.post('/api/capture-photo/stream?mask=vader-mask', data=frame.getvalue(),
+                           content_type='image/jpeg').get_json()['filename']
+    url = f'/api/photos/thumb/{filename}'
+    assert client.get(url, headers={'Accept': 'image/webp'}).mimetype == 'image/webp'
+
+    derivatives = app_module.get_derivative_service()
+    deadline = time.monotonic() + 10
+    while derivatives.stats()['pending']:
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    thumb = derivatives.variant_path(filename, 'thumb')
+    assert os.path.exists(thumb)
+
+    assert client.delete(f'/api/delete-photo/{filename}').status_code == 200
+    assert not os.path.exists(thumb)
+    assert not os.path.exists(derivatives.variant_path(filename, 'medium'))
+    assert client.get(url, headers={'Accept': 'image/webp'}).status_code == 404
@@ -0,0 +1,53 @@
+"""Tests for the frame cache: handles, expiry and background pruning"""
+
+import os
+import threading
+import time
+
+from services.frame_cache import FrameCache
+
+
+def test_frames_resolve_from_another_worker(tmp_path):
+    frame_id = FrameCache(str(tmp_path)).put(b'frame')
+    other = FrameCache(str(tmp_path))
+    assert other.get(frame_id) == b'frame'
+    assert other.get('0' * 64) is None and other.get('../etc') is None
+    assert other.stats()['disk_hits'] == 1
+
+
+def test_expired_frames_are_misses(tmp_path):
+    cache = FrameCache(str(tmp_path), ttl=0)
+    frame_id = cache.put(b'frame')
+    time.sleep(0.01)
+    assert cache.get(frame_id) is None
+    assert not os.path.exists(cache._path(frame_id))
+
+
+def test_pruning_runs_off_the_request_path(tmp_path, monkeypatch):
+    cache = FrameCache(str(tmp_path), ttl=60, prune_every=2)
+    expired = cache._path(cache.put(b'old'))
+    os.utime(expired, (0, 0))
+
+    walking = threading.Event()
+    release = threading.Event()
+    prune = cache.prune
+
+    def slow_prune():
+        walking.set()
+        release.wait(5)
+        return prune()
+    monkeypatch.setattr(cache, 'prune', slow_prune)
+
+    started = time.monotonic()
+    cache.put(b'second')  # the prune_every-th put
+    pruning = cache._pruning
+    cache.put(b'third')
+    cache.put(b'fourth')  # prune still running: no second thread
+    assert time.monotonic() - started < 1
+    assert walking.wait(5)
+    assert cache._pruning is pruning and pruning.is_alive() and os.path.exists(expired)
+
+    release.set()
+    pruning.join(5)
+    assert not os.path.exists(expired)
+    assert cache.get(cache.frame_id(b'fourth')) == b'fourth'
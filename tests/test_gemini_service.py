@@ -0,0 +1,60 @@
+"""Tests for Gemini response caching, against the offline stub model"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from services.gemini_service import GeminiResponseCache, GeminiService, StubGenerativeModel
+
+
+def jpeg_bytes(color='red', size=(32, 32)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def model():
+    return StubGenerativeModel(latency=0)
+
+
+@pytest.fixture
+def service(model, tmp_path):
+    return GeminiService('test-key', cache=GeminiResponseCache(str(tmp_path / 'cache')), model=model)
+
+
+def test_same_frame_with_jittered_landmarks_hits_the_cache(service, model):
+    frame = jpeg_bytes()
+    first = service.enhance_mask_bytes(frame, 'vader-mask', {'x': 120.0, 'y': 80.0})
+    second = service.enhance_mask_bytes(frame, 'vader-mask', {'x': 121.5, 'y': 79.2})
+    assert first['success'] and not first['cached']
+    assert second['success'] and second['cached']
+    assert model.calls == 1
+
+
+def test_cache_is_keyed_by_mask_and_image(service, model):
+    frame = jpeg_bytes()
+    service.enhance_mask_bytes(frame, 'vader-mask')
+    service.enhance_mask_bytes(frame, 'emperor')
+    service.enhance_mask_bytes(jpeg_bytes('blue'), 'vader-mask')
+    assert model.calls == 3
+
+
+def test_failures_are_not_cached(tmp_path):
+    model = StubGenerativeModel(latency=0, error='boom')
+    service = GeminiService('test-key', cache=GeminiResponseCache(str(tmp_path / 'cache')), model=model)
+    frame = jpeg_bytes()
+    assert not service.enhance_mask_bytes(frame, 'vader-mask')['success']
+    assert not service.enhance_mask_bytes(frame, 'vader-mask')['success']
+    assert model.calls == 2
+
+
+def test_cache_entries_are_shared_through_disk(model, tmp_path):
+    frame = jpeg_bytes()
+    GeminiService('test-key', cache=GeminiResponseCache(str(tmp_path / 'cache')), model=model) \
+        .enhance_mask_bytes(frame, 'vader-mask')
+    other = GeminiService('test-key', cache=GeminiResponseCache(str(tmp_path / 'cache')), model=model)
+    assert other.enhance_mask_bytes(frame, 'vader-mask')['cached']
+    assert other.cache.stats()['disk_hits'] == 1
+    assert model.calls == 1
@@ -0,0 +1,83 @@
+"""Tests for the spawn process pool: shared memory transfer, timeouts and crashes"""
+
+import os
+import time
+
+import pytest
+from PIL import Image, ImageChops
+
+from services import image_executor
+from services.image_executor import SHARED_BYTES_THRESHOLD, ImageExecutor, TaskTimeout, WorkerCrashed
+
+
+# Tasks must be module-level so spawned workers can import them
+
+def invert(image, payload):
+    return ImageChops.invert(image), payload[::-1], os.getpid()
+
+
+def sleep_for(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crash():
+    os._exit(3)
+
+
+def fail():
+    raise ValueError('bad frame')
+
+
+@pytest.fixture
+def executor():
+    executor = ImageExecutor(max_workers=1, task_timeout=10, name='test-worker')
+    yield executor
+    executor.shutdown()
+
+
+def test_images_and_large_bytes_travel_through_shared_memory(executor, monkeypatch):
+    shared = []
+    share = image_executor._share
+
+    def recording(value, created):
+        result = share(value, created)
+        shared.append(type(result).__name__)
+        return result
+    monkeypatch.setattr(image_executor, '_share', recording)
+
+    image = Image.new('RGB', (320, 240), (10, 200, 30))
+    payload = bytes(range(256)) * (SHARED_BYTES_THRESHOLD // 256 + 1)
+    inverted, reversed_payload, pid = executor.run(invert, image, payload)
+
+    assert shared == ['SharedFrame', 'SharedBytes']
+    assert pid != os.getpid()
+    assert inverted.size == (320, 240) and inverted.getpixel((5, 5)) == (245, 55, 225)
+    assert reversed_payload == payload[::-1]
+    assert executor.stats()['tasks'] == 1 and executor.stats()['failed'] == 0
+
+
+def test_task_errors_are_raised_and_keep_the_worker(executor):
+    with pytest.raises(RuntimeError, match='ValueError: bad frame'):
+        executor.run(fail)
+    assert executor.run(sleep_for, 0) == 0
+    assert executor.stats()['started'] == 1
+
+
+def test_overrunning_task_is_killed_and_the_pool_recovers(executor):
+    started = time.monotonic()
+    with pytest.raises(TaskTimeout):
+        executor.run(sleep_for, 30, timeout=0.5)
+    assert time.monotonic() - started < 10
+    assert executor.run(sleep_for, 0) == 0
+    stats = executor.stats()
+    assert stats['timeouts'] == 1 and stats['started'] == 2 and stats['alive'] == 1
+
+
+def test_crashed_worker_is_replaced(executor):
+    with pytest.raises(WorkerCrashed, match='exit code 3'):
+        executor.run(crash)
+    assert executor.run(sleep_for, 0) == 0
+    stats = executor.stats()
+    assert stats['crashes'] == 1 and stats['started'] == 2 and stats['alive'] == 1
+    assert stats['busy'] == 0 and stats['queued'] == 0
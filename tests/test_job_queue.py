@@ -0,0 +1,143 @@
+"""Tests for the background job queue and the queued /api/apply-mask flow"""
+
+import threading
+import time
+
+import pytest
+
+from services.call_guard import CallGuard
+from services.gemini_service import GeminiService, StubGenerativeModel
+from services.job_queue import JobQueue, QueueFull, remaining_time
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_submit_and_poll():
+    jobs = JobQueue(workers=1, max_pending=4)
+    job = jobs.submit(lambda a, b=0: a + b, 2, b=3)
+    assert job.wait(2)
+    assert jobs.get(job.id) is job
+    assert job.to_dict()['status'] == 'done'
+    assert job.to_dict()['result'] == 5
+
+
+def test_failed_job_reports_its_error():
+    def fail():
+        raise RuntimeError('boom')
+    job = JobQueue(workers=1).submit(fail)
+    assert job.wait(2)
+    assert job.to_dict()['status'] == 'failed'
+    assert job.to_dict()['error'] == 'boom'
+
+
+def test_full_queue_raises_queue_full():
+    release = threading.Event()
+    jobs = JobQueue(workers=1, max_pending=1)
+    running = jobs.submit(release.wait, 5)
+    assert wait_for(lambda: running.status == 'running')
+    jobs.submit(release.wait, 5)
+    with pytest.raises(QueueFull):
+        jobs.submit(release.wait, 5)
+    release.set()
+
+
+def test_job_expired_in_the_queue_never_starts():
+    release = threading.Event()
+    started = []
+    jobs = JobQueue(workers=1, max_pending=2)
+    jobs.submit(release.wait, 5)
+    late = jobs.submit(started.append, 'late', timeout=0.05)
+    time.sleep(0.1)
+    release.set()
+    assert late.wait(2)
+    assert late.status == 'timeout' and started == []
+
+
+def test_overrunning_job_is_reported_as_timed_out():
+    jobs = JobQueue(workers=1)
+    job = jobs.submit(time.sleep, 0.3, timeout=0.05)
+    time.sleep(0.1)
+    assert job.to_dict()['status'] == 'timeout'
+    assert job.wait(2)
+    assert job.status == 'timeout'
+
+
+def test_remaining_time_follows_the_job_deadline():
+    assert remaining_time() is None
+    job = JobQueue(workers=1).submit(remaining_time, timeout=5)
+    assert job.wait(2)
+    assert 4 < job.result <= 5
+
+
+def test_hung_model_call_frees_the_worker_at_the_deadline():
+    model = StubGenerativeModel(latency=5)
+    service = GeminiService('test-key', model=model, guard=CallGuard(max_concurrency=4))
+    jobs = JobQueue(workers=1)
+    started = time.monotonic()
+    hung = jobs.submit(service.get_filter_recommendations, 'face', timeout=0.2)
+    after = jobs.submit(lambda: 'next', timeout=5)
+    assert after.wait(2)
+    assert time.monotonic() - started < 1.5
+    assert hung.status == 'timeout'
+    assert jobs.stats()['running'] == 0
+    assert service.guard.stats()['abandoned'] == 1
+
+
+def test_cancel_queued_job_skips_it():
+    release = threading.Event()
+    ran = []
+    jobs = JobQueue(workers=1, max_pending=2)
+    jobs.submit(release.wait, 5)
+    queued = jobs.submit(ran.append, 'queued')
+    assert jobs.cancel(queued.id)
+    release.set()
+    jobs._queue.join()
+    assert queued.status == 'cancelled' and ran == []
+    assert not jobs.cancel(queued.id)
+
+
+def test_cancel_running_job_keeps_cancelled():
+    release = threading.Event()
+    jobs = JobQueue(workers=1)
+    job = jobs.submit(release.wait, 5)
+    assert wait_for(lambda: job.status == 'running')
+    assert jobs.cancel(job.id)
+    release.set()
+    jobs._queue.join()
+    assert job.status == 'cancelled' and job.result is None
+
+
+def test_apply_mask_async_queues_a_job_and_polls_it(flask_app, client, jpeg, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'ENABLE_AI_PROCESSING', True)
+    response = client.post('/api/apply-mask?mask_id=vader-mask&async=1&response=handle',
+                           data=jpeg, content_type='image/jpeg')
+    assert response.status_code == 202
+    job_url = response.get_json()['job_url']
+    assert wait_for(lambda: client.get(job_url).get_json()['status'] == 'done')
+    assert client.get(job_url).get_json()['result']['success']
+
+
+def test_apply_mask_async_answers_429_when_the_queue_is_full(flask_app, client, jpeg, monkeypatch):
+    import app as app_module
+    monkeypatch.setitem(flask_app.config, 'ENABLE_AI_PROCESSING', True)
+    monkeypatch.setitem(flask_app.config, 'AI_JOB_WORKERS', 1)
+    monkeypatch.setitem(flask_app.config, 'AI_JOB_QUEUE_SIZE', 1)
+    release = threading.Event()
+    jobs = app_module.get_ai_job_queue()
+    blocker = jobs.submit(release.wait, 5)
+    assert wait_for(lambda: blocker.status == 'running')
+    jobs.submit(release.wait, 5)
+    try:
+        response = client.post('/api/apply-mask?mask_id=vader-mask&async=1&response=handle',
+                               data=jpeg, content_type='image/jpeg')
+        assert response.status_code == 429
+        assert response.headers['Retry-After']
+    finally:
+        release.set()
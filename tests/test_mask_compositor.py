@@ -0,0 +1,116 @@
+"""Tests for MaskCompositor: landmark warps, the pose cache and multi-face compositing"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from services.camera_service import WARP_LANDMARKS, MaskCompositor
+
+MASK_SIZE = (100, 120)
+ANCHORS = {
+    'left_eye': {'x': 0.3, 'y': 0.4},
+    'right_eye': {'x': 0.7, 'y': 0.4},
+    'nose': {'x': 0.5, 'y': 0.6},
+    'mouth': {'x': 0.5, 'y': 0.75},
+    'chin': {'x': 0.5, 'y': 0.9}
+}
+
+
+@pytest.fixture
+def masks_dir(tmp_path):
+    image = Image.new('RGBA', MASK_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((10, 10, 89, 109), fill=(200, 30, 30, 255))
+    draw.rectangle((20, 40, 79, 59), fill=(30, 30, 200, 128))
+    image.save(tmp_path / 'vader.png')
+    return tmp_path
+
+
+def compositor(masks_dir, **options):
+    return MaskCompositor(str(masks_dir), anchors={'vader': ANCHORS}, **options)
+
+
+def face(offset=(0, 0), scale=1.0, shear=0.0):
+    """face_data whose warp landmarks sit on the mask's anchors, moved and scaled"""
+    width, height = MASK_SIZE
+    points = [{'x': 0.0, 'y': 0.0} for _ in range(max(max(i) for i in WARP_LANDMARKS.values()) + 1)]
+    for name, indices in WARP_LANDMARKS.items():
+        x, y = ANCHORS[name]['x'] * width, ANCHORS[name]['y'] * height
+        x += shear * (y - height / 2)
+        for index in indices:
+            points[index] = {'x': offset[0] + x * scale, 'y': offset[1] + y * scale}
+    return {'landmarks_px': points}
+
+
+def place(patch, x, y, size=(300, 240)):
+    canvas = np.zeros((size[1], size[0], 4), dtype=int)
+    canvas[y:y + patch.shape[0], x:x + patch.shape[1]] = patch
+    return canvas
+
+
+def test_identity_landmarks_keep_the_unwarped_mask(masks_dir):
+    masks = compositor(masks_dir)
+    patch, x, y = masks.warped_mask('vader', masks.face_landmarks(face(offset=(50, 40))))
+    # The patch may carry a transparent rounding border, but no more
+    assert abs(x - 50) <= 1 and abs(y - 40) <= 1
+    assert abs(patch.shape[1] - MASK_SIZE[0]) <= 2 and abs(patch.shape[0] - MASK_SIZE[1]) <= 2
+    unwarped = place(masks.scaled_mask('vader', *MASK_SIZE), 50, 40)
+    assert np.abs(place(patch, x, y) - unwarped).max() <= 1
+
+
+def test_identity_warp_composites_like_a_plain_blend(masks_dir):
+    masks = compositor(masks_dir)
+    frame = Image.new('RGB', (300, 240), (90, 90, 90))
+    warped = np.array(masks.composite_image(frame, 'vader', face(offset=(50, 40))), dtype=int)
+    expected = np.array(frame)
+    MaskCompositor._blend(expected, masks.scaled_mask('vader', *MASK_SIZE), 50, 40)
+    assert np.abs(warped - expected).max() <= 1
+    assert masks.stats()['fallbacks'] == 0
+
+
+def test_repeated_pose_is_a_cache_hit(masks_dir):
+    masks = compositor(masks_dir)
+    first = masks.warped_mask('vader', masks.face_landmarks(face(offset=(50, 40), scale=0.8)))
+    # The same pose slid across the frame reuses the warp
+    second = masks.warped_mask('vader', masks.face_landmarks(face(offset=(120, 70), scale=0.8)))
+    assert masks.warp_counters == {'hits': 1, 'misses': 1, 'fallbacks': 0}
+    assert second[0] is first[0]
+    assert (second[1] - first[1], second[2] - first[2]) == (70, 30)
+
+    masks.warped_mask('vader', masks.face_landmarks(face(offset=(50, 40), scale=1.2)))
+    assert masks.warp_counters['misses'] == 2
+    assert masks.stats()['entries'] == 2
+
+
+def test_perspective_mode_gives_a_premultiplied_rgba_patch(masks_dir):
+    masks = compositor(masks_dir, warp_mode='perspective')
+    patch, x, y = masks.warped_mask('vader', masks.face_landmarks(face(offset=(60, 30), shear=0.2)))
+    assert patch.dtype == np.uint8 and patch.ndim == 3 and patch.shape[2] == 4
+    assert patch[..., 3].max() == 255
+    assert (patch[..., :3] <= patch[..., 3:4]).all()
+
+    frame = Image.new('RGB', (300, 240), (90, 90, 90))
+    result = masks.composite_image(frame, 'vader', face(offset=(60, 30), shear=0.2))
+    assert result.mode == 'RGB' and result.size == frame.size
+    assert np.array(result)[30 + 60, 60 + 50].tolist() != [90, 90, 90]
+
+
+def test_degenerate_landmarks_fall_back_to_placement(masks_dir):
+    masks = compositor(masks_dir)
+    points = face(offset=(50, 40))
+    for point in points['landmarks_px']:
+        point['y'] = 100.0  # every landmark on one line
+    frame = Image.new('RGB', (300, 240), (90, 90, 90))
+    result = masks.composite_image(frame, 'vader', points)
+    assert masks.warp_counters['fallbacks'] == 1
+    assert np.array(result).tolist() != np.array(frame).tolist()
+
+
+def test_every_face_gets_a_mask(masks_dir):
+    masks = compositor(masks_dir)
+    frame = Image.new('RGB', (400, 200), (90, 90, 90))
+    faces = [face(offset=(20, 40), scale=0.8), face(offset=(260, 40), scale=0.8)]
+    result = np.array(masks.composite_image(frame, 'vader', faces))
+    changed = (result != 90).any(axis=2)
+    assert changed[:, :200].any() and changed[:, 200:].any()
+    assert masks.warp_counters['hits'] == 1  # the second face has the same pose
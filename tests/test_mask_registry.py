@@ -0,0 +1,93 @@
+"""Tests for the mask registry and its precomputed manifest analysis"""
+
+import json
+
+import pytest
+from PIL import Image, ImageDraw
+
+from services import mask_registry
+from services.mask_registry import MaskRegistry
+
+
+def draw_mask(path, size=(200, 240)):
+    """An opaque oval with two eye holes and a mouth hole"""
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((10, 10, 190, 230), fill=(90, 10, 10, 255))
+    for box in ((55, 80, 85, 105), (115, 80, 145, 105), (80, 165, 120, 185)):
+        draw.ellipse(box, fill=(0, 0, 0, 0))
+    image.save(path)
+
+
+@pytest.fixture
+def masks_dir(tmp_path):
+    draw_mask(tmp_path / 'vader.png')
+    (tmp_path / 'manifest.json').write_text(json.dumps({'masks': [
+        {'id': 'none', 'name': 'No Mask', 'file': None, 'icon': '', 'description': ''},
+        {'id': 'vader-mask', 'name': 'Darth Vader', 'file': 'vader.png', 'icon': '', 'description': ''}
+    ]}))
+    return tmp_path
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    """Records the files analyze_mask is called for"""
+    calls = []
+    analyze = mask_registry.analyze_mask
+
+    def counting(path, thumbnail_size=64):
+        calls.append(path)
+        return analyze(path, thumbnail_size)
+    monkeypatch.setattr(mask_registry, 'analyze_mask', counting)
+    return calls
+
+
+def test_registry_analyzes_masks_without_precomputed_data(masks_dir, analyses):
+    registry = MaskRegistry(str(masks_dir))
+    mask = registry.get('vader-mask')
+    assert len(analyses) == 1
+    assert mask['anchor_source'] == 'holes'
+    assert mask['anchors']['left_eye']['x'] < mask['anchors']['right_eye']['x']
+    assert mask['thumbnail'].startswith('data:image/webp;base64,')
+    assert [m['id'] for m in registry.masks()] == ['none', 'vader-mask']
+
+
+def test_built_manifest_is_served_without_analysis(masks_dir, analyses):
+    draw_mask(masks_dir / 'extra.png')
+    assert MaskRegistry(str(masks_dir)).build_manifest() == 2
+    analyses.clear()
+
+    registry = MaskRegistry(str(masks_dir))
+    assert analyses == []
+    assert registry.get('vader-mask')['anchor_source'] == 'holes'
+    assert registry.get('extra')['name'] == 'Extra'
+
+
+def test_changed_and_unlisted_files_are_analyzed_at_runtime(masks_dir, analyses):
+    MaskRegistry(str(masks_dir)).build_manifest()
+    draw_mask(masks_dir / 'vader.png', size=(220, 260))
+    draw_mask(masks_dir / 'new.png')
+    analyses.clear()
+
+    registry = MaskRegistry(str(masks_dir))
+    assert sorted(path.rsplit('/', 1)[-1] for path in analyses) == ['new.png', 'vader.png']
+    assert registry.get('vader-mask')['width'] == 220
+
+
+def test_unreadable_mask_is_recorded_and_not_retried(masks_dir, analyses):
+    (masks_dir / 'broken.png').write_bytes(b'not a png')
+    MaskRegistry(str(masks_dir)).build_manifest()
+    analyses.clear()
+
+    registry = MaskRegistry(str(masks_dir))
+    assert analyses == []
+    assert registry.get('broken') is None
+
+
+def test_version_changes_with_the_catalog(masks_dir):
+    registry = MaskRegistry(str(masks_dir), check_interval=0)
+    version = registry.version
+    assert not registry.refresh()
+    draw_mask(masks_dir / 'new.png')
+    assert registry.refresh()
+    assert registry.version != version
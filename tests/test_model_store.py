@@ -0,0 +1,128 @@
+"""Tests for resumable, deduplicated model uploads"""
+
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from services.model_store import ModelRejected, ModelStore, UploadSessionConflict
+from services.upload_stream import UploadTooLarge
+
+MODEL = bytes(range(256)) * 400  # 100 KiB
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ModelStore(str(tmp_path / 'models'), min_bytes=1024)
+
+
+class SlowStream:
+    """A request body that blocks after its first block until released"""
+
+    def __init__(self, data, release):
+        self.data = io.BytesIO(data)
+        self.release = release
+        self.started = threading.Event()
+
+    def read(self, size):
+        block = self.data.read(min(size, 1024))
+        if not self.started.is_set():
+            self.started.set()
+            self.release.wait(5)
+        return block
+
+
+class BrokenStream:
+    """A request body whose connection drops after ``size`` bytes"""
+
+    def __init__(self, data, size):
+        self.data = io.BytesIO(data[:size])
+
+    def read(self, size):
+        block = self.data.read(size)
+        if not block:
+            raise ConnectionResetError('client went away')
+        return block
+
+
+def test_upload_resumes_from_the_stored_offset(store):
+    session = store.create_session('face.task', len(MODEL), hashlib.sha256(MODEL).hexdigest())
+    store.append(session['id'], 0, io.BytesIO(MODEL[:40000]))
+
+    # A new worker picks the session up from disk
+    resumed = ModelStore(store.models_dir, min_bytes=1024)
+    assert resumed.get_session(session['id'])['offset'] == 40000
+    with pytest.raises(UploadSessionConflict) as conflict:
+        resumed.append(session['id'], 0, io.BytesIO(MODEL[:40000]))
+    assert conflict.value.offset == 40000
+
+    finished = resumed.append(session['id'], 40000, io.BytesIO(MODEL[40000:]), total=len(MODEL))
+    assert finished['result']['sha256'] == hashlib.sha256(MODEL).hexdigest()
+    with open(store.path('face.task'), 'rb') as f:
+        assert f.read() == MODEL
+    assert resumed.get_session(session['id']) is None
+
+
+def test_concurrent_retries_of_one_chunk_append_once(store):
+    session = store.create_session('face.task', len(MODEL))
+    release = threading.Event()
+    slow = SlowStream(MODEL[:50000], release)
+    outcomes = []
+
+    def first():
+        outcomes.append(store.append(session['id'], 0, slow)['offset'])
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert slow.started.wait(2)
+
+    retry_outcome = []
+
+    def retry():
+        try:
+            retry_outcome.append(store.append(session['id'], 0, io.BytesIO(MODEL[:50000]))['offset'])
+        except UploadSessionConflict as e:
+            retry_outcome.append(('conflict', e.offset))
+    retry_thread = threading.Thread(target=retry)
+    retry_thread.start()
+    release.set()
+    thread.join(5)
+    retry_thread.join(5)
+
+    assert outcomes == [50000]
+    assert retry_outcome == [('conflict', 50000)]
+    assert store.get_session(session['id'])['offset'] == 50000
+
+
+def test_dropped_chunk_is_truncated_away(store):
+    session = store.create_session('face.task', len(MODEL))
+    store.append(session['id'], 0, io.BytesIO(MODEL[:10000]))
+    with pytest.raises(ConnectionResetError):
+        store.append(session['id'], 10000, BrokenStream(MODEL[10000:], 5000))
+    assert store.get_session(session['id'])['offset'] == 10000
+    store.append(session['id'], 10000, io.BytesIO(MODEL[10000:]))
+    with open(store.path('face.task'), 'rb') as f:
+        assert f.read() == MODEL
+
+
+def test_chunk_past_the_declared_size_is_rejected(store):
+    session = store.create_session('face.task', len(MODEL))
+    with pytest.raises(UploadTooLarge):
+        store.append(session['id'], 0, io.BytesIO(MODEL + b'extra'))
+    assert store.get_session(session['id'])['offset'] == 0
+
+
+def test_checksum_mismatch_rejects_the_upload(store):
+    session = store.create_session('face.task', len(MODEL), 'ab' * 32)
+    with pytest.raises(ModelRejected):
+        store.append(session['id'], 0, io.BytesIO(MODEL))
+    assert not os.path.exists(store.path('face.task'))
+
+
+def test_known_content_is_linked_without_upload(store):
+    session = store.create_session('face.task', len(MODEL))
+    store.append(session['id'], 0, io.BytesIO(MODEL))
+    again = store.create_session('copy.task', len(MODEL), hashlib.sha256(MODEL).hexdigest())
+    assert again['result']['deduplicated']
+    assert os.path.samefile(store.path('face.task'), store.path('copy.task'))
@@ -0,0 +1,82 @@
+"""Tests for the SQLite photo index: keyset pagination and gallery ETags"""
+
+import pytest
+
+from services.photo_index import PhotoIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    return PhotoIndex(str(tmp_path / 'index.sqlite3'), str(tmp_path / 'uploads'))
+
+
+def fill(index, count, mask='vader-mask', start=1000.0):
+    for i in range(count):
+        index.add(f'photo_{i:03d}.jpg', mask, 100, start + i)
+
+
+def test_page_walks_every_photo_newest_first(index):
+    fill(index, 7)
+    seen, cursor = [], None
+    while True:
+        records, cursor = index.page(limit=3, cursor=cursor)
+        seen.extend(record['filename'] for record in records)
+        if cursor is None:
+            break
+    assert seen == [f'photo_{i:03d}.jpg' for i in reversed(range(7))]
+
+
+def test_page_breaks_timestamp_ties_by_filename(index):
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        index.add(name, 'none', 1, 500.0)
+    first, cursor = index.page(limit=2)
+    second, last_cursor = index.page(limit=2, cursor=cursor)
+    assert [r['filename'] for r in first] == ['c.jpg', 'b.jpg']
+    assert [r['filename'] for r in second] == ['a.jpg']
+    assert last_cursor is None
+
+
+def test_page_is_stable_when_newer_photos_arrive(index):
+    fill(index, 4)
+    first, cursor = index.page(limit=2)
+    index.add('newer.jpg', 'none', 1, 9999.0)
+    second, _ = index.page(limit=2, cursor=cursor)
+    assert [r['filename'] for r in first + second] == [
+        'photo_003.jpg', 'photo_002.jpg', 'photo_001.jpg', 'photo_000.jpg'
+    ]
+
+
+def test_page_filters_by_mask(index):
+    fill(index, 3, mask='emperor')
+    index.add('other.jpg', 'jedi', 1, 5000.0)
+    records, cursor = index.page(limit=10, mask='emperor')
+    assert {r['mask'] for r in records} == {'emperor'}
+    assert len(records) == 3 and cursor is None
+
+
+def test_malformed_cursor_raises_value_error(index):
+    with pytest.raises(ValueError):
+        index.page(cursor='not-a-cursor')
+
+
+def test_etag_changes_on_writes_only(index):
+    fill(index, 2)
+    etag = index.etag(50, None, None)
+    index.page(limit=50)
+    assert index.etag(50, None, None) == etag
+    assert index.etag(10, None, None) != etag
+
+    index.add('new.jpg', 'none', 1, 3000.0)
+    after_add = index.etag(50, None, None)
+    assert after_add != etag
+
+    assert index.remove('new.jpg')
+    assert index.etag(50, None, None) not in (etag, after_add)
+    assert not index.remove('new.jpg')
+
+
+def test_version_is_shared_between_instances(index, tmp_path):
+    other = PhotoIndex(index.db_path, index.uploads_dir)
+    fill(index, 1)
+    assert other.version() == index.version()
+    assert other.etag(50, None, None) == index.etag(50, None, None)
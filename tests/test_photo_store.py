@@ -0,0 +1,99 @@
+"""Tests for the content-addressed photo store and photo deletion"""
+
+import threading
+import time
+
+import pytest
+
+from services.photo_index import PhotoIndex
+from services.photo_store import FilesystemPhotoStore, PhotoStore, delete_photo
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FilesystemPhotoStore(str(tmp_path / 'store'))
+
+
+@pytest.fixture
+def index(tmp_path):
+    return PhotoIndex(str(tmp_path / 'index.sqlite3'), str(tmp_path / 'uploads'))
+
+
+def test_incomplete_backend_fails_when_created():
+    class ReadOnlyStore(PhotoStore):
+        def open(self, key):
+            raise FileNotFoundError(key)
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+
+def test_identical_captures_share_a_blob_until_both_are_deleted(store, index):
+    blob = store.put_bytes(b'same jpeg bytes')
+    assert store.put_bytes(b'same jpeg bytes') == blob
+    index.add('a.jpg', blob=blob, timestamp=1.0)
+    index.add('b.jpg', blob=blob, timestamp=2.0)
+
+    assert delete_photo(store, index, 'a.jpg')['blob'] == blob
+    assert store.exists(blob)
+    delete_photo(store, index, 'b.jpg')
+    assert not store.exists(blob)
+    assert delete_photo(store, index, 'b.jpg') is None
+
+
+def test_capture_racing_the_last_delete_keeps_its_blob(store, index):
+    data = b'identical capture'
+    blob = store.put_bytes(data)
+    index.add('old.jpg', blob=blob, timestamp=1.0)
+    stored = threading.Event()
+
+    def capture():
+        # Same steps as app._register_capture, with a pause where a
+        # delete could sneak in between put_bytes and the index insert
+        with index.blob_lock():
+            key = store.put_bytes(data)  # skipped: the blob exists
+            stored.set()
+            time.sleep(0.2)
+            index.add('new.jpg', blob=key, timestamp=2.0)
+
+    thread = threading.Thread(target=capture)
+    thread.start()
+    assert stored.wait(2)
+    delete_photo(store, index, 'old.jpg')
+    thread.join(5)
+
+    assert index.get('new.jpg')['blob'] == blob
+    assert store.exists(blob)
+
+
+def test_capture_during_the_last_delete_stores_the_blob_again(tmp_path, index):
+    deleting = threading.Event()
+
+    class SlowDeleteStore(FilesystemPhotoStore):
+        def delete(self, key):
+            deleting.set()
+            time.sleep(0.2)
+            return super().delete(key)
+
+    store = SlowDeleteStore(str(tmp_path / 'store'))
+    data = b'identical capture'
+    blob = store.put_bytes(data)
+    index.add('old.jpg', blob=blob, timestamp=1.0)
+    thread = threading.Thread(target=delete_photo, args=(store, index, 'old.jpg'))
+    thread.start()
+    assert deleting.wait(2)
+    with index.blob_lock():
+        key = store.put_bytes(data)
+        index.add('new.jpg', blob=key, timestamp=2.0)
+    thread.join(5)
+
+    assert store.exists(blob)
+
+
+def test_capture_and_delete_through_the_api(client, jpeg):
+    first = client.post('/api/capture-photo/stream?mask=vader-mask', data=jpeg, content_type='image/jpeg')
+    second = client.post('/api/capture-photo/stream?mask=vader-mask', data=jpeg, content_type='image/jpeg')
+    assert first.status_code == second.status_code == 200
+    assert client.delete(f"/api/delete-photo/{first.get_json()['filename']}").status_code == 200
+    download = client.get(second.get_json()['url'])
+    assert download.status_code == 200 and download.data == jpeg
@@ -0,0 +1,89 @@
+"""Tests for live previews: latest frame wins, stale frames and FPS throttling"""
+
+import re
+import threading
+import time
+
+from services.preview_service import PreviewService, PreviewSession
+
+
+def echo(frame_bytes, mask_id, face_data):
+    return frame_bytes
+
+
+def part_seq(part):
+    return int(re.search(rb'X-Frame-Seq: (\d+)', part).group(1))
+
+
+def test_a_new_frame_replaces_the_pending_one():
+    session = PreviewSession('s')
+    assert session.push(b'1') == (1, False)
+    assert session.push(b'2') == (2, True)
+    assert session.push(b'3', mask_id='vader-mask') == (3, True)
+
+    seq, frame_bytes, mask_id, _, _ = session.take(timeout=0)
+    assert (seq, frame_bytes, mask_id) == (3, b'3', 'vader-mask')
+    assert session.take(timeout=0) is None
+    assert session.counters['received'] == 3 and session.counters['dropped'] == 2
+
+
+def test_stream_emits_only_the_newest_frame_at_the_target_fps():
+    service = PreviewService(echo, max_fps=10)
+    session = service.create_session()
+    stream = service.stream(session)
+    for i in range(5):
+        session.push(b'frame-%d' % i)
+
+    first = next(stream)
+    assert part_seq(first) == 5 and first.endswith(b'frame-4\r\n')
+    started = time.monotonic()
+    # Frames pushed faster than 10 FPS: only the last one is rendered
+    for i in range(5, 9):
+        session.push(b'frame-%d' % i)
+    second = next(stream)
+    assert part_seq(second) == 9 and second.endswith(b'frame-8\r\n')
+    assert time.monotonic() - started >= 0.09
+
+    stream.close()
+    stats = session.stats()
+    assert stats['rendered'] == 2 and stats['dropped'] == 7 and stats['received'] == 9
+    assert not stats['streaming']
+
+
+def test_fast_pushes_are_throttled_and_counted_as_dropped():
+    service = PreviewService(echo, max_fps=20)
+    session = service.create_session()
+    stop = threading.Event()
+
+    def push():
+        while not stop.is_set():
+            session.push(b'frame')
+            time.sleep(0.002)
+    pusher = threading.Thread(target=push)
+    pusher.start()
+    seqs = []
+    started = time.monotonic()
+    try:
+        for part in service.stream(session):
+            seqs.append(part_seq(part))
+            if time.monotonic() - started > 0.5:
+                break
+    finally:
+        stop.set()
+        pusher.join()
+
+    elapsed = time.monotonic() - started
+    assert len(seqs) <= elapsed * 20 + 2
+    assert seqs == sorted(set(seqs))
+    assert session.counters['dropped'] > len(seqs)
+    assert service.stats()['dropped'] == session.counters['dropped']
+
+
+def test_stale_frames_are_skipped():
+    service = PreviewService(echo, max_frame_age=0.01)
+    session = service.create_session()
+    session.push(b'old')
+    time.sleep(0.05)
+    threading.Timer(0.2, session.close).start()
+    assert list(service.stream(session)) == []
+    assert session.counters['stale'] == 1 and session.counters['rendered'] == 0
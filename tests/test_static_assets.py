@@ -0,0 +1,45 @@
+"""Tests for the fingerprinted static asset manifest"""
+
+import pytest
+
+from services import static_assets
+from services.static_assets import StaticAssets
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    root = tmp_path / 'static'
+    (root / 'js').mkdir(parents=True)
+    (root / 'js' / 'main.js').write_text('function hello() { return "hello"; }\n' * 200)
+    (root / 'logo.png').write_bytes(b'\x89PNG' + bytes(100))
+    return root
+
+
+def test_runtime_build_hashes_without_compressing(static_dir, tmp_path):
+    assets = StaticAssets(str(static_dir), str(tmp_path / 'build'))
+    entry = assets.entry('js/main.js')
+    assert entry['fingerprinted'].startswith('js/main.') and entry['encodings'] == []
+    assert assets.resolve(entry['fingerprinted'])[0] == 'js/main.js'
+    assert not list((tmp_path / 'build').rglob('*.gz'))
+
+
+def test_deploy_build_is_reused_without_rehashing(static_dir, tmp_path, monkeypatch):
+    build_dir = str(tmp_path / 'build')
+    StaticAssets(str(static_dir), build_dir).build(precompress=True)
+
+    def no_hashing(path):
+        raise AssertionError(f'rehashed {path}')
+    monkeypatch.setattr(static_assets, '_file_sha256', no_hashing)
+    assets = StaticAssets(str(static_dir), build_dir)
+    assert 'gzip' in assets.entry('js/main.js')['encodings']
+    assert assets.entry('logo.png')['encodings'] == []
+
+
+def test_unwritable_compressed_copy_keeps_the_fingerprint(static_dir, tmp_path, monkeypatch):
+    def read_only(path, data):
+        raise OSError(30, 'Read-only file system')
+    monkeypatch.setattr(static_assets, '_write_atomic', read_only)
+    assets = StaticAssets(str(static_dir), str(tmp_path / 'build'), precompress=True)
+    entry = assets.entry('js/main.js')
+    assert entry is not None and entry['encodings'] == []
+    assert assets.url('js/main.js') == '/assets/' + entry['fingerprinted']